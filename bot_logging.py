@@ -0,0 +1,99 @@
+"""Логування бота: рівні, логер на компонент, семплінг частих подій і неблокуючий вивід.
+
+Записи кладуться в чергу (QueueHandler) і пишуться в stdout окремим потоком (QueueListener),
+тож event loop не чекає на запис у консоль.
+
+Змінні середовища:
+    LOG_LEVEL=INFO                      — загальний рівень
+    LOG_LEVELS=avg=DEBUG,vip_job=WARNING — рівні для окремих компонентів
+    LOG_SAMPLE_EVERY=20                 — для семплованих подій писати кожну N-ту
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+ROOT_LOGGER = 'nzbot'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(name)s] %(message)s'
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '20'))
+
+# Передається як extra=SAMPLED: подія з одного місця коду пишеться раз на LOG_SAMPLE_EVERY
+SAMPLED = {'sample_every': LOG_SAMPLE_EVERY}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускає кожен N-й запис з однакового місця виклику (записи з extra sample_every)"""
+
+    def __init__(self):
+        super().__init__()
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        every = getattr(record, 'sample_every', None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self._lock:
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+        if n % every:
+            return False
+        if n:
+            record.msg = f"{record.msg} [sampled 1/{every}]"
+        return True
+
+
+def get_logger(component: str) -> logging.Logger:
+    """Логер компонента: nzbot.<component>"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{component}")
+
+
+def _parse_levels(spec: str) -> dict:
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = None, stream=None):
+    """Налаштовує логування один раз; повторні виклики нічого не роблять"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+        for component, component_level in _parse_levels(os.getenv('LOG_LEVELS', '')).items():
+            get_logger(component).setLevel(component_level)
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        # Семплінг до черги: відкинуті записи не форматуються і не потрапляють у потік виводу
+        queue_handler.addFilter(SamplingFilter())
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописує чергу та зупиняє потік виводу"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
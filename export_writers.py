@@ -0,0 +1,87 @@
+"""Потоковий експорт оцінок у CSV, JSON Lines і XLSX.
+
+Рядки надходять генератором (з курсора БД) і одразу пишуться у файл; файл тримається в пам'яті
+лише до SPOOL_MAX_SIZE, далі — на диску (SpooledTemporaryFile).
+"""
+import csv
+import io
+import json
+import tempfile
+
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except Exception:
+    Workbook = None
+    OPENPYXL_AVAILABLE = False
+
+SPOOL_MAX_SIZE = 1 << 20
+
+# Ключі JSON Lines та заголовок таблиць (CSV/XLSX)
+COLUMNS = ('subject', 'date', 'mark', 'value', 'absent', 'kind')
+HEADER = ('Предмет', 'Дата', 'Оцінка', 'Бал', 'Відсутність', 'Тип')
+
+FORMAT_LABELS = {'csv': 'CSV', 'jsonl': 'JSON Lines', 'xlsx': 'Excel (XLSX)'}
+
+
+def export_rows(marks):
+    """(subject, Mark) -> кортежі у порядку COLUMNS"""
+    for subject, mark in marks:
+        yield subject, mark.date or '', mark.raw, mark.value, bool(mark.absent), mark.kind or ''
+
+
+def write_csv(rows, out):
+    # utf-8-sig: Excel інакше не розпізнає кирилицю
+    text = io.TextIOWrapper(out, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_jsonl(rows, out):
+    count = 0
+    for row in rows:
+        out.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False).encode('utf-8'))
+        out.write(b'\n')
+        count += 1
+    return count
+
+
+def write_xlsx(rows, out):
+    # write_only: рядки не накопичуються в об'єктній моделі книги
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Оцінки')
+    ws.append(list(HEADER))
+    count = 0
+    for row in rows:
+        ws.append(list(row))
+        count += 1
+    wb.save(out)
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'xlsx': write_xlsx}
+
+
+def available_formats() -> list:
+    return [fmt for fmt in WRITERS if fmt != 'xlsx' or OPENPYXL_AVAILABLE]
+
+
+def export_to_file(rows, fmt: str):
+    """Пише рядки у тимчасовий файл; повертає (file, count), файл перемотано на початок"""
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        count = WRITERS[fmt](rows, out)
+    except Exception:
+        out.close()
+        raise
+    out.seek(0)
+    return out, count
@@ -0,0 +1,45 @@
+import base64
+import os
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Формат v2: "v2:" + urlsafe_b64(nonce(12) + ciphertext + tag(16)), AES-256-GCM
+V2_PREFIX = 'v2:'
+_NONCE_SIZE = 12
+# Fernet-токени завжди починаються з версії 0x80 -> "gAAAAA" у base64
+_FERNET_PREFIX = 'gAAAAA'
+_HKDF_INFO = b'nz-bot field encryption v2'
+
+
+class FieldCipher:
+    """Шифрування полів сесії: пише v2 (AES-GCM), читає v2 та старий Fernet"""
+
+    def __init__(self, key: bytes):
+        self._fernet = Fernet(key)
+        # Окремий ключ для GCM виводимо з того ж файлу ключа, щоб не міняти його формат
+        raw = base64.urlsafe_b64decode(key)
+        aes_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=_HKDF_INFO).derive(raw)
+        self._aesgcm = AESGCM(aes_key)
+
+    def encrypt(self, data: str) -> str:
+        nonce = os.urandom(_NONCE_SIZE)
+        blob = nonce + self._aesgcm.encrypt(nonce, data.encode(), None)
+        return V2_PREFIX + base64.urlsafe_b64encode(blob).decode()
+
+    def decrypt(self, data: str) -> str:
+        """Дешифрує значення будь-якого підтримуваного формату; при пошкодженні кидає виняток"""
+        if data.startswith(V2_PREFIX):
+            blob = base64.urlsafe_b64decode(data[len(V2_PREFIX):])
+            return self._aesgcm.decrypt(blob[:_NONCE_SIZE], blob[_NONCE_SIZE:], None).decode()
+        if data.startswith(_FERNET_PREFIX):
+            return self._fernet.decrypt(data.encode()).decode()
+        # Рядки, збережені до появи шифрування
+        return data
+
+    @staticmethod
+    def needs_migration(data: str) -> bool:
+        """True, якщо значення треба перешифрувати у v2"""
+        return not data.startswith(V2_PREFIX)
@@ -0,0 +1,116 @@
+"""Тренди та прогноз оцінок за поточний семестр.
+
+Ряди оцінок кладуться в одну матрицю (рядок — предмет учня, доповнення NaN), і всі величини
+рахуються векторно по рядках: так само швидко для одного учня, як і для всіх VIP у нічному пакеті.
+Без numpy NUMPY_AVAILABLE = False, і тренди не показуються.
+"""
+import math
+import os
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Ковзне середнє — за останні TREND_WINDOW оцінок; нахил рахується від TREND_MIN_MARKS оцінок
+TREND_WINDOW = int(os.getenv('TREND_WINDOW', '5'))
+TREND_MIN_MARKS = int(os.getenv('TREND_MIN_MARKS', '3'))
+MAX_MARK = 12.0
+DAYS_PER_MONTH = 30.0
+
+
+class SubjectTrend(NamedTuple):
+    count: int
+    mean: float
+    moving_avg: float               # середнє останніх TREND_WINDOW оцінок
+    slope: Optional[float]          # зміна балу за місяць (лінійна регресія), None — замало оцінок
+    projection: float               # очікуваний середній на кінець семестру
+    target: Optional[int]           # наступний цілий бал над поточним середнім
+    needed: Optional[int]           # скільки оцінок 12 потрібно для target (None — недосяжно)
+
+
+def semester_bounds(today: date):
+    """(початок, кінець) поточного семестру; влітку (червень–серпень) — минулий другий семестр
+
+    >>> semester_bounds(date(2026, 8, 20))
+    (datetime.date(2026, 1, 1), datetime.date(2026, 5, 31))
+    >>> semester_bounds(date(2026, 9, 1))
+    (datetime.date(2026, 9, 1), datetime.date(2026, 12, 31))
+    """
+    if today.month >= 9:
+        return date(today.year, 9, 1), date(today.year, 12, 31)
+    return date(today.year, 1, 1), date(today.year, 5, 31)
+
+
+def compute_trends(series: dict, today: date = None) -> dict:
+    """{key: [(date_iso, value), ...]} -> {key: SubjectTrend} для оцінок поточного семестру.
+
+    key — будь-який (предмет або (учень, предмет)); ряди без оцінок у семестрі пропускаються.
+    """
+    today = today or date.today()
+    sem_start, sem_end = semester_bounds(today)
+    start_iso, today_iso = sem_start.isoformat(), today.isoformat()
+    rows = {}
+    for key, marks in series.items():
+        kept = [(d, v) for d, v in marks if d and start_iso <= d <= today_iso and v is not None]
+        if kept:
+            rows[key] = kept
+    if not rows:
+        return {}
+
+    keys = list(rows)
+    width = max(len(r) for r in rows.values())
+    xs = np.full((len(keys), width), np.nan)
+    ys = np.full((len(keys), width), np.nan)
+    for i, key in enumerate(keys):
+        kept = rows[key]
+        xs[i, :len(kept)] = [(datetime.strptime(d, '%Y-%m-%d').date() - sem_start).days for d, _ in kept]
+        ys[i, :len(kept)] = [v for _, v in kept]
+
+    mask = ~np.isnan(ys)
+    n = mask.sum(axis=1)
+    y0 = np.where(mask, ys, 0.0)
+    total = y0.sum(axis=1)
+    mean = total / n
+
+    # Рядки заповнені зліва в порядку дат, тож останні TREND_WINDOW оцінок — позиції [n - W, n)
+    window = mask & (np.arange(width) >= (n - TREND_WINDOW)[:, None])
+    moving = np.where(window, ys, 0.0).sum(axis=1) / window.sum(axis=1)
+
+    x_mean = np.where(mask, xs, 0.0).sum(axis=1) / n
+    dx = np.where(mask, xs - x_mean[:, None], 0.0)
+    dy = np.where(mask, ys - mean[:, None], 0.0)
+    sxx = (dx * dx).sum(axis=1)
+    fit = (n >= TREND_MIN_MARKS) & (sxx > 0)
+    slope = np.where(fit, (dx * dy).sum(axis=1) / np.where(sxx > 0, sxx, 1.0), np.nan)
+    intercept = mean - np.nan_to_num(slope) * x_mean
+
+    # Прогноз: оцінок до кінця семестру стільки ж на день, як досі, а їх значення — на лінії тренду
+    # (без тренду — на рівні ковзного середнього)
+    elapsed = max((today - sem_start).days, 1)
+    remaining = max((sem_end - today).days, 0)
+    future = n / elapsed * remaining
+    midpoint = elapsed + remaining / 2
+    future_value = np.clip(np.where(fit, intercept + slope * midpoint, moving), 1.0, MAX_MARK)
+    projection = np.clip((total + future * future_value) / (n + future), 1.0, MAX_MARK)
+
+    # Скільки оцінок 12 підтягнуть середній до наступного цілого: (S + 12k) / (n + k) >= target
+    target = np.floor(mean) + 1
+    reachable = target < MAX_MARK
+    needed = np.where(reachable, np.ceil((target * n - total) / np.where(reachable, MAX_MARK - target, 1.0)), np.nan)
+
+    trends = {}
+    for i, key in enumerate(keys):
+        has_target = target[i] <= MAX_MARK
+        trends[key] = SubjectTrend(
+            int(n[i]), float(mean[i]), float(moving[i]),
+            None if math.isnan(slope[i]) else float(slope[i] * DAYS_PER_MONTH),
+            float(projection[i]),
+            int(target[i]) if has_target else None,
+            None if math.isnan(needed[i]) else max(int(needed[i]), 1),
+        )
+    return trends
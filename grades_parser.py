@@ -0,0 +1,317 @@
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+from bot_logging import get_logger
+from marks import parse_mark
+
+log = get_logger('grades_parser')
+
+# lxml будує дерево в рази швидше за html.parser; використовуємо, якщо встановлений
+try:
+    import lxml  # noqa: F401
+    TREE_BUILDER = 'lxml'
+except Exception:
+    TREE_BUILDER = 'html.parser'
+
+_RANGE_RE = re.compile(r"Оберіть діапазон дат:\s*(\d{4}-\d{2}-\d{2})\s*по\s*(\d{4}-\d{2}-\d{2})")
+_TWO_DATES_RE = re.compile(r"(\d{4}-\d{2}-\d{2}).{0,40}(\d{4}-\d{2}-\d{2})")
+_TEXT_ROW_RE = re.compile(r'^\s*(\d+)\s+([^\t\n\r\d].*?)\s{2,}(.+)$')
+_FLEXIBLE_ROW_RE = re.compile(r'^\s*(\d+)[\.\)\s]+(.+?)\s+([\d\s,НПВ\-]+)$')
+_COMMA_SPLIT_RE = re.compile(r",\s*")
+_FLEXIBLE_SPLIT_RE = re.compile(r"[,;\s]+")
+
+
+def split_marks_cell(marks_raw: str) -> list[str]:
+    """Ділить вміст клітинки оцінок по комах, не розриваючи дужки"""
+    tokens_raw = []
+    current_token = ""
+    paren_depth = 0
+    for char in marks_raw:
+        if char == '(':
+            paren_depth += 1
+        elif char == ')':
+            paren_depth -= 1
+        elif char == ',' and paren_depth == 0:
+            if current_token.strip():
+                tokens_raw.append(current_token.strip())
+            current_token = ""
+            continue
+        current_token += char
+    if current_token.strip():
+        tokens_raw.append(current_token.strip())
+    return tokens_raw
+
+
+def _date_inputs(soup):
+    """Значення полів date_from / date_to з форми фільтра"""
+    start_date = end_date = None
+    try:
+        df = soup.find('input', attrs={'name': 'date_from'}) or soup.find(id='classselectform-date_from')
+        dt = soup.find('input', attrs={'name': 'date_to'}) or soup.find(id='classselectform-date_to')
+        if df and df.get('value'):
+            start_date = df.get('value')
+            log.debug("Found start_date from input: %s", start_date)
+        if dt and dt.get('value'):
+            end_date = dt.get('value')
+            log.debug("Found end_date from input: %s", end_date)
+    except Exception as e:
+        log.warning("Error reading date inputs: %s", e)
+    return start_date, end_date
+
+
+def _subjects_from_text_lines(text: str) -> dict:
+    subjects = {}
+    if 'Виписка оцінок' not in text and 'Отримані результати' not in text:
+        return subjects
+    lines = text.splitlines()
+    log.debug("Processing %s lines from text", len(lines))
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        m = _TEXT_ROW_RE.match(line)
+        if not m:
+            parts = line.split('\t')
+            if len(parts) >= 3 and parts[0].strip().isdigit():
+                subj = parts[1].strip()
+                marks_raw = parts[2].strip()
+            else:
+                continue
+        else:
+            subj = m.group(2).strip()
+            marks_raw = m.group(3).strip()
+
+        tokens = [parse_mark(t) for t in (t.strip() for t in _COMMA_SPLIT_RE.split(marks_raw)) if t]
+        if tokens:
+            subjects[subj] = tokens
+            log.debug("Found subject: %s with %s marks", subj, len(tokens))
+    return subjects
+
+
+def _subjects_from_tables(soup) -> dict:
+    subjects = {}
+    marks_table = soup.find('table', class_='marks-report')
+    if not marks_table:
+        tables = soup.find_all('table')
+        log.debug("Found %s tables in HTML (no marks-report table)", len(tables))
+    else:
+        tables = [marks_table]
+        log.debug("Found marks-report table")
+
+    for table in tables:
+        rows = table.select('tbody tr') if table.select('tbody') else table.select('tr')
+        log.debug("Processing table with %s rows", len(rows))
+        row_count = 0
+        for tr in rows:
+            tds = tr.find_all('td')
+            if len(tds) < 3:
+                continue
+            num_text = tds[0].get_text(' ', strip=True)
+            subj = tds[1].get_text(' ', strip=True)
+            marks_raw = tds[2].get_text(' ', strip=True)
+
+            # Пропускаємо заголовок і порожні рядки
+            if not num_text.strip().isdigit() or not subj:
+                continue
+            if not marks_raw.strip():
+                log.debug("Skipping subject '%s' - no marks", subj)
+                continue
+            row_count += 1
+
+            tokens = [parse_mark(t) for t in split_marks_cell(marks_raw)]
+            if tokens:
+                subjects[subj] = tokens
+                log.debug("Found subject in table: %s with %s marks", subj, len(tokens))
+
+        log.debug("Processed %s data rows from table", row_count)
+    return subjects
+
+
+def _subjects_flexible(text: str) -> dict:
+    subjects = {}
+    log.debug("Trying flexible parsing, text length: %s", len(text))
+    for line in text.splitlines():
+        m = _FLEXIBLE_ROW_RE.match(line.strip())
+        if not m:
+            continue
+        _num, subj, marks_raw = m.groups()
+        tokens = [parse_mark(t) for t in (t.strip() for t in _FLEXIBLE_SPLIT_RE.split(marks_raw)) if t and t != '-']
+        if tokens and subj.strip():
+            subjects[subj.strip()] = tokens
+            log.debug("Found subject (flexible): %s with %s marks", subj.strip(), len(tokens))
+    return subjects
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _UnexpectedStructure(Exception):
+    pass
+
+
+class MarksReportParser(HTMLParser):
+    """Потоковий розбір table.marks-report без побудови DOM.
+
+    Тримає в пам'яті лише поточний рядок таблиці, зупиняється на </table>.
+    Кидає _UnexpectedStructure, якщо розмітка не схожа на звичну (тоді працює BeautifulSoup).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.start_date = None
+        self.end_date = None
+        self.subjects = {}
+        self.found_table = False
+        self._pre_text = []
+        self._in_table = False
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._in_table:
+            if tag == 'table':
+                raise _UnexpectedStructure('nested table')
+            if tag == 'tr':
+                self._finish_row()
+                self._row = []
+            elif tag in ('td', 'th'):
+                if self._row is None:
+                    raise _UnexpectedStructure('cell outside of row')
+                self._finish_cell()
+                self._cell = [] if tag == 'td' else None
+                if tag == 'th':
+                    self._row.append(None)
+            return
+        if tag == 'input':
+            a = dict(attrs)
+            keys, value = (a.get('name'), a.get('id')), a.get('value')
+            if value and not self.start_date and ('date_from' in keys or 'classselectform-date_from' in keys):
+                self.start_date = value
+            elif value and not self.end_date and ('date_to' in keys or 'classselectform-date_to' in keys):
+                self.end_date = value
+        elif tag == 'table':
+            classes = (dict(attrs).get('class') or '').split()
+            if 'marks-report' in classes:
+                self._in_table = True
+                self.found_table = True
+
+    def handle_endtag(self, tag):
+        if not self._in_table:
+            return
+        if tag in ('td', 'th'):
+            self._finish_cell()
+        elif tag == 'tr':
+            self._finish_row()
+        elif tag == 'table':
+            self._finish_row()
+            raise _StopParsing
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        elif not self._in_table and not self.found_table:
+            data = data.strip()
+            if data:
+                self._pre_text.append(data)
+
+    def _finish_cell(self):
+        if self._cell is not None:
+            self._row.append(' '.join(t for t in (d.strip() for d in self._cell) if t))
+        self._cell = None
+
+    def _finish_row(self):
+        self._finish_cell()
+        row, self._row = self._row, None
+        if not row or len(row) < 3 or None in row[:3]:
+            return
+        num_text, subj, marks_raw = row[0], row[1], row[2]
+        if not num_text.isdigit() or not subj or not marks_raw:
+            return
+        tokens = [parse_mark(t) for t in split_marks_cell(marks_raw)]
+        if tokens:
+            self.subjects[subj] = tokens
+
+    @property
+    def pre_text(self) -> str:
+        return "\n".join(self._pre_text)
+
+
+def _parse_marks_report_fast(html: str):
+    """Швидкий шлях: (start_date, end_date, subjects) або None, якщо треба повний DOM"""
+    if 'marks-report' not in html:
+        return None
+    parser = MarksReportParser()
+    try:
+        parser.feed(html)
+        parser.close()
+        log.debug("Fast path: marks-report table is not closed")
+        return None
+    except _StopParsing:
+        pass
+    except _UnexpectedStructure as e:
+        log.info("Fast path bailed out: %s", e)
+        return None
+    except Exception as e:
+        log.warning("Fast path error: %s", e)
+        return None
+    if not parser.found_table or not parser.subjects:
+        return None
+    start_date, end_date = parser.start_date, parser.end_date
+    if not start_date:
+        m = _RANGE_RE.search(parser.pre_text) or _TWO_DATES_RE.search(parser.pre_text)
+        if m:
+            start_date, end_date = m.group(1), m.group(2)
+    return start_date, end_date, parser.subjects
+
+
+def parse_grades_from_html(html: str):
+    """Парсить сторінку 'Виписка оцінок' і повертає (start_date, end_date, {subject: [Mark, ...]})
+
+    Спершу пробує потоковий розбір table.marks-report; якщо розмітка незвична,
+    дерево будується один раз, і всі стратегії (текст, таблиця, гнучкий розбір) працюють по ньому.
+    """
+    fast = _parse_marks_report_fast(html)
+    if fast is not None:
+        log.debug("Fast path: %s subjects found", len(fast[2]))
+        return fast
+
+    soup = None
+    start_date = end_date = None
+    try:
+        soup = BeautifulSoup(html, TREE_BUILDER)
+        text = soup.get_text("\n", strip=True)
+        start_date, end_date = _date_inputs(soup)
+    except Exception as e:
+        log.warning("Could not build DOM, using raw text: %s", e)
+        text = html
+
+    if not start_date:
+        m = _RANGE_RE.search(text) or _TWO_DATES_RE.search(text)
+        if m:
+            start_date, end_date = m.group(1), m.group(2)
+
+    subjects = {}
+    try:
+        subjects = _subjects_from_text_lines(text)
+    except Exception as e:
+        log.warning("Error parsing text lines: %s", e)
+
+    if not subjects and soup is not None:
+        try:
+            subjects = _subjects_from_tables(soup)
+        except Exception as e:
+            log.exception("Error parsing HTML tables: %s", e)
+
+    if not subjects:
+        try:
+            subjects = _subjects_flexible(text)
+        except Exception as e:
+            log.warning("Error in flexible parsing: %s", e)
+
+    if soup is not None:
+        soup.decompose()
+    log.debug("Final result: %s subjects found", len(subjects))
+    return start_date, end_date, subjects
@@ -0,0 +1,91 @@
+import html
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin
+
+from bot_logging import get_logger
+
+log = get_logger('login_form')
+
+LOGIN_URL = "https://nz.ua/login"
+
+# Скануємо лише теги meta/input/form у сирих байтах, без побудови DOM
+_TAG_RE = re.compile(rb'<(meta|input|form)\b([^>]*)>', re.IGNORECASE)
+_ATTR_RE = re.compile(rb'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+
+
+class LoginForm(NamedTuple):
+    csrf: Optional[str]
+    action: Optional[str]
+
+
+def _attrs(raw: bytes) -> dict:
+    out = {}
+    for m in _ATTR_RE.finditer(raw):
+        value = m.group(2) if m.group(2) is not None else m.group(3) if m.group(3) is not None else m.group(4)
+        out.setdefault(m.group(1).lower(), value)
+    return out
+
+
+def _text(value: Optional[bytes]) -> Optional[str]:
+    return html.unescape(value.decode('utf-8', errors='replace')) if value else None
+
+
+def _scan(data: bytes):
+    meta_csrf = input_csrf = None
+    first_action = login_action = current_action = None
+    for m in _TAG_RE.finditer(data):
+        tag = m.group(1).lower()
+        attrs = _attrs(m.group(2))
+        if tag == b'meta':
+            if attrs.get(b'name') == b'csrf-token' and meta_csrf is None:
+                meta_csrf = attrs.get(b'content')
+        elif tag == b'form':
+            current_action = attrs.get(b'action', b'')
+            if first_action is None:
+                first_action = current_action
+        else:
+            name = attrs.get(b'name') or b''
+            if name == b'_csrf' and attrs.get(b'value') and input_csrf is None:
+                input_csrf = attrs.get(b'value')
+            if (name == b'_csrf' or name.startswith(b'LoginForm[')) and current_action is not None:
+                login_action = current_action
+            if input_csrf is not None and login_action is not None:
+                break
+    action = login_action if login_action is not None else first_action
+    # Прихований _csrf форми має пріоритет над meta, як і раніше
+    return _text(input_csrf or meta_csrf), _text(action)
+
+
+def _parse_with_soup(data: bytes):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(data, 'html.parser')
+    csrf = None
+    meta_csrf = soup.find('meta', attrs={'name': 'csrf-token'})
+    if meta_csrf:
+        csrf = meta_csrf.get('content')
+    hidden_csrf = soup.find('input', {'name': '_csrf'})
+    if hidden_csrf and hidden_csrf.get('value'):
+        csrf = hidden_csrf.get('value')
+    form = hidden_csrf.find_parent('form') if hidden_csrf else None
+    form = form or soup.find('form')
+    return csrf, form.get('action') if form else None
+
+
+def extract_login_form(page, base_url: str = LOGIN_URL) -> LoginForm:
+    """CSRF-токен і action форми логіну зі сторінки (bytes або str).
+
+    Спершу швидке сканування тегів; якщо токен не знайдено, а сторінка його згадує — повний розбір.
+    """
+    data = page.encode('utf-8') if isinstance(page, str) else (page or b'')
+    try:
+        csrf, action = _scan(data)
+    except Exception as e:
+        log.warning("Scan failed, using full parse: %s", e)
+        csrf, action = None, None
+    if csrf is None and b'csrf' in data:
+        try:
+            csrf, action = _parse_with_soup(data)
+        except Exception as e:
+            log.warning("Full parse failed: %s", e)
+    return LoginForm(csrf, urljoin(base_url, action) if action else base_url)
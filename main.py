@@ -4,7 +4,7 @@ import os
 import requests
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from datetime import datetime, timedelta
@@ -23,12 +23,19 @@ import json
 import re
 import base64
 import hashlib
+import codecs
 from urllib.parse import urljoin, urlparse
 import html
 import time
 import threading
 import asyncio
 import gc
+import heapq
+from collections import Counter, OrderedDict, deque
+from typing import NamedTuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 
 # Optional, lightweight memory metrics (if available)
 try:
@@ -37,12 +44,48 @@ except Exception:
     psutil = None
 
 from report_card_parser import parse_report_card
+from grades_parser import parse_grades_from_html
+from marks import Mark, to_mark
+from login_form import extract_login_form
+from news_parser import count_news_items, parse_news_from_html, parse_news_page
+from report_pdf import render_report, report_payload
+from mark_stats import SubjectStats, school_year_of
+from grade_trends import NUMPY_AVAILABLE, compute_trends, semester_bounds
+from export_writers import FORMAT_LABELS, available_formats, export_rows, export_to_file
+from bot_logging import SAMPLED, get_logger, setup_logging
+
+# Логер на компонент: рівні налаштовуються через LOG_LEVEL / LOG_LEVELS (див. bot_logging.py);
+# обробники підключає setup_logging() у main() — процеси-воркери звітів імпортують цей модуль без них
+startup_log = get_logger('startup')
+db_log = get_logger('db')
+crypto_log = get_logger('crypto')
+mem_log = get_logger('mem')
+stats_log = get_logger('stats')
+vip_log = get_logger('vip')
+vip_job_log = get_logger('vip_job')
+vip_request_log = get_logger('vip_request')
+vip_pdf_log = get_logger('vip_pdf')
+broadcast_log = get_logger('broadcast')
+support_log = get_logger('support')
+admin_log = get_logger('admin')
+avg_log = get_logger('avg')
+grades_log = get_logger('grades')
+news_log = get_logger('news')
+schedule_log = get_logger('schedule')
+report_card_log = get_logger('report_card')
+msg_log = get_logger('msg')
+button_log = get_logger('button')
+callback_log = get_logger('callback')
+errors_log = get_logger('errors')
+ping_log = get_logger('ping')
 
 try:
     from cryptography.fernet import Fernet
+    from field_crypto import FieldCipher
     CRYPTO_AVAILABLE = True
 except Exception:
     Fernet = None
+    FieldCipher = None
     CRYPTO_AVAILABLE = False
 
 API_BASE = "https://api-mobile.nz.ua"
@@ -59,14 +102,71 @@ def get_scraper():
         except Exception:
             pass
 
+# Потокове завантаження HTML: читаємо тіло частинами й обриваємо з'єднання,
+# щойно потрібна секція сторінки закінчилась (пари (початок, кінець) секції)
+STREAM_CHUNK_SIZE = 16384
+GRADES_PAGE_MARKERS = (('marks-report', '</table>'),)
+NEWS_PAGE_MARKERS = (('school-news-list', 'Показано новин'), ('Мої новини', 'Показано новин'))
+REPORT_CARD_MARKERS = (('Табель', '</table>'),)
+
+
+class StreamedPage:
+    """Результат fetch_html_until: status_code, url, text та truncated (читання обірвано на маркері)"""
+    __slots__ = ('status_code', 'url', 'text', 'truncated')
+
+    def __init__(self, status_code, url, text, truncated):
+        self.status_code = status_code
+        self.url = url
+        self.text = text
+        self.truncated = truncated
+
+
+def fetch_html_until(scraper, url, markers, **kwargs) -> StreamedPage:
+    """GET зі стрімінгом: декодує тіло по ходу і зупиняється після кінцевого маркера секції"""
+    resp = scraper.get(url, stream=True, **kwargs)
+    try:
+        # requests підставляє ISO-8859-1 для text/html без charset; nz.ua віддає UTF-8
+        encoding = resp.encoding if resp.encoding and resp.encoding.lower() != 'iso-8859-1' else 'utf-8'
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        overlap = max(len(m) for pair in markers for m in pair) - 1
+        started = [False] * len(markers)
+        parts = []
+        tail = ''
+        truncated = False
+        for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+            piece = decoder.decode(chunk)
+            if not piece:
+                continue
+            parts.append(piece)
+            window = tail + piece
+            for i, (start, end) in enumerate(markers):
+                search_from = 0
+                if not started[i]:
+                    pos = window.find(start)
+                    if pos == -1:
+                        continue
+                    started[i] = True
+                    search_from = pos + len(start)
+                if window.find(end, search_from) != -1:
+                    truncated = True
+                    break
+            if truncated:
+                break
+            tail = window[-overlap:] if overlap > 0 else ''
+        if not truncated:
+            parts.append(decoder.decode(b'', final=True))
+        return StreamedPage(resp.status_code, resp.url, ''.join(parts), truncated)
+    finally:
+        resp.close()
+
 # База даних
 # На Railway volume монтується на /data, локально використовуємо data/
 if os.path.isdir("/data"):
     DB_FILE = os.getenv("DB_FILE", "/data/nz_bot.db")
-    ENCRYPTION_KEY_FILE = "/data/bot_encryption.key"
+    ENCRYPTION_KEY_FILE = os.getenv("ENCRYPTION_KEY_FILE", "/data/bot_encryption.key")
 else:
     DB_FILE = os.getenv("DB_FILE", "data/nz_bot.db")
-    ENCRYPTION_KEY_FILE = "data/bot_encryption.key"
+    ENCRYPTION_KEY_FILE = os.getenv("ENCRYPTION_KEY_FILE", "data/bot_encryption.key")
 # Власник / основний адмін (можна задати через змінну середовища OWNER_ID)
 OWNER_ID = int(os.getenv("OWNER_ID", "1716175980"))
 
@@ -89,33 +189,53 @@ def get_encryption_key():
             f.write(key)
         return key
 
-ENCRYPTION_KEY = get_encryption_key()
-cipher_suite = Fernet(ENCRYPTION_KEY) if CRYPTO_AVAILABLE and ENCRYPTION_KEY else None
+_cipher_suite = None
+_cipher_lock = threading.Lock()
+
+def get_cipher():
+    """FieldCipher або None без cryptography; ключ читається (чи створюється) при першому зверненні,
+    а не під час імпорту — процеси-воркери звітів імпортують main.py і не мають чіпати файл ключа"""
+    global _cipher_suite
+    if _cipher_suite is None and CRYPTO_AVAILABLE:
+        with _cipher_lock:
+            if _cipher_suite is None:
+                key = get_encryption_key()
+                if key:
+                    _cipher_suite = FieldCipher(key)
+    return _cipher_suite
 
 def encrypt_data(data: str) -> str:
-    """Шифрує дані"""
-    if cipher_suite:
-        return cipher_suite.encrypt(data.encode()).decode()
+    """Шифрує дані (формат v2, AES-GCM)"""
+    cipher = get_cipher()
+    if cipher:
+        return cipher.encrypt(data)
     return data
 
-def decrypt_data(data: str) -> str:
-    """Дешифрує дані"""
-    if cipher_suite:
+def decrypt_data(data: str):
+    """Дешифрує дані; None, якщо значення пошкоджене або ключ не підходить"""
+    cipher = get_cipher()
+    if cipher:
         try:
-            return cipher_suite.decrypt(data.encode()).decode()
-        except:
-            return data
+            return cipher.decrypt(data)
+        except Exception as e:
+            crypto_log.warning("Could not decrypt field: %s", type(e).__name__)
+            return None
     return data
 
+def field_needs_migration(data: str) -> bool:
+    """Чи збережене значення ще у старому форматі (Fernet або без шифрування)"""
+    cipher = get_cipher()
+    return bool(cipher) and cipher.needs_migration(data)
+
 # Константи
 WEEKDAYS = ['Понеділок', 'Вівторок', 'Середа', 'Четвер', "П'ятниця", 'Субота', 'Неділя']
 POLICY_TEXT = """📋 *Політика конфіденційності та умови використання*
 
 🔐 *Безпека даних:*
-• Всі ваші дані зберігаються у зашифрованому форматі
-• Логіни та паролі шифруються перед збереженням у базі даних
+• Логіни, паролі, токени та збережений табель шифруються перед збереженням у базі даних
+• Оцінки зберігаються в базі бота для середнього балу, аналітики та експорту — лише поки ви в боті
 • Бот не передає ваші особисті дані третім особам
-• Ви можете видалити всі дані командою /logout
+• Командою /logout ви видаляєте сесію, збережені оцінки, табель і кеші бота
 
 📱 *Використання:*
 • Бот працює з офіційним API NZ.UA
@@ -166,11 +286,61 @@ GRADES_LOOKBACK_DAYS = int(os.getenv("GRADES_LOOKBACK_DAYS", "30"))  # скол
 PING_URL = os.getenv("PING_URL")
 PING_INTERVAL = int(os.getenv("PING_INTERVAL", "600"))  # каждые N секунд слать пинг, по умолчанию 10 минут
 
-# Memory-safe broadcast parameters
+# Розсилка йде у фоні: не більше BROADCAST_RATE повідомлень на секунду на весь бот (ліміт Telegram ~30/с),
+# до BROADCAST_CONCURRENCY запитів одночасно; отримувачі читаються з БД по BROADCAST_BATCH_SIZE.
+# Кожен чат отримує одне повідомлення, тож ліміт на чат (~1/с) стосується лише статусу в чаті адміна,
+# який оновлюється раз на BROADCAST_PROGRESS_INTERVAL секунд
 BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '50'))
-BROADCAST_BATCH_PAUSE = float(os.getenv('BROADCAST_BATCH_PAUSE', '0.4'))  # seconds between batches
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '16'))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv('BROADCAST_MAX_ATTEMPTS', '5'))  # спроб на отримувача (RetryAfter, збої мережі)
 SCRAPER_TIMEOUT = float(os.getenv('SCRAPER_TIMEOUT', '10'))
 
+# Як часто перераховувати лічильники адмін-меню з нуля (секунди)
+STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', '3600'))
+
+# Розмір сторінки для адмінських списків (тикети, VIP, лог дій)
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '15'))
+
+# Кеш розшифрованих сесій (щоб не робити Fernet-дешифрування на кожен запит)
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '5000'))
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '900'))
+
+# Кеш налаштувань користувачів (VIP-налаштування та день з 8 уроками)
+PREFS_CACHE_SIZE = int(os.getenv('PREFS_CACHE_SIZE', '2048'))
+
+# Табель: відповідаємо з кешу, якщо йому не більше REPORT_CARD_MAX_AGE секунд,
+# і перевіряємо сайт у фоні, якщо кеш старший за REPORT_CARD_REVALIDATE_AFTER
+REPORT_CARD_MAX_AGE = int(os.getenv('REPORT_CARD_MAX_AGE', str(7 * 86400)))
+REPORT_CARD_REVALIDATE_AFTER = int(os.getenv('REPORT_CARD_REVALIDATE_AFTER', '600'))
+
+# Розклад і домашка кешуються на весь тиждень (Пн–Пт); старші за WEEK_CACHE_REFRESH_AFTER секунд
+# оновлюються у фоні, старші за WEEK_CACHE_MAX_AGE завантажуються заново
+WEEK_CACHE_REFRESH_AFTER = int(os.getenv('WEEK_CACHE_REFRESH_AFTER', '900'))
+WEEK_CACHE_MAX_AGE = int(os.getenv('WEEK_CACHE_MAX_AGE', str(6 * 3600)))
+
+# PDF-звіти рендеряться в окремих процесах; готові файли кешуються за хешем оцінок і періоду
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '1'))
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '64'))
+
+# Оцінки (API або HTML-виписка) кешуються на GRADES_CACHE_TTL секунд; HTML-виписка — до
+# GRADES_HTML_ATTEMPTS входів на сайт з паузою GRADES_RETRY_BACKOFF, що подвоюється після кожної спроби
+GRADES_CACHE_TTL = int(os.getenv('GRADES_CACHE_TTL', '300'))
+GRADES_HTML_ATTEMPTS = int(os.getenv('GRADES_HTML_ATTEMPTS', '4'))
+GRADES_RETRY_BACKOFF = float(os.getenv('GRADES_RETRY_BACKOFF', '1'))
+# Для кожного учня запам'ятовується джерело оцінок, що дало повні дані; раз на GRADE_SOURCE_REPROBE
+# секунд обидва джерела опитуються заново й порівнюються
+GRADE_SOURCE_REPROBE = int(os.getenv('GRADE_SOURCE_REPROBE', str(24 * 3600)))
+
+# Тренди оцінок для всіх VIP перераховуються щоночі о TREND_PREWARM_TIME (за Києвом)
+TREND_PREWARM_TIME = os.getenv('TREND_PREWARM_TIME', '03:30')
+# Кеш трендів (учнів); нічний пакет за потреби розширює його до кількості VIP
+TREND_CACHE_SIZE = int(os.getenv('TREND_CACHE_SIZE', '4096'))
+
+# Кеш відрендерених повідомлень (розклад, домашка, новини, аналітика) за хешем вхідних даних
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '2048'))
+
 
 def get_rss_mb():
     """Return RSS in MB (psutil if available, else /proc fallback)."""
@@ -190,11 +360,134 @@ def get_rss_mb():
 def log_memory(prefix=''):
     try:
         mb = get_rss_mb()
-        print(f"[MEM] {prefix} RSS={mb:.1f}MB")
+        mem_log.info("%s RSS=%.1fMB", prefix, mb)
     except Exception:
         pass
 
 
+class LRUCache:
+    """Потокобезпечний LRU-кеш з обмеженою кількістю записів та опційним TTL (секунди)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def discard_where(self, predicate) -> int:
+        """Видаляє записи, ключ яких задовольняє predicate; повертає їх кількість"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# digest -> текст; digest рахується з виду повідомлення, даних і налаштувань користувача
+_RENDER_CACHE = LRUCache(RENDER_CACHE_SIZE)
+# (chat_id, message_id) -> digest вмісту, який зараз показує повідомлення
+_SHOWN_DIGESTS = LRUCache(RENDER_CACHE_SIZE)
+
+
+def content_digest(*parts) -> str:
+    """Стабільний хеш даних (JSON з відсортованими ключами)"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+
+def render_cached(kind: str, render, *parts):
+    """Повертає (text, digest); render(*parts) викликається лише для даних, яких ще не бачили"""
+    digest = content_digest(kind, *parts)
+    text = _RENDER_CACHE.get(digest)
+    if text is None:
+        text = render(*parts)
+        _RENDER_CACHE.set(digest, text)
+    return text, digest
+
+
+def _message_key(message):
+    if message is None:
+        return None
+    return (message.chat_id, message.message_id)
+
+
+def _remember_shown(message, digest):
+    key = _message_key(message)
+    if key is None:
+        return
+    if digest is None:
+        _SHOWN_DIGESTS.pop(key)
+    else:
+        _SHOWN_DIGESTS.set(key, digest)
+
+
+async def edit_or_reply(target, text: str, digest: str = None, **kwargs):
+    """Редагує повідомлення callback-запиту або відповідає на команду.
+
+    Якщо повідомлення вже показує вміст з тим самим digest, редагування пропускається
+    (Telegram все одно відхилив би його як "message is not modified").
+    """
+    if not hasattr(target, 'edit_message_text'):
+        sent = await target.message.reply_text(text, **kwargs)
+        _remember_shown(sent, digest)
+        return sent
+    message = target.message
+    if digest is not None and _SHOWN_DIGESTS.get(_message_key(message)) == digest:
+        return message
+    try:
+        await target.edit_message_text(text, **kwargs)
+    except BadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+    _remember_shown(message, digest)
+    return message
+
+
 def iterate_user_ids_batch(cursor, batch_size=100):
     """Yield user ids from a cursor using fetchmany to avoid building large lists in memory."""
     while True:
@@ -235,10 +528,10 @@ def init_db():
         admin_note TEXT
     )''')
     
-    # Таблиця VIP-підписок
+    # Таблиця VIP-підписок (expires_at — unix epoch у секундах)
     c.execute('''CREATE TABLE IF NOT EXISTS vip_users (
         user_id INTEGER PRIMARY KEY,
-        expires_at TIMESTAMP NOT NULL,
+        expires_at INTEGER NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
 
@@ -306,6 +599,82 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
 
+    # Кеш табеля: хеш вмісту блоку табеля + розібраний і відрендерений результат (обидва зашифровані)
+    c.execute('''CREATE TABLE IF NOT EXISTS report_cards (
+        student_id TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        parsed TEXT,
+        rendered TEXT NOT NULL,
+        fetched_at INTEGER NOT NULL
+    )''')
+
+    # Локальне сховище оцінок (джерело для експорту й аналітики); рядки періоду замінюються при кожному
+    # завантаженні. Оцінки учня зберігаються, лише поки є сесія з ним (див. STUDENT_DATA_TABLES)
+    c.execute('''CREATE TABLE IF NOT EXISTS marks (
+        student_id TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        raw TEXT NOT NULL,
+        mark_date TEXT,
+        value REAL,
+        absent INTEGER NOT NULL DEFAULT 0,
+        kind TEXT,
+        fetched_at INTEGER NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_marks_student ON marks (student_id, subject, mark_date)')
+
+    # Агрегати оцінок по предмету за навчальний рік; оновлюються в store_marks, перераховуються rebuild_mark_stats
+    c.execute('''CREATE TABLE IF NOT EXISTS mark_stats (
+        student_id TEXT NOT NULL,
+        school_year TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        marks INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        min_value REAL,
+        max_value REAL,
+        absences INTEGER NOT NULL DEFAULT 0,
+        other TEXT,
+        last_marks TEXT,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (student_id, school_year, subject)
+    )''')
+
+    # Джерело оцінок (api/html), яке останнім дало повні дані для учня, і статистика влучань
+    c.execute('''CREATE TABLE IF NOT EXISTS grade_sources (
+        student_id TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        api_hits INTEGER NOT NULL DEFAULT 0,
+        api_tries INTEGER NOT NULL DEFAULT 0,
+        html_hits INTEGER NOT NULL DEFAULT 0,
+        html_tries INTEGER NOT NULL DEFAULT 0,
+        probed_at INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER NOT NULL
+    )''')
+
+    # Розсилки адміна; last_user_id — усі отримувачі з id до нього включно вже оброблені,
+    # тож розсилка зі status = 'running' після перезапуску продовжується з цього місця
+    c.execute('''CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        chat_id INTEGER,
+        message_id INTEGER,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    )''')
+
+    # Матеріалізовані лічильники для адмін-меню
+    c.execute('''CREATE TABLE IF NOT EXISTS bot_stats (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
     # Міграція: додати колонки до таблиці support_tickets, якщо їх немає
     c.execute("PRAGMA table_info(support_tickets)")
     cols = [r[1] for r in c.fetchall()]
@@ -318,14 +687,142 @@ def init_db():
         c.execute("ALTER TABLE support_tickets ADD COLUMN resolved_at TIMESTAMP")
     if 'admin_note' not in cols:
         c.execute("ALTER TABLE support_tickets ADD COLUMN admin_note TEXT")
+    # статус NULL трактувався як 'open' — нормалізуємо, щоб фільтр міг йти по індексу
+    c.execute("UPDATE support_tickets SET status = 'open' WHERE status IS NULL")
+
+    # Індекси для keyset-пагінації адмінських списків (created_at, id)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_support_tickets_created ON support_tickets (created_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_support_tickets_status_created ON support_tickets (status, created_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vip_requests_created ON vip_requests (created_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_admin_actions_created ON admin_actions (created_at, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vip_users_created ON vip_users (created_at, user_id)')
+
+    # Міграція: expires_at з ISO-рядків (naive та tz-aware вперемішку) у цілі epoch-секунди
+    c.execute("SELECT user_id, expires_at FROM vip_users WHERE typeof(expires_at) = 'text'")
+    migrated = 0
+    for uid, raw in c.fetchall():
+        expires = _parse_vip_expires(raw)
+        if expires is None:
+            db_log.warning("Dropping VIP row with unparseable expires_at: user=%s value=%r", uid, raw)
+            c.execute('DELETE FROM vip_users WHERE user_id = ?', (uid,))
+        else:
+            c.execute('UPDATE vip_users SET expires_at = ? WHERE user_id = ?', (int(expires.timestamp()), uid))
+            migrated += 1
+    if migrated:
+        db_log.info("Migrated %s VIP expiry values to epoch seconds", migrated)
+
+    # Індекси для діапазонних запитів за часом
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vip_users_expires ON vip_users (expires_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_reminders_sent_lookup ON reminders_sent (user_id, lesson_date, lesson_time)')
+
+    # Міграція: табелі, збережені до шифрування кешу табеля
+    c.execute('SELECT student_id, parsed, rendered FROM report_cards')
+    for sid, parsed, rendered in c.fetchall():
+        if field_needs_migration(rendered):
+            c.execute('UPDATE report_cards SET parsed = ?, rendered = ? WHERE student_id = ?',
+                      (encrypt_data(parsed) if parsed else parsed, encrypt_data(rendered), sid))
+
+    # Міграція: агрегати для оцінок, збережених до появи mark_stats
+    c.execute('SELECT EXISTS(SELECT 1 FROM marks) AND NOT EXISTS(SELECT 1 FROM mark_stats)')
+    needs_mark_stats = bool(c.fetchone()[0])
 
     conn.commit()
     conn.close()
+
+    if needs_mark_stats:
+        rows, _ = rebuild_mark_stats()
+        db_log.info("Built %s mark aggregates from stored marks", rows)
     
     if CRYPTO_AVAILABLE:
-        print(f"✅ База даних (SQLite) ініціалізована (з шифруванням)")
+        db_log.info("✅ База даних (SQLite) ініціалізована (з шифруванням)")
     else:
-        print(f"⚠️  База даних (SQLite) ініціалізована (без шифрування - встановіть cryptography)")
+        db_log.warning("⚠️  База даних (SQLite) ініціалізована (без шифрування - встановіть cryptography)")
+
+# --- Лічильники адмін-меню ---
+# Оновлюються інкрементально в тих самих транзакціях, що й зміни даних,
+# і періодично звіряються повним перерахунком (reconcile_admin_stats).
+
+def _bump_stat(cursor, key: str, delta: int = 1):
+    """Змінює лічильник у bot_stats (в межах транзакції переданого курсора)"""
+    cursor.execute('''INSERT INTO bot_stats (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                      ON CONFLICT(key) DO UPDATE SET value = value + excluded.value, updated_at = CURRENT_TIMESTAMP''',
+                   (key, delta))
+
+
+def reconcile_admin_stats():
+    """Повністю перераховує лічильники адмін-меню"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    counts = {}
+    c.execute('SELECT COUNT(*) FROM sessions')
+    counts['total_users'] = c.fetchone()[0] or 0
+    c.execute("SELECT COUNT(*) FROM sessions WHERE created_at > datetime('now', '-7 days')")
+    counts['new_users_week'] = c.fetchone()[0] or 0
+    c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'open'")
+    counts['open_tickets'] = c.fetchone()[0] or 0
+    c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'closed'")
+    counts['closed_tickets'] = c.fetchone()[0] or 0
+    c.execute("SELECT COUNT(*) FROM support_tickets WHERE created_at > datetime('now', '-7 days')")
+    counts['new_tickets_week'] = c.fetchone()[0] or 0
+    c.execute('SELECT COUNT(*) FROM vip_requests')
+    counts['vip_requests'] = c.fetchone()[0] or 0
+    c.executemany('INSERT OR REPLACE INTO bot_stats (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                  list(counts.items()))
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def get_admin_stats() -> dict:
+    """Повертає лічильники для адмін-меню без COUNT(*) по таблицях"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT key, value FROM bot_stats')
+    stats = {r[0]: r[1] for r in c.fetchall()}
+    conn.close()
+    stats['active_vips'] = count_active_vips()
+    return stats
+
+
+async def reconcile_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фонова звірка лічильників адмін-меню"""
+    try:
+        counts = reconcile_admin_stats()
+        stats_log.info("Reconciled admin counters: %s", counts)
+    except Exception as e:
+        stats_log.warning("Reconcile failed: %s", e)
+    try:
+        deleted = await asyncio.to_thread(purge_orphan_student_data)
+        if deleted:
+            db_log.info("Purged data of students without a session: %s", deleted)
+    except Exception as e:
+        db_log.warning("Orphan purge failed: %s", e)
+
+class SessionRecord:
+    """Розшифрована сесія користувача; підтримує доступ як до dict (session['token'])"""
+
+    __slots__ = ('username', 'password', 'token', 'student_id', 'fio')
+
+    def __init__(self, username, password, token, student_id, fio):
+        self.username = username
+        self.password = password
+        self.token = token
+        self.student_id = student_id
+        self.fio = fio
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+
+_SESSION_CACHE = LRUCache(SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
 
 def save_session(user_id: int, username: str, password: str, token: str, student_id: str, fio: str):
     """Зберігає сесію користувача з шифрованими даними"""
@@ -336,23 +833,39 @@ def save_session(user_id: int, username: str, password: str, token: str, student
     encrypted_password = encrypt_data(password)
     encrypted_token = encrypt_data(token)
     
+    c.execute('SELECT 1 FROM sessions WHERE user_id = ?', (user_id,))
+    is_new_user = c.fetchone() is None
     c.execute('''INSERT OR REPLACE INTO sessions 
                  (user_id, username, password, token, student_id, fio, last_login) 
                  VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''', 
               (user_id, username, encrypted_password, encrypted_token, student_id, fio))
+    if is_new_user:
+        _bump_stat(c, 'total_users')
+        _bump_stat(c, 'new_users_week')
     conn.commit()
     conn.close()
+    # відкриті дані вже є — кладемо свіжий запис у кеш замість старого
+    _SESSION_CACHE.set(user_id, SessionRecord(username, password, token, student_id, fio))
+
+# Write-through кеш: user_id -> (day_weekday, has_8th_lesson)
+_LESSON8_CACHE = LRUCache(PREFS_CACHE_SIZE)
 
 def get_user_8th_lesson_day(user_id: int):
     """Получает настройку дня с 8 уроками для пользователя"""
+    cached = _LESSON8_CACHE.get(user_id)
+    if cached is not None:
+        return cached
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('SELECT day_weekday, has_8th_lesson FROM user_8th_lesson_day WHERE user_id = ?', (user_id,))
     row = c.fetchone()
     conn.close()
     if row:
-        return row[0], row[1]  # day_weekday, has_8th_lesson
-    return None, 0  # Нет настройки, по умолчанию нет 8 уроков
+        result = (row[0], row[1])  # day_weekday, has_8th_lesson
+    else:
+        result = (None, 0)  # Нет настройки, по умолчанию нет 8 уроков
+    _LESSON8_CACHE.set(user_id, result)
+    return result
 
 def save_user_8th_lesson_day(user_id: int, day_weekday: int = None, has_8th_lesson: int = 0):
     """Сохраняет настройку дня с 8 уроками для пользователя"""
@@ -362,24 +875,44 @@ def save_user_8th_lesson_day(user_id: int, day_weekday: int = None, has_8th_less
               (user_id, day_weekday, has_8th_lesson))
     conn.commit()
     conn.close()
+    _LESSON8_CACHE.set(user_id, (day_weekday, has_8th_lesson))
 
 def get_session(user_id: int):
     """Отримує сесію користувача та дешифрує дані"""
+    cached = _SESSION_CACHE.get(user_id)
+    if cached is not None:
+        return cached
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('SELECT username, password, token, student_id, fio FROM sessions WHERE user_id = ?', (user_id,))
     row = c.fetchone()
     conn.close()
     
-    if row:
-        return {
-            'username': row[0],
-            'password': decrypt_data(row[1]),
-            'token': decrypt_data(row[2]),
-            'student_id': row[3],
-            'fio': row[4]
-        }
-    return None
+    if not row:
+        return None
+    password = decrypt_data(row[1])
+    token = decrypt_data(row[2])
+    if password is None or token is None:
+        crypto_log.debug("Session for user %s is unreadable, treating as logged out", user_id)
+        return None
+    if field_needs_migration(row[1]) or field_needs_migration(row[2]):
+        # Ліниве перешифрування старих рядків у v2 при першому читанні
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute('UPDATE sessions SET password = ?, token = ? WHERE user_id = ? AND password = ? AND token = ?',
+                  (encrypt_data(password), encrypt_data(token), user_id, row[1], row[2]))
+        conn.commit()
+        conn.close()
+    session = SessionRecord(row[0], password, token, row[3], row[4])
+    _SESSION_CACHE.set(user_id, session)
+    return session
+
+def _api_login(username: str, password: str):
+    """Блокуючий виклик: (status_code, json | None) від /v1/user/login"""
+    with get_scraper() as scraper:
+        r = scraper.post(f"{API_BASE}/v1/user/login", json={"username": username, "password": password},
+                         timeout=SCRAPER_TIMEOUT)
+        return r.status_code, (r.json() if r.status_code == 200 else None)
 
 async def refresh_session(user_id: int):
     """Оновлює токен користувача за допомогою збережених credentials"""
@@ -388,13 +921,9 @@ async def refresh_session(user_id: int):
         return None
     
     try:
-        r = get_scraper().post(f"{API_BASE}/v1/user/login", json={
-            "username": session['username'],
-            "password": session['password']
-        })
+        status, data = await asyncio.to_thread(_api_login, session['username'], session['password'])
         
-        if r.status_code == 200:
-            data = r.json()
+        if status == 200:
             save_session(
                 user_id,
                 session['username'],
@@ -409,13 +938,62 @@ async def refresh_session(user_id: int):
     
     return None
 
+# Таблиці з даними учня (student_id): зберігаються, лише поки є сесія з цим учнем —
+# видаляються при /logout, а залишені (вхід під іншим учнем без /logout) — purge_orphan_student_data
+STUDENT_DATA_TABLES = ('report_cards', 'marks', 'mark_stats', 'grade_sources')
+
+
+def _purge_student_data(cursor, student_id) -> bool:
+    """Видаляє збережені дані учня, якщо на нього більше не посилається жодна сесія"""
+    cursor.execute('SELECT 1 FROM sessions WHERE student_id = ? LIMIT 1', (student_id,))
+    if cursor.fetchone():
+        return False
+    for table in STUDENT_DATA_TABLES:
+        cursor.execute(f'DELETE FROM {table} WHERE student_id = ?', (str(student_id),))
+    return True
+
+
+def purge_orphan_student_data() -> dict:
+    """Видаляє дані учнів, на яких не посилається жодна сесія; повертає {таблиця: видалено рядків}"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    deleted = {}
+    for table in STUDENT_DATA_TABLES:
+        c.execute(f'DELETE FROM {table} WHERE student_id NOT IN (SELECT student_id FROM sessions)')
+        if c.rowcount:
+            deleted[table] = c.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+def _forget_student(student_id):
+    """Прибирає з кешів у пам'яті оцінки, джерела й тренди учня"""
+    student_id = str(student_id)
+    _GRADES_CACHE.discard_where(lambda key: key[0] == student_id)
+    _GRADE_SOURCE_CACHE.pop(student_id)
+    _TREND_CACHE.pop(student_id)
+
+
 def delete_session_from_db(user_id: int):
-    """Видаляє сесію користувача"""
+    """Видаляє сесію користувача, а також збережені й закешовані дані його учня"""
     conn = get_db_connection()
     c = conn.cursor()
+    c.execute('SELECT student_id FROM sessions WHERE user_id = ?', (user_id,))
+    row = c.fetchone()
+    student_id = row[0] if row else None
     c.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+    if c.rowcount > 0:
+        _bump_stat(c, 'total_users', -1)
+    purged = bool(student_id) and _purge_student_data(c, student_id)
     conn.commit()
     conn.close()
+    _SESSION_CACHE.pop(user_id)
+    if student_id:
+        _NEWS_CACHE.pop(student_id)
+        _WEEK_CACHE.discard_where(lambda key: key[0] == student_id)
+    if purged:
+        _forget_student(student_id)
 
 def save_support_ticket(user_id: int, message: str):
     """Зберігає звернення до підтримки"""
@@ -423,6 +1001,8 @@ def save_support_ticket(user_id: int, message: str):
     c = conn.cursor()
     c.execute('INSERT INTO support_tickets (user_id, message) VALUES (?, ?)', (user_id, message))
     ticket_id = c.lastrowid
+    _bump_stat(c, 'open_tickets')
+    _bump_stat(c, 'new_tickets_week')
     conn.commit()
     conn.close()
     return ticket_id
@@ -447,8 +1027,13 @@ def resolve_ticket_db(ticket_id: int, admin_id: int, note: str = None):
     """Позначає тикет як вирішений"""
     conn = get_db_connection()
     c = conn.cursor()
+    c.execute("SELECT COALESCE(status,'open') FROM support_tickets WHERE id = ?", (ticket_id,))
+    prev = c.fetchone()
     c.execute('UPDATE support_tickets SET status = ?, resolved_by = ?, resolved_at = CURRENT_TIMESTAMP, admin_note = ? WHERE id = ?',
               ('closed', admin_id, note, ticket_id))
+    if prev and prev[0] != 'closed':
+        _bump_stat(c, 'open_tickets', -1)
+        _bump_stat(c, 'closed_tickets')
     conn.commit()
     # повертаємо оновлений запис
     c.execute('SELECT id, user_id, message, created_at, status FROM support_tickets WHERE id = ?', (ticket_id,))
@@ -459,317 +1044,112 @@ def resolve_ticket_db(ticket_id: int, admin_id: int, note: str = None):
     return {'id': row[0], 'user_id': row[1], 'message': row[2], 'created_at': row[3], 'status': row[4]}
 
 
-# --- Mark/grade helpers ---
-
-def _extract_mark_info(mark):
-    """Повертає кортеж (signature, display_text) для оцінки"""
-    try:
-        if isinstance(mark, dict):
-            # value
-            value = None
-            for key in ('mark','value','grade','score','mark_value'):
-                if key in mark and mark.get(key) is not None:
-                    value = mark.get(key)
-                    break
-            mid = mark.get('id') or mark.get('mark_id') or ''
-            date = mark.get('date') or mark.get('created_at') or mark.get('datetime') or ''
-            val_str = str(value).strip() if value is not None else str(mark)
-        else:
-            val_str = str(mark)
-            mid = ''
-            date = ''
-    except Exception:
-        val_str = str(mark)
-        mid = ''
-        date = ''
+# ----------------- VIP REGISTRY -----------------
+# Членство VIP тримаємо в пам'яті: user_id -> expires_at (epoch) + купа дедлайнів,
+# щоб записи зникали рівно в момент закінчення без звернень до БД.
 
-    signature = f"{val_str}|{mid}|{date}"
-    display = val_str if not date else f"{val_str} ({date})"
-    return signature, display
+_VIP_EXPIRY = {}
+_VIP_DEADLINES = []
+_VIP_LOCK = threading.Lock()
 
 
-def _extract_numeric_from_mark(mark):
-    """Старається витягти числове значення з оцінки, повертає float або None"""
+def _parse_vip_expires(value):
+    """Перетворює expires_at з БД (epoch або legacy ISO-рядок) у datetime в Europe/Kyiv"""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, KYIV_TZ)
+    # legacy: naive значення вважаємо київським часом
     try:
-        if isinstance(mark, (int, float)):
-            return float(mark)
-        if isinstance(mark, dict):
-            for key in ('mark','value','grade','score','mark_value'):
-                if key in mark and mark.get(key) is not None:
-                    s = str(mark.get(key))
-                    m = re.search(r"(\d+(?:[\.,]\d+)?)", s)
-                    if m:
-                        return float(m.group(1).replace(',', '.'))
-                    else:
-                        return None
-        s = str(mark)
-        m = re.search(r"(\d+(?:[\.,]\d+)?)", s)
-        if m:
-            return float(m.group(1).replace(',', '.'))
+        expires = datetime.fromisoformat(str(value))
     except Exception:
         return None
-    return None
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=KYIV_TZ)
+    return expires
 
 
-def parse_grades_from_html(html: str):
-    """Парсить сторінку 'Виписка оцінок' і повертати (start_date, end_date, {subject: [(token, date_iso_or_None), ...]})"""
-    from bs4 import BeautifulSoup
+def _vip_expire_due(now_ts: float):
+    """Видаляє з реєстру записи, дедлайн яких вже настав (викликати під _VIP_LOCK)"""
+    while _VIP_DEADLINES and _VIP_DEADLINES[0][0] <= now_ts:
+        ts, uid = heapq.heappop(_VIP_DEADLINES)
+        # запис міг бути продовжений — тоді в купі лежить застарілий дедлайн
+        if _VIP_EXPIRY.get(uid) == ts:
+            del _VIP_EXPIRY[uid]
 
-    try:
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(html, 'html.parser')
-        text = soup.get_text("\n", strip=True)
 
-        # Try to read date inputs from the form (date_from / date_to)
-        try:
-            # Try multiple selectors for date inputs
-            df = soup.find('input', attrs={'name': 'date_from'}) or soup.find(id='classselectform-date_from') or soup.find('input', id='classselectform-date_from')
-            dt = soup.find('input', attrs={'name': 'date_to'}) or soup.find(id='classselectform-date_to') or soup.find('input', id='classselectform-date_to')
-            if df and df.get('value'):
-                start_date = df.get('value')
-                print(f"[PARSE_HTML] Found start_date from input: {start_date}")
-            if dt and dt.get('value'):
-                end_date = dt.get('value')
-                print(f"[PARSE_HTML] Found end_date from input: {end_date}")
-        except Exception as e:
-            print(f"[PARSE_HTML] Error reading date inputs: {e}")
-            pass
-    except Exception:
-        # fallback to raw text
-        text = html
+def _vip_registry_set(user_id: int, ts: int):
+    with _VIP_LOCK:
+        _VIP_EXPIRY[user_id] = ts
+        heapq.heappush(_VIP_DEADLINES, (ts, user_id))
+        _vip_expire_due(time.time())
 
-    # helper to try to find a date inside a token string
-    months = {
-        'січня': 1, 'лютого': 2, 'березня': 3, 'квітня': 4, 'травня': 5, 'червня': 6,
-        'липня': 7, 'серпня': 8, 'вересня': 9, 'жовтня': 10, 'листопада': 11, 'грудня': 12
-    }
 
-    def _try_parse_date_from_text(s: str):
-        try:
-            s = s or ''
-            if not isinstance(s, str):
-                s = str(s)
-            # ISO
-            m = re.search(r"(\d{4}-\d{2}-\d{2})", s)
-            if m:
-                return m.group(1)
-            # dd.mm.yyyy
-            m = re.search(r"(\d{1,2})\.(\d{1,2})\.(\d{4})", s)
-            if m:
-                d, mo, y = m.groups()
-                try:
-                    return f"{int(y):04d}-{int(mo):02d}-{int(d):02d}"
-                except Exception:
-                    pass
-            # Ukrainian month names: '19 грудня 2025' or '19 грудня'
-            # Escape special regex characters in month names and join them
-            month_pattern = '|'.join(re.escape(month) for month in months.keys())
-            m = re.search(r"(\d{1,2})\s+({})\s*(\d{4})?".format(month_pattern), s, flags=re.IGNORECASE)
-            if m:
-                d = int(m.group(1))
-                mon_name = m.group(2).lower()
-                y = int(m.group(3)) if m.group(3) else datetime.now().year
-                mo = months.get(mon_name, None)
-                if mo:
-                    try:
-                        return f"{int(y):04d}-{int(mo):02d}-{int(d):02d}"
-                    except Exception:
-                        pass
-        except Exception as e:
-            # If any error occurs, just return None (no date found)
-            pass
+def _vip_registry_drop(user_id: int):
+    with _VIP_LOCK:
+        _VIP_EXPIRY.pop(user_id, None)
+
+
+def load_vip_registry():
+    """Завантажує активні VIP-підписки з БД у пам'ять (викликається при старті)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT user_id, expires_at FROM vip_users WHERE expires_at > ?', (int(time.time()),))
+    rows = c.fetchall()
+    conn.close()
+
+    with _VIP_LOCK:
+        _VIP_EXPIRY.clear()
+        _VIP_DEADLINES.clear()
+        for uid, expires_ts in rows:
+            _VIP_EXPIRY[uid] = expires_ts
+            _VIP_DEADLINES.append((expires_ts, uid))
+        heapq.heapify(_VIP_DEADLINES)
+    vip_log.info("Registry loaded: %s active VIP users", len(_VIP_EXPIRY))
+
+
+def get_vip_expires(user_id: int):
+    """Повертає час закінчення VIP (datetime у Europe/Kyiv) або None, якщо VIP неактивний"""
+    with _VIP_LOCK:
+        _vip_expire_due(time.time())
+        ts = _VIP_EXPIRY.get(user_id)
+    if ts is None:
         return None
+    return datetime.fromtimestamp(ts, KYIV_TZ)
 
-    # Attempt to extract the visible date range
-    start_date = None
-    end_date = None
-    m = re.search(r"Оберіть діапазон дат:\s*(\d{4}-\d{2}-\d{2})\s*по\s*(\d{4}-\d{2}-\d{2})", text)
-    if not start_date and m:
-        start_date, end_date = m.group(1), m.group(2)
-    else:
-        # try simple two dates
-        m2 = re.search(r"(\d{4}-\d{2}-\d{2}).{0,40}(\d{4}-\d{2}-\d{2})", text)
-        if not start_date and m2:
-            start_date, end_date = m2.group(1), m2.group(2)
 
-    # Try to find table rows / lines first
-    subjects = {}
-    try:
-        if 'Виписка оцінок' in text or 'Отримані результати' in text:
-            lines = text.splitlines()
-            print(f"[PARSE_HTML] Processing {len(lines)} lines from text")
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                m = re.match(r'^\s*(\d+)\s+([^\t\n\r\d].*?)\s{2,}(.+)$', line)
-                if not m:
-                    parts = line.split('\t')
-                    if len(parts) >= 3 and parts[0].strip().isdigit():
-                        subj = parts[1].strip()
-                        marks_raw = parts[2].strip()
-                    else:
-                        continue
-                else:
-                    subj = m.group(2).strip()
-                    marks_raw = m.group(3).strip()
-
-                tokens_raw = [t.strip() for t in re.split(r",\s*", marks_raw) if t.strip()]
-                tokens = []
-                for t in tokens_raw:
-                    d = _try_parse_date_from_text(t)
-                    tokens.append((t, d))
-                if tokens:
-                    subjects[subj] = tokens
-                    print(f"[PARSE_HTML] Found subject: {subj} with {len(tokens)} marks")
-    except Exception as e:
-        print(f"[PARSE_HTML] Error parsing text lines: {e}")
-        pass
+def count_active_vips() -> int:
+    """Кількість активних VIP (з реєстру в пам'яті)"""
+    with _VIP_LOCK:
+        _vip_expire_due(time.time())
+        return len(_VIP_EXPIRY)
 
-    # If no subjects found via text, try to find HTML tables
-    if not subjects:
-        try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html, 'html.parser')
-            # First try to find the specific marks-report table
-            marks_table = soup.find('table', class_='marks-report')
-            if not marks_table:
-                # Fallback to any table
-                tables = soup.find_all('table')
-                print(f"[PARSE_HTML] Found {len(tables)} tables in HTML (no marks-report table)")
-            else:
-                tables = [marks_table]
-                print(f"[PARSE_HTML] Found marks-report table")
-            
-            for table in tables:
-                rows = table.select('tbody tr') if table.select('tbody') else table.select('tr')
-                print(f"[PARSE_HTML] Processing table with {len(rows)} rows")
-                row_count = 0
-                for tr in rows:
-                    tds = tr.select('td')
-                    if len(tds) >= 3:
-                        # Get text from each td, preserving structure
-                        num_text = tds[0].get_text(' ', strip=True)
-                        subj = tds[1].get_text(' ', strip=True)
-                        marks_raw = tds[2].get_text(' ', strip=True)
-                        
-                        # Skip header row or empty rows
-                        if not num_text.strip().isdigit() or not subj:
-                            continue
-                        
-                        # Skip rows with empty marks (like "Польська мова" with empty td)
-                        if not marks_raw or marks_raw.strip() == '':
-                            print(f"[PARSE_HTML] Skipping subject '{subj}' - no marks")
-                            continue
-                        
-                        row_count += 1
-                            
-                        # Split marks by comma, but preserve parentheses content
-                        tokens_raw = []
-                        # More careful splitting - split by comma but keep parentheses together
-                        current_token = ""
-                        paren_depth = 0
-                        for char in marks_raw:
-                            if char == '(':
-                                paren_depth += 1
-                                current_token += char
-                            elif char == ')':
-                                paren_depth -= 1
-                                current_token += char
-                            elif char == ',' and paren_depth == 0:
-                                if current_token.strip():
-                                    tokens_raw.append(current_token.strip())
-                                current_token = ""
-                            else:
-                                current_token += char
-                        if current_token.strip():
-                            tokens_raw.append(current_token.strip())
-                        
-                        tokens = []
-                        for t in tokens_raw:
-                            if t:  # Only process non-empty tokens
-                                try:
-                                    d = _try_parse_date_from_text(t)
-                                    tokens.append((t, d))
-                                except Exception as e:
-                                    # If date parsing fails, just add token without date
-                                    print(f"[PARSE_HTML] Warning: failed to parse date from token '{t}': {e}")
-                                    tokens.append((t, None))
-                        if tokens and subj:
-                            subjects[subj] = tokens
-                            print(f"[PARSE_HTML] Found subject in table: {subj} with {len(tokens)} marks")
-                
-                print(f"[PARSE_HTML] Processed {row_count} data rows from table")
-        except Exception as e:
-            print(f"[PARSE_HTML] Error parsing HTML tables: {e}")
-            import traceback
-            print(f"[PARSE_HTML] Traceback: {traceback.format_exc()}")
-            pass
-    
-    # If still no subjects, try more flexible parsing
-    if not subjects:
-        try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html, 'html.parser')
-            # Try to find any divs or spans that might contain subject names and marks
-            # Look for patterns like "Subject Name: 5, 6, 7" or similar
-            all_text = soup.get_text("\n", strip=True)
-            print(f"[PARSE_HTML] Trying flexible parsing, text length: {len(all_text)}")
-            # Try to find lines with numbers followed by text (subject names)
-            lines = all_text.splitlines()
-            for i, line in enumerate(lines):
-                line = line.strip()
-                # Look for pattern: number, subject name, marks
-                # More flexible regex
-                m = re.match(r'^\s*(\d+)[\.\)\s]+(.+?)\s+([\d\s,НПВ\-]+)$', line)
-                if m:
-                    num, subj, marks_raw = m.groups()
-                    tokens_raw = [t.strip() for t in re.split(r"[,;\s]+", marks_raw) if t.strip() and t.strip() not in ['', '-']]
-                    if tokens_raw:
-                        tokens = []
-                        for t in tokens_raw:
-                            d = _try_parse_date_from_text(t)
-                            tokens.append((t, d))
-                        if tokens and subj.strip():
-                            subjects[subj.strip()] = tokens
-                            print(f"[PARSE_HTML] Found subject (flexible): {subj.strip()} with {len(tokens)} marks")
-        except Exception as e:
-            print(f"[PARSE_HTML] Error in flexible parsing: {e}")
-            pass
-    
-    print(f"[PARSE_HTML] Final result: {len(subjects)} subjects found")
-    return start_date, end_date, subjects
 
-    return start_date, end_date, subjects
+def active_vip_users() -> list:
+    """Знімок реєстру: [(user_id, expires_at)] активних VIP, відсортований за user_id"""
+    with _VIP_LOCK:
+        _vip_expire_due(time.time())
+        return sorted(_VIP_EXPIRY.items())
 
 
 def is_vip_user(user_id: int) -> bool:
     """Перевіряє чи є користувач VIP"""
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT expires_at FROM vip_users WHERE user_id = ?', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    
-    if row and row[0]:
-        try:
-            expires = datetime.fromisoformat(row[0])
-            return expires > now_kyiv()
-        except Exception:
-            return False
-    return False
+    with _VIP_LOCK:
+        _vip_expire_due(time.time())
+        return user_id in _VIP_EXPIRY
 
 # ----------------- VIP HELPERS -----------------
 
 def grant_vip(user_id: int, days: int = 30):
     """Надає VIP на вказану кількість днів"""
-    expires_at = (now_kyiv() + timedelta(days=days)).isoformat()
+    expires_ts = int(time.time()) + days * 86400
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('INSERT OR REPLACE INTO vip_users (user_id, expires_at, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
-              (user_id, expires_at))
+              (user_id, expires_ts))
     conn.commit()
     conn.close()
+    _vip_registry_set(user_id, expires_ts)
 
 
 def revoke_vip(user_id: int):
@@ -779,6 +1159,7 @@ def revoke_vip(user_id: int):
     c.execute('DELETE FROM vip_users WHERE user_id = ?', (user_id,))
     conn.commit()
     conn.close()
+    _vip_registry_drop(user_id)
 
 
 def save_reminder_sent(user_id: int, lesson_date: str, lesson_time: str):
@@ -819,11 +1200,244 @@ def save_last_grades(user_id: int, grades: dict):
     conn.close()
 
 
+def store_marks(student_id, subjects_parsed: dict, start: str, end: str):
+    """Замінює збережені оцінки учня за період [start, end] свіжими і в тій самій транзакції оновлює
+    агрегати mark_stats на різницю між старими й новими оцінками.
+
+    Оцінки без дати замінюються лише завантаженням за весь поточний навчальний рік: вужчий період
+    не каже, які з них досі актуальні, тож збережені лишаються, а свіжі недатовані не дописуються."""
+    student_id = str(student_id)
+    now = int(time.time())
+    school_year = school_year_of(None, now)
+    whole_year = start <= school_year and school_year_of(end) == school_year
+    fresh = [(subject, mark) for subject, marks in subjects_parsed.items() for mark in marks
+             if mark.date or whole_year]
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        # Транзакція з запису — до читання старих оцінок: інакше два одночасні збереження для одного учня
+        # порахували б різницю від тих самих рядків і двічі застосували її до mark_stats
+        c.execute('BEGIN IMMEDIATE')
+        # Завантаження могло завершитись уже після /logout — тоді оцінки не зберігаємо
+        c.execute('SELECT 1 FROM sessions WHERE student_id = ? LIMIT 1', (student_id,))
+        if not c.fetchone():
+            return
+        c.execute('''SELECT rowid, subject, raw, mark_date, value, absent, kind, fetched_at FROM marks
+                     WHERE student_id = ? AND (mark_date BETWEEN ? AND ? OR mark_date IS NULL)''',
+                  (student_id, start, end))
+        # Недатовані оцінки, завантажені в минулі навчальні роки, лишаються як є
+        stale = [row for row in c.fetchall()
+                 if row[3] is not None or (whole_year and school_year_of(None, row[7]) == school_year)]
+        old = [(school_year_of(mark_date, fetched_at), subject, Mark(raw, mark_date, value, bool(absent), kind))
+               for _, subject, raw, mark_date, value, absent, kind, fetched_at in stale]
+        c.executemany('DELETE FROM marks WHERE rowid = ?', [(row[0],) for row in stale])
+        c.executemany('INSERT INTO marks (student_id, subject, raw, mark_date, value, absent, kind, fetched_at) '
+                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      [(student_id, subject, mark.raw, mark.date, mark.value, int(mark.absent), mark.kind, now)
+                       for subject, mark in fresh])
+        new = [(school_year_of(mark.date, now), subject, mark) for subject, mark in fresh]
+        _apply_mark_stats(c, student_id, old, new)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _stored_subject_marks(cursor, student_id: str, school_year: str, subject: str):
+    cursor.execute('''SELECT raw, mark_date, value, absent, kind, fetched_at FROM marks
+                      WHERE student_id = ? AND subject = ? ORDER BY mark_date, rowid''', (student_id, subject))
+    for raw, mark_date, value, absent, kind, fetched_at in cursor.fetchall():
+        if school_year_of(mark_date, fetched_at) == school_year:
+            yield Mark(raw, mark_date, value, bool(absent), kind)
+
+
+def _save_mark_stats(cursor, student_id: str, school_year: str, subject: str, stats: SubjectStats):
+    if stats.marks:
+        cursor.execute('''INSERT OR REPLACE INTO mark_stats
+                          (student_id, school_year, subject, marks, count, total, min_value, max_value,
+                           absences, other, last_marks, updated_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (student_id, school_year, subject, *stats.to_row(), int(time.time())))
+    else:
+        cursor.execute('DELETE FROM mark_stats WHERE student_id = ? AND school_year = ? AND subject = ?',
+                       (student_id, school_year, subject))
+
+
+def _apply_mark_stats(cursor, student_id: str, old: list, new: list):
+    """Оновлює агрегати лише для оцінок, що зникли чи з'явились ((навч. рік, предмет, Mark) у old/new)"""
+    old_counts, new_counts = Counter(old), Counter(new)
+    changes = {}
+    for (year, subject, mark), n in (old_counts - new_counts).items():
+        changes.setdefault((year, subject), ([], []))[0].extend([mark] * n)
+    for (year, subject, mark), n in (new_counts - old_counts).items():
+        changes.setdefault((year, subject), ([], []))[1].extend([mark] * n)
+    for (year, subject), (removed, added) in changes.items():
+        cursor.execute('''SELECT marks, count, total, min_value, max_value, absences, other, last_marks
+                          FROM mark_stats WHERE student_id = ? AND school_year = ? AND subject = ?''',
+                       (student_id, year, subject))
+        row = cursor.fetchone()
+        stats = SubjectStats.from_row(*row) if row else SubjectStats()
+        if all(stats.remove(mark) for mark in removed):
+            for mark in added:
+                stats.add(mark)
+        else:
+            # Зник мінімум/максимум або одна з останніх оцінок — перераховуємо предмет зі сховища
+            stats = SubjectStats.fold(_stored_subject_marks(cursor, student_id, year, subject))
+        _save_mark_stats(cursor, student_id, year, subject, stats)
+
+
+def get_mark_stats(student_id, school_year: str) -> dict:
+    """{предмет: SubjectStats} учня за навчальний рік (YYYY-08-01) — без читання самих оцінок"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''SELECT subject, marks, count, total, min_value, max_value, absences, other, last_marks
+                 FROM mark_stats WHERE student_id = ? AND school_year = ?''', (str(student_id), school_year))
+    stats = {row[0]: SubjectStats.from_row(*row[1:]) for row in c.fetchall()}
+    conn.close()
+    return stats
+
+
+def rebuild_mark_stats(student_id=None):
+    """Перераховує mark_stats з таблиці marks (усіх учнів або одного).
+    Повертає (кількість агрегатів, скільки з них розходилися з інкрементальними)"""
+    where, params = ('WHERE student_id = ?', (str(student_id),)) if student_id is not None else ('', ())
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        rebuilt = {}
+        c.execute(f'''SELECT student_id, subject, raw, mark_date, value, absent, kind, fetched_at FROM marks {where}
+                      ORDER BY student_id, subject, mark_date, rowid''', params)
+        while True:
+            batch = c.fetchmany(500)
+            if not batch:
+                break
+            for sid, subject, raw, mark_date, value, absent, kind, fetched_at in batch:
+                key = (sid, school_year_of(mark_date, fetched_at), subject)
+                rebuilt.setdefault(key, SubjectStats()).add(Mark(raw, mark_date, value, bool(absent), kind))
+        c.execute(f'''SELECT student_id, school_year, subject, marks, count, total, min_value, max_value,
+                             absences, other, last_marks FROM mark_stats {where}''', params)
+        current = {tuple(row[:3]): SubjectStats.from_row(*row[3:]) for row in c.fetchall()}
+        mismatched = sum(1 for key in rebuilt.keys() | current.keys() if rebuilt.get(key) != current.get(key))
+        c.execute(f'DELETE FROM mark_stats {where}', params)
+        for (sid, year, subject), stats in rebuilt.items():
+            _save_mark_stats(c, sid, year, subject, stats)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rebuilt), mismatched
+
+
+def iter_stored_marks(student_id, start: str = None, end: str = None, batch_size: int = 500):
+    """Генератор (subject, Mark) зі сховища, по предметах і датах; читає курсор порціями"""
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute('''SELECT subject, raw, mark_date, value, absent, kind FROM marks
+                     WHERE student_id = ? AND (mark_date IS NULL OR mark_date BETWEEN ? AND ?)
+                     ORDER BY subject, mark_date, rowid''',
+                  (str(student_id), start or '0000-00-00', end or '9999-99-99'))
+        while True:
+            batch = c.fetchmany(batch_size)
+            if not batch:
+                break
+            for subject, raw, mark_date, value, absent, kind in batch:
+                yield subject, Mark(raw, mark_date, value, bool(absent), kind)
+    finally:
+        conn.close()
+
+
+def export_stored_marks(student_id, start: str, end: str, fmt: str):
+    """Блокуючий виклик: (file, count) — файл експорту, записаний потоково зі сховища"""
+    return export_to_file(export_rows(iter_stored_marks(student_id, start, end)), fmt)
+
+
+class GradeSourcePref(NamedTuple):
+    """Джерело оцінок, яке останнім дало повні дані, і лічильники спроб/влучань по джерелах"""
+    source: Optional[str]
+    api_hits: int = 0
+    api_tries: int = 0
+    html_hits: int = 0
+    html_tries: int = 0
+    probed_at: int = 0
+
+    def hit_rate(self, source: str) -> float:
+        tries = self.api_tries if source == 'api' else self.html_tries
+        hits = self.api_hits if source == 'api' else self.html_hits
+        return hits / tries if tries else 0.0
+
+
+# Write-through кеш: student_id -> GradeSourcePref
+_GRADE_SOURCE_CACHE = LRUCache(PREFS_CACHE_SIZE)
+
+
+def get_grade_source(student_id):
+    """GradeSourcePref учня або None, якщо джерела ще не перевірялись"""
+    student_id = str(student_id)
+    cached = _GRADE_SOURCE_CACHE.get(student_id)
+    if cached is not None:
+        return cached
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT source, api_hits, api_tries, html_hits, html_tries, probed_at FROM grade_sources WHERE student_id = ?',
+              (student_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        return None
+    pref = GradeSourcePref(*row)
+    _GRADE_SOURCE_CACHE.set(student_id, pref)
+    return pref
+
+
+def record_grade_sources(student_id, outcomes: dict, source: str = None, probed: bool = False):
+    """Додає результати спроб ({джерело: влучання}); source — нове бажане джерело (None — лишити як є)"""
+    student_id = str(student_id)
+    pref = get_grade_source(student_id) or GradeSourcePref(None)
+    pref = pref._replace(
+        source=source or pref.source,
+        api_hits=pref.api_hits + int(outcomes.get('api', False)),
+        api_tries=pref.api_tries + int('api' in outcomes),
+        html_hits=pref.html_hits + int(outcomes.get('html', False)),
+        html_tries=pref.html_tries + int('html' in outcomes),
+        probed_at=int(time.time()) if probed else pref.probed_at,
+    )
+    if pref.source is None:
+        return pref
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT OR REPLACE INTO grade_sources
+                 (student_id, source, api_hits, api_tries, html_hits, html_tries, probed_at, updated_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+              (student_id, *pref, int(time.time())))
+    conn.commit()
+    conn.close()
+    _GRADE_SOURCE_CACHE.set(student_id, pref)
+    return pref
+
+
+def grade_source_summary() -> dict:
+    """Для адмін-статистики: скільки учнів на кожному джерелі та загальні влучання"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''SELECT COALESCE(SUM(source = 'api'), 0), COALESCE(SUM(source = 'html'), 0),
+                        COALESCE(SUM(api_hits), 0), COALESCE(SUM(api_tries), 0),
+                        COALESCE(SUM(html_hits), 0), COALESCE(SUM(html_tries), 0)
+                 FROM grade_sources''')
+    api_users, html_users, api_hits, api_tries, html_hits, html_tries = c.fetchone()
+    conn.close()
+    return {
+        'api_users': api_users, 'html_users': html_users,
+        'api_hit_rate': api_hits / api_tries if api_tries else 0.0,
+        'html_hit_rate': html_hits / html_tries if html_tries else 0.0,
+    }
+
+
 def create_vip_request(user_id: int, message: str):
     conn = get_db_connection()
     c = conn.cursor()
     c.execute('INSERT INTO vip_requests (user_id, contact_text) VALUES (?, ?)', (user_id, message))
     ticket_id = c.lastrowid
+    _bump_stat(c, 'vip_requests')
     conn.commit()
     conn.close()
     return ticket_id
@@ -839,6 +1453,24 @@ def log_admin_action(admin_id: int, action: str, target_user: int = None, ticket
     conn.close()
 
 
+# Write-through кеш: user_id -> {key: value} з усіма VIP-налаштуваннями користувача
+_VIP_SETTINGS_CACHE = LRUCache(PREFS_CACHE_SIZE)
+
+
+def _load_vip_settings(user_id: int) -> dict:
+    settings = _VIP_SETTINGS_CACHE.get(user_id)
+    if settings is not None:
+        return settings
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT key, value FROM vip_settings WHERE user_id = ?', (user_id,))
+    rows = c.fetchall()
+    conn.close()
+    settings = {r[0]: r[1] for r in rows}
+    _VIP_SETTINGS_CACHE.set(user_id, settings)
+    return settings
+
+
 def set_vip_setting(user_id: int, key: str, value: str):
     conn = get_db_connection()
     c = conn.cursor()
@@ -846,26 +1478,77 @@ def set_vip_setting(user_id: int, key: str, value: str):
               (user_id, key, str(value)))
     conn.commit()
     conn.close()
+    # оновлюємо кеш новою копією, щоб читачі не бачили напівзмінений dict
+    settings = _VIP_SETTINGS_CACHE.get(user_id)
+    if settings is not None:
+        updated = dict(settings)
+        updated[key] = str(value)
+        _VIP_SETTINGS_CACHE.set(user_id, updated)
 
 
 def get_vip_setting(user_id: int, key: str, default=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT value FROM vip_settings WHERE user_id = ? AND key = ?', (user_id, key))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return row[0]
-    return default
+    return _load_vip_settings(user_id).get(key, default)
 
 
 def get_all_vip_settings(user_id: int) -> dict:
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT key, value FROM vip_settings WHERE user_id = ?', (user_id,))
+    return dict(_load_vip_settings(user_id))
+
+
+# --- Keyset-пагінація ---
+# Курсор сторінки = (created_at, id) останнього/першого рядка, закодований у callback_data
+# як "YYYYMMDDHHMMSS_id" (без двокрапок і в межах ліміту 64 байти).
+
+def encode_page_cursor(created_at, row_id) -> str:
+    digits = re.sub(r'\D', '', str(created_at or ''))[:14]
+    return f"{digits}_{row_id}"
+
+
+def decode_page_cursor(token: str):
+    digits, _, row_id = (token or '').rpartition('_')
+    t = digits.ljust(14, '0')
+    return f"{t[0:4]}-{t[4:6]}-{t[6:8]} {t[8:10]}:{t[10:12]}:{t[12:14]}", int(row_id)
+
+
+def fetch_keyset_page(table: str, columns: str, where: str = '', params=(), cursor: str = None,
+                      direction: str = 'n', id_col: str = 'id', page_size: int = None):
+    """Повертає (rows, prev_cursor, next_cursor) для сторінки, відсортованої від нових до старих.
+
+    direction 'n' — старіші за курсор, 'p' — новіші за курсор.
+    """
+    page_size = page_size or ADMIN_PAGE_SIZE
+    conds = [where] if where else []
+    args = list(params)
+    if cursor:
+        ts, row_id = decode_page_cursor(cursor)
+        conds.append(f"(created_at, {id_col}) {'<' if direction == 'n' else '>'} (?, ?)")
+        args += [ts, row_id]
+    order = 'DESC' if direction == 'n' else 'ASC'
+    sql = f"SELECT {columns}, created_at, {id_col} FROM {table}"
+    if conds:
+        sql += " WHERE " + " AND ".join(conds)
+    sql += f" ORDER BY created_at {order}, {id_col} {order} LIMIT ?"
+    args.append(page_size + 1)
+
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(sql, args)
     rows = c.fetchall()
     conn.close()
-    return {r[0]: r[1] for r in rows}
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'p':
+        rows.reverse()
+    if not rows:
+        return [], None, None
+
+    if direction == 'n':
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+    prev_cursor = encode_page_cursor(rows[0][-2], rows[0][-1]) if has_prev else None
+    next_cursor = encode_page_cursor(rows[-1][-2], rows[-1][-1]) if has_next else None
+    return [r[:-2] for r in rows], prev_cursor, next_cursor
 
 
 # Адміни (можна задати через змінну середовища ADMIN_IDS через кому, наприклад: "1716175980,751886453")
@@ -891,41 +1574,18 @@ def is_admin(user_id: int) -> bool:
 
 async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
     """Проверяет расписание VIP-пользователей и отправляет напоминания за REMINDER_MINUTES"""
-    print("[VIP JOB] Checking reminders...")
+    vip_job_log.debug("Checking reminders...")
     if 'REMINDERS_LOCK' in globals() and REMINDERS_LOCK is not None and REMINDERS_LOCK.locked():
-        print("[VIP JOB] Reminders job still running, skipping this round")
+        vip_job_log.info("Reminders job still running, skipping this round")
         return
 
     try:
         async with REMINDERS_LOCK:
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute('SELECT user_id, expires_at FROM vip_users WHERE expires_at > ?', (now_kyiv().isoformat(),))
-            # stream users in batches to avoid loading all rows into memory
-            def iter_fetchmany(cursor, batch_size=200):
-                while True:
-                    rows = cursor.fetchmany(batch_size)
-                    if not rows:
-                        break
-                    for r in rows:
-                        yield r
-
-            users_gen = iter_fetchmany(c, batch_size=200)
-            # peek first user to detect empty resultset
-            try:
-                first_user = next(users_gen)
-            except StopIteration:
-                conn.close()
-                print("[VIP JOB] No active VIP users found")
+            users = active_vip_users()
+            if not users:
+                vip_job_log.info("No active VIP users found")
                 return
-
-            # chain first_user back to generator
-            def users_chain(first, gen):
-                yield first
-                yield from gen
-
-            users = users_chain(first_user, users_gen)
-            print("[VIP JOB] Streaming VIP users")
+            vip_job_log.debug("Processing %s VIP users", len(users))
             user_counter = 0
 
             for user in users:
@@ -938,13 +1598,13 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
                     user_id = user[0]
                     session = get_session(user_id)
                     if not session:
-                        print(f"[VIP JOB] No session for user {user_id}")
+                        vip_job_log.debug("No session for user %s", user_id)
                         continue
 
                     # Проверяем настройки напоминаний
                     reminders_enabled = get_vip_setting(user_id, 'reminders', '1') == '1'
                     if not reminders_enabled:
-                        print(f"[VIP JOB] User {user_id} has reminders disabled; skipping")
+                        vip_job_log.debug("User %s has reminders disabled; skipping", user_id)
                         continue
 
                     today = now_kyiv().strftime('%Y-%m-%d')
@@ -959,11 +1619,11 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
                                 timeout=SCRAPER_TIMEOUT
                             )
                     except Exception as e:
-                        print(f"[VIP JOB] API request failed for user {user_id}: {e}")
+                        vip_job_log.warning("API request failed for user %s: %s", user_id, e, extra=SAMPLED)
                         continue
 
                     if r.status_code == 401:
-                        print(f"[VIP JOB] Token expired for user {user_id}, refreshing...")
+                        vip_job_log.info("Token expired for user %s, refreshing...", user_id)
                         new_s = await refresh_session(user_id)
                         if new_s:
                             session = new_s
@@ -976,20 +1636,20 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
                                         timeout=SCRAPER_TIMEOUT
                                     )
                             except Exception as e:
-                                print(f"[VIP JOB] API request failed after refresh for user {user_id}: {e}")
+                                vip_job_log.warning("API request failed after refresh for user %s: %s", user_id, e)
                                 continue
                         else:
-                            print(f"[VIP JOB] Could not refresh session for user {user_id}")
+                            vip_job_log.warning("Could not refresh session for user %s", user_id, extra=SAMPLED)
                             continue
 
                     if r.status_code != 200:
-                        print(f"[VIP JOB] API returned {r.status_code} for user {user_id}")
+                        vip_job_log.info("API returned %s for user %s", r.status_code, user_id, extra=SAMPLED)
                         continue
 
                     try:
                         data = r.json()
                     except Exception as e:
-                        print(f"[VIP JOB] Could not parse JSON for user {user_id}: {e}")
+                        vip_job_log.warning("Could not parse JSON for user %s: %s", user_id, e, extra=SAMPLED)
                         try:
                             r.close()
                         except Exception:
@@ -1058,28 +1718,18 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
                                             parse_mode=ParseMode.MARKDOWN
                                         )
                                         save_reminder_sent(user_id, lesson_date, lesson_time)
-                                        print(f"[VIP JOB] ✅ Sent reminder to {user_id} for {lesson_time} {subject_name} (in {minutes_left} min)")
+                                        vip_job_log.info("✅ Sent reminder to %s for %s %s (in %s min)", user_id, lesson_time, subject_name, minutes_left)
                                     except Exception as e:
-                                        print(f"[VIP JOB] ❌ Could not send reminder to {user_id}: {e}")
+                                        vip_job_log.warning("❌ Could not send reminder to %s: %s", user_id, e, extra=SAMPLED)
                     
                     if lessons_today:
-                        print(f"[VIP JOB] User {user_id} has {len(lessons_today)} lessons today: {[l['time'] for l in lessons_today]}")
+                        vip_job_log.debug("User %s has %s lessons today: %s", user_id, len(lessons_today), [l['time'] for l in lessons_today])
 
                 except Exception as e:
-                    print(f"[VIP JOB] Error processing user {user}: {e}")
-                    import traceback
-                    traceback.print_exc()
-
-            # Close DB connection used for streaming
-            try:
-                conn.close()
-            except Exception:
-                pass
+                    vip_job_log.exception("Error processing user %s: %s", user, e, extra=SAMPLED)
 
     except Exception as e:
-        print(f"[VIP JOB] Error in reminders job: {e}")
-        import traceback
-        traceback.print_exc()
+        vip_job_log.exception("Error in reminders job: %s", e)
     finally:
         # Попробуем освободить память после интенсивной работы
         try:
@@ -1091,39 +1741,18 @@ async def check_reminders(context: ContextTypes.DEFAULT_TYPE):
 
 async def check_grades(context: ContextTypes.DEFAULT_TYPE):
     """Проверяет новые оценки для VIP-пользователей через новости и отправляет уведомления"""
-    print("[VIP JOB] Checking grades from news")
+    vip_job_log.debug("Checking grades from news")
     if 'GRADES_LOCK' in globals() and GRADES_LOCK is not None and GRADES_LOCK.locked():
-        print("[VIP JOB] Grades job still running, skipping this round")
+        vip_job_log.info("Grades job still running, skipping this round")
         return
 
     async with GRADES_LOCK:
         try:
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute('SELECT user_id, expires_at FROM vip_users WHERE expires_at > ?', (now_kyiv().isoformat(),))
-            # stream users to avoid loading all rows
-            def iter_fetchmany(cursor, batch_size=200):
-                while True:
-                    rows = cursor.fetchmany(batch_size)
-                    if not rows:
-                        break
-                    for r in rows:
-                        yield r
-
-            users_gen = iter_fetchmany(c, batch_size=200)
-            try:
-                first_user = next(users_gen)
-            except StopIteration:
-                conn.close()
-                print("[VIP JOB] No active VIP users found")
+            users = active_vip_users()
+            if not users:
+                vip_job_log.info("No active VIP users found")
                 return
-
-            def users_chain(first, gen):
-                yield first
-                yield from gen
-
-            users = users_chain(first_user, users_gen)
-            print("[VIP JOB] Streaming VIP users")
+            vip_job_log.debug("Processing %s VIP users", len(users))
             user_counter = 0
 
             for user in users:
@@ -1141,37 +1770,29 @@ async def check_grades(context: ContextTypes.DEFAULT_TYPE):
                     # Проверяем настройки уведомлений
                     notif_enabled = get_vip_setting(user_id, 'grade_notifications', '1') == '1'
                     if not notif_enabled:
-                        print(f"[VIP JOB] User {user_id} has grade notifications disabled; skipping")
+                        vip_job_log.debug("User %s has grade notifications disabled; skipping", user_id)
                         continue
 
                     # Получаем новости с оценками (use short-lived scraper)
-                    from bs4 import BeautifulSoup
                     login_url = "https://nz.ua/login"
                     payload = None
                     try:
                         with get_scraper() as web_scraper:
                             # GET login page
                             login_page = web_scraper.get(login_url, timeout=SCRAPER_TIMEOUT)
-                            login_html = login_page.text
+                            login_html = login_page.content
                             try:
                                 login_page.close()
                             except Exception:
                                 pass
 
-                            login_soup = BeautifulSoup(login_html, "html.parser")
-                            csrf = None
-                            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-                            if meta_csrf:
-                                csrf = meta_csrf.get('content')
-                            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-                            if hidden_csrf and hidden_csrf.get('value'):
-                                csrf = hidden_csrf.get('value')
+                            login_form = extract_login_form(login_html)
+                            csrf = login_form.csrf
 
                             if not csrf:
                                 raise ValueError('No CSRF token')
 
-                            login_action = login_soup.find('form')
-                            login_action = login_action.get('action') if login_action else login_url
+                            login_action = login_form.action
 
                             payload = {
                                 '_csrf': csrf,
@@ -1186,7 +1807,7 @@ async def check_grades(context: ContextTypes.DEFAULT_TYPE):
                             except Exception:
                                 pass
                     except Exception as e:
-                        print(f"[VIP JOB] Error fetching/parsing news for user {user_id}: {e}")
+                        vip_job_log.warning("Error fetching/parsing news for user %s: %s", user_id, e, extra=SAMPLED)
                         continue
 
                     # Простая логика парсинга новостей на предмет оценок
@@ -1234,9 +1855,9 @@ async def check_grades(context: ContextTypes.DEFAULT_TYPE):
 
                         try:
                             await context.bot.send_message(chat_id=user_id, text="\n".join(text_lines), parse_mode=ParseMode.MARKDOWN)
-                            print(f"[VIP JOB] Sent {len(unique_grades)} grade notifications to {user_id}")
+                            vip_job_log.info("Sent %s grade notifications to %s", len(unique_grades), user_id)
                         except Exception as e:
-                            print(f"[VIP JOB] Could not send grades to {user_id}: {e}")
+                            vip_job_log.warning("Could not send grades to %s: %s", user_id, e, extra=SAMPLED)
                             continue
 
                         try:
@@ -1248,26 +1869,16 @@ async def check_grades(context: ContextTypes.DEFAULT_TYPE):
                             conn.commit()
                             conn.close()
                         except Exception as db_error:
-                            print(f"[VIP JOB] Warning: Could not save grade notifications to DB for user {user_id}: {db_error}")
+                            vip_job_log.warning("Could not save grade notifications to DB for user %s: %s", user_id, db_error)
                     else:
-                        print(f"[VIP JOB] No new grades for user {user_id}")
+                        vip_job_log.debug("No new grades for user %s", user_id)
 
                 except Exception as e:
-                    print(f"[VIP JOB] Error checking news for user {user_id}: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    vip_job_log.exception("Error checking news for user %s: %s", user_id, e, extra=SAMPLED)
                     continue
 
-            # Close DB connection used for streaming
-            try:
-                conn.close()
-            except Exception:
-                pass
-
         except Exception as e:
-            print(f"[VIP JOB] Error in grades job: {e}")
-            import traceback
-            traceback.print_exc()
+            vip_job_log.exception("Error in grades job: %s", e)
         finally:
             try:
                 gc.collect()
@@ -1374,45 +1985,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data.pop('step', None)
             return
 
-        broadcast_text = update.message.text
-
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT DISTINCT user_id FROM sessions')
-
-        success_count = 0
-        failed_count = 0
-        await update.message.reply_text("📤 Розсилка повідомлення (батчами)…")
-
-        while True:
-            rows = c.fetchmany(BROADCAST_BATCH_SIZE)
-            if not rows:
-                break
-            for row in rows:
-                uid = row[0]
-                try:
-                    await context.bot.send_message(uid, broadcast_text)
-                    success_count += 1
-                except Exception as e:
-                    failed_count += 1
-                    print(f"[BROADCAST] Failed to send to user {uid}: {e}")
-            del rows
-            gc.collect()
-            await asyncio.sleep(BROADCAST_BATCH_PAUSE)
-
-        conn.close()
-        # Log action and report
-        log_admin_action(update.effective_user.id, 'broadcast', details=f'sent to {success_count} users')
-        result_text = (
-            f"✅ *Розсилка завершена*\n\n"
-            f"📊 Статистика:\n"
-            f"• Успішно: {success_count}\n"
-            f"• Не вдалось: {failed_count}\n"
-        )
-        await update.message.reply_text(result_text, parse_mode=ParseMode.MARKDOWN)
+        # Розсилка йде фоновою задачею; прогрес показується в цьому повідомленні
+        status = await update.message.reply_text("📤 Готую розсилку…")
+        broadcast_id = await asyncio.to_thread(create_broadcast, update.effective_user.id, update.message.text,
+                                               status.chat_id, status.message_id)
+        start_broadcast(context.application, broadcast_id)
         context.user_data.pop('step', None)
-        gc.collect()
-        log_memory('admin_broadcast')
         return
 
     # Обробка логіну
@@ -1434,13 +2012,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
         
         try:
-            r = get_scraper().post(f"{API_BASE}/v1/user/login", json={
-                "username": login,
-                "password": password
-            })
+            status, data = await asyncio.to_thread(_api_login, login, password)
             
-            if r.status_code == 200:
-                data = r.json()
+            if status == 200:
                 
                 # Зберігаємо в БД з паролем для автоматичного оновлення
                 save_session(
@@ -1528,7 +2102,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             await context.bot.send_message(OWNER_ID, notify_text, reply_markup=kb)
         except Exception as e:
-            print(f"[SUPPORT] Could not notify owner {OWNER_ID}: {e}")
+            support_log.warning("Could not notify owner %s: %s", OWNER_ID, e)
 
         # Повідомляємо додаткових адміністраторів, якщо вказані
         admin_env = os.getenv('ADMIN_IDS', '')
@@ -1537,7 +2111,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 try:
                     await context.bot.send_message(int(aid), notify_text, reply_markup=kb)
                 except Exception as e:
-                    print(f"[SUPPORT] Could not notify admin {aid}: {e}")
+                    support_log.warning("Could not notify admin %s: %s", aid, e)
 
         await update.message.reply_text(
             f"✅ Ваше звернення #{ticket_id} зафіксовано!\n\n"
@@ -1567,7 +2141,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             await context.bot.send_message(OWNER_ID, notify_text, reply_markup=kb)
         except Exception as e:
-            print(f"[VIP REQUEST] Could not notify owner {OWNER_ID}: {e}")
+            vip_request_log.warning("Could not notify owner %s: %s", OWNER_ID, e)
 
         # Повідомляємо адмінів (ADMIN_IDS in env) якщо вказані
         admin_env = os.getenv('ADMIN_IDS', '')
@@ -1576,7 +2150,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 try:
                     await context.bot.send_message(int(aid), notify_text, reply_markup=kb)
                 except Exception as e:
-                    print(f"[VIP REQUEST] Could not notify admin {aid}: {e}")
+                    vip_request_log.warning("Could not notify admin %s: %s", aid, e)
 
         await update.message.reply_text(f"✅ Ваша заявка на VIP #{ticket_id} відправлена! Адмін зв'яжеться з вами.")
         context.user_data.clear()
@@ -1649,237 +2223,298 @@ async def get_date_for_weekday(day_name: str) -> str:
     
     return target.strftime('%Y-%m-%d')
 
-async def schedule_for_date(query_or_update, context: ContextTypes.DEFAULT_TYPE, date: str):
-    """Отримує розклад на конкретну дату (компактне форматування + домашка прив'язана до конкретного уроку)"""
-    user_id = (query_or_update.from_user.id if hasattr(query_or_update, 'from_user')
-               else query_or_update.effective_user.id)
+def split_diary_tasks(tasks: list) -> tuple[str | None, list[str]]:
+    """Ділить записи щоденника на тему уроку та домашнє завдання"""
+    topic_parts: list[str] = []
+    homework_parts: list[str] = []
 
-    def split_diary_tasks(tasks: list) -> tuple[str | None, list[str]]:
-        topic_parts: list[str] = []
-        homework_parts: list[str] = []
+    for raw in tasks or []:
+        # Разбиваем по переносам строк (данные могут прийти как одна строка с \n)
+        for line in str(raw).split('\n'):
+            s = line.strip()
+            if not s:
+                continue
 
-        for raw in tasks or []:
-            # Разбиваем по переносам строк (данные могут прийти как одна строка с \n)
-            for line in str(raw).split('\n'):
-                s = line.strip()
-                if not s:
-                    continue
+            # Мусор: числа, одиночные буквы (Н, П, В и т.д.)
+            if re.fullmatch(r"\d+", s):
+                continue
+            if re.fullmatch(r"[A-Za-zА-Яа-яЄєІіЇїҐґ]", s):
+                continue
 
-                # Мусор: числа, одиночные буквы (Н, П, В и т.д.)
-                if re.fullmatch(r"\d+", s):
-                    continue
-                if re.fullmatch(r"[A-Za-zА-Яа-яЄєІіЇїҐґ]", s):
-                    continue
+            # Тема: только строки с "Поточна:" или "Тема:"
+            m_topic = re.match(r"^(поточна|тема)\s*[:\-]?\s*(.*)$", s, flags=re.IGNORECASE)
+            if m_topic:
+                topic_parts.append((m_topic.group(2) or '').strip())
+                continue
 
-                # Тема: только строки с "Поточна:" или "Тема:"
-                m_topic = re.match(r"^(поточна|тема)\s*[:\-]?\s*(.*)$", s, flags=re.IGNORECASE)
-                if m_topic:
-                    topic_parts.append((m_topic.group(2) or '').strip())
-                    continue
+            # Всё остальное — ДЗ. Убираем префикс "Д/з:" / "ДЗ:" если есть
+            hw_text = s
+            m_hw = re.match(r"^(д\s*/\s*з|дз)\s*[:\-]?\s*(.*)$", s, flags=re.IGNORECASE)
+            if m_hw:
+                hw_text = (m_hw.group(2) or '').strip()
+
+            if hw_text:
+                homework_parts.append(hw_text)
+
+    topic_text = "\n".join([p for p in topic_parts if p]) or None
+    return topic_text, [p for p in homework_parts if p]
+
+SCHEDULE_DAYS_KB = InlineKeyboardMarkup([[
+    InlineKeyboardButton("Пн", callback_data="schedule:Понеділок"),
+    InlineKeyboardButton("Вт", callback_data="schedule:Вівторок"),
+    InlineKeyboardButton("Ср", callback_data="schedule:Середа"),
+    InlineKeyboardButton("Чт", callback_data="schedule:Четвер"),
+    InlineKeyboardButton("Пт", callback_data="schedule:П'ятниця")
+]])
+
+
+def fetch_schedule(scraper, endpoint: str, session, start_date: str, end_date: str = None):
+    """POST /v1/schedule/<endpoint> (timetable або diary) за діапазон дат"""
+    return scraper.post(
+        f"{API_BASE}/v1/schedule/{endpoint}",
+        headers={"Authorization": f"Bearer {session['token']}"},
+        json={"student_id": session['student_id'], "start_date": start_date, "end_date": end_date or start_date},
+        timeout=SCRAPER_TIMEOUT,
+    )
 
-                # Всё остальное — ДЗ. Убираем префикс "Д/з:" / "ДЗ:" если есть
-                hw_text = s
-                m_hw = re.match(r"^(д\s*/\s*з|дз)\s*[:\-]?\s*(.*)$", s, flags=re.IGNORECASE)
-                if m_hw:
-                    hw_text = (m_hw.group(2) or '').strip()
 
-                if hw_text:
-                    homework_parts.append(hw_text)
+def school_week(date: str):
+    """(понеділок, п'ятниця) тижня, до якого належить date; None для вихідних"""
+    d = datetime.strptime(date, '%Y-%m-%d')
+    if d.weekday() > 4:
+        return None
+    monday = d - timedelta(days=d.weekday())
+    return monday.strftime('%Y-%m-%d'), (monday + timedelta(days=4)).strftime('%Y-%m-%d')
 
-        topic_text = "\n".join([p for p in topic_parts if p]) or None
-        return topic_text, [p for p in homework_parts if p]
 
-    session = get_session(user_id)
-    if not session:
-        text = '❌ Спочатку увійдіть: /start'
-        if hasattr(query_or_update, 'edit_message_text'):
-            await query_or_update.edit_message_text(text)
-        else:
-            await query_or_update.message.reply_text(text)
-        return
+def split_schedule_by_day(payload: dict, default_date: str = None):
+    """{'dates': [...]} -> {date: {'dates': [...]}}; None, якщо в дня немає дати"""
+    days = {}
+    for day in (payload or {}).get('dates', []):
+        date = str(day.get('date') or '')[:10] or default_date
+        if not date:
+            return None
+        days.setdefault(date, {'dates': []})['dates'].append(day)
+    return days
+
 
+def _download_schedule(session, start_date: str, end_date: str):
+    """Блокуючий виклик: {endpoint: (status_code, payload | None)} для timetable і diary (незалежно)"""
+    result = {}
+    with get_scraper() as scraper:
+        for endpoint in ('timetable', 'diary'):
+            r = fetch_schedule(scraper, endpoint, session, start_date, end_date)
+            result[endpoint] = (r.status_code, r.json() if r.status_code == 200 else None)
+    return result
+
+
+async def load_schedule(user_id: int, session, start_date: str, end_date: str):
+    """Завантажує розклад і домашку за діапазон дат; кожна частина може завантажитись без іншої.
+
+    Повертає (entry, error): entry = {'fetched_at', 'timetable': {date: payload} | None,
+    'diary': {date: payload} | None, 'errors': {endpoint: код відповіді}}; entry = None, якщо не вдалось
+    жодне, тоді error — 'expired', код відповіді розкладу або 'unsplit' (API не вказав дати днів).
+    """
+    result = await asyncio.to_thread(_download_schedule, session, start_date, end_date)
+    if any(status == 401 for status, _ in result.values()):
+        session = await refresh_session(user_id)
+        if not session:
+            return None, 'expired'
+        result = await asyncio.to_thread(_download_schedule, session, start_date, end_date)
+
+    default_date = start_date if start_date == end_date else None
+    entry = {'fetched_at': time.time(), 'errors': {}}
+    for endpoint, (status, payload) in result.items():
+        if status != 200:
+            entry[endpoint] = None
+            entry['errors'][endpoint] = status
+            continue
+        days = split_schedule_by_day(payload, default_date)
+        if days is None:
+            return None, 'unsplit'
+        entry[endpoint] = days
+    if entry['timetable'] is None and entry['diary'] is None:
+        return None, entry['errors']['timetable']
+    return entry, None
+
+
+# (student_id, понеділок) -> розклад і домашка на Пн–Пт
+_WEEK_CACHE = LRUCache(PREFS_CACHE_SIZE, ttl=WEEK_CACHE_MAX_AGE)
+_WEEK_REFRESHING = set()
+
+
+async def _refresh_week(user_id: int, student_id: str, week):
+    """Фонове оновлення тижня після WEEK_CACHE_REFRESH_AFTER"""
+    key = (student_id, week[0])
     try:
-        r = get_scraper().post(
-            f"{API_BASE}/v1/schedule/timetable",
-            headers={"Authorization": f"Bearer {session['token']}"},
-            json={
-                "student_id": session['student_id'],
-                "start_date": date,
-                "end_date": date
-            }
-        )
+        # Користувач міг вийти або увійти як інший учень, поки задача чекала
+        session = get_session(user_id)
+        if not session or session['student_id'] != student_id:
+            return
+        entry, error = await load_schedule(user_id, session, *week)
+        if entry is not None:
+            _WEEK_CACHE.set(key, entry)
+        else:
+            schedule_log.info("Week refresh for user %s failed: %s", user_id, error)
+    except Exception as e:
+        schedule_log.warning("Week refresh for user %s failed: %s", user_id, e)
+    finally:
+        _WEEK_REFRESHING.discard(key)
 
-        # Якщо токен застарів, оновлюємо
-        if r.status_code == 401:
-            new_session = await refresh_session(user_id)
-            if new_session:
-                r = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/timetable",
-                    headers={"Authorization": f"Bearer {new_session['token']}"},
-                    json={
-                        "student_id": new_session['student_id'],
-                        "start_date": date,
-                        "end_date": date
-                    }
-                )
-            else:
-                text = '❌ Сесія застаріла. Використайте /logout та /start'
-                if hasattr(query_or_update, 'edit_message_text'):
-                    await query_or_update.edit_message_text(text)
-                else:
-                    await query_or_update.message.reply_text(text)
-                return
 
-        # Получаем домашку из diary
-        r_hw = get_scraper().post(
-            f"{API_BASE}/v1/schedule/diary",
-            headers={"Authorization": f"Bearer {session['token']}"},
-            json={
-                "student_id": session['student_id'],
-                "start_date": date,
-                "end_date": date
-            }
-        )
+async def get_schedule_day(user_id: int, session, date: str, context=None):
+    """Розклад і домашка на день: (timetable | None, diary | None, error розкладу).
 
-        if r_hw.status_code == 401:
-            new_session = await refresh_session(user_id)
-            if new_session:
-                session = new_session
-                r_hw = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/diary",
-                    headers={"Authorization": f"Bearer {session['token']}"},
-                    json={
-                        "student_id": session['student_id'],
-                        "start_date": date,
-                        "end_date": date
-                    }
-                )
+    Перший перегляд тижня завантажує Пн–Пт одним запитом на endpoint; наступні дні беруться з кешу,
+    а після WEEK_CACHE_REFRESH_AFTER тиждень оновлюється у фоні.
+    """
+    week = school_week(date)
+    entry = None
+    if week is not None:
+        key = (session['student_id'], week[0])
+        entry = _WEEK_CACHE.get(key)
+        # Тиждень, у якому не завантажилась одна з частин, завантажуємо знову при кожному перегляді
+        if entry is None or entry['errors']:
+            entry, error = await load_schedule(user_id, session, *week)
+            if error == 'expired':
+                return None, None, error
+            if entry is not None:
+                _WEEK_CACHE.set(key, entry)
+        elif (time.time() - entry['fetched_at'] >= WEEK_CACHE_REFRESH_AFTER
+              and key not in _WEEK_REFRESHING and context is not None):
+            _WEEK_REFRESHING.add(key)
+            context.application.create_task(_refresh_week(user_id, session['student_id'], week))
+
+    if entry is None:
+        # Вихідний день або тиждень не вдалось розбити по днях — запит лише за цей день
+        entry, error = await load_schedule(user_id, session, date, date)
+        if entry is None:
+            return None, None, error
+    empty = {'dates': []}
+    timetable = entry['timetable'].get(date, empty) if entry['timetable'] is not None else None
+    diary = entry['diary'].get(date, empty) if entry['diary'] is not None else None
+    return timetable, diary, entry['errors'].get('timetable')
+
+
+def is_hidden_lesson(num, weekday_num: int, user_8th_day, has_8th) -> bool:
+    """Чи приховувати урок з номером 8+ згідно з налаштуванням користувача"""
+    if num is None or num < 8:
+        return False
+    if has_8th == 0:
+        # У пользователя нет 8 уроков - пропускаем все 8+
+        return True
+    # У пользователя есть 8 уроков только в определенный день
+    return has_8th == 1 and user_8th_day is not None and weekday_num != user_8th_day
+
+
+def render_schedule(date: str, data: dict, hw_data: dict, user_8th_day, has_8th) -> str:
+    """Markdown-розклад на день; домашка прив'язана до конкретного уроку"""
+    # Собираем домашку по (предмет, номер урока) — чтобы не смешивать уроки одного предмета
+    homework_dict = {}
+    for day in (hw_data or {}).get('dates', []):
+        for call in day.get('calls', []):
+            call_num = call.get('call_number')
+            for subj in call.get('subjects', []):
+                name = subj.get('subject_name', 'Невідомо')
+                tasks = subj.get('hometask', []) or []
+                # Фильтруем мусор
+                topic_text, hw_parts = split_diary_tasks(tasks)
+                # Ключ = (предмет, номер урока)
+                key = (name, call_num)
+                if hw_parts:
+                    # Накапливаем, а не перезаписываем
+                    if key in homework_dict:
+                        homework_dict[key] += ', ' + ', '.join(hw_parts)
+                    else:
+                        homework_dict[key] = ', '.join(hw_parts)
 
-        # Собираем домашку по (предмет, номер урока) — чтобы не смешивать уроки одного предмета
-        homework_dict = {}
-        if r_hw.status_code == 200:
-            hw_data = r_hw.json()
-            for day in hw_data.get('dates', []):
-                for call in day.get('calls', []):
-                    call_num = call.get('call_number')
-                    for subj in call.get('subjects', []):
-                        name = subj.get('subject_name', 'Невідомо')
-                        tasks = subj.get('hometask', []) or []
-                        # Фильтруем мусор
-                        topic_text, hw_parts = split_diary_tasks(tasks)
-                        # Ключ = (предмет, номер урока)
-                        key = (name, call_num)
-                        if hw_parts:
-                            # Накапливаем, а не перезаписываем
-                            if key in homework_dict:
-                                homework_dict[key] += ', ' + ', '.join(hw_parts)
-                            else:
-                                homework_dict[key] = ', '.join(hw_parts)
+    date_obj = datetime.strptime(date, '%Y-%m-%d')
+    day_name = WEEKDAYS[date_obj.weekday()]
+    weekday_num = date_obj.weekday()  # 0=Понедельник, 4=Пятница
 
-        if r.status_code == 200:
-            data = r.json()
+    lines = [f"📅 *{date_obj.strftime('%d.%m')}* • {day_name}\n"]
+    for day in data.get('dates', []):
+        for call in day.get('calls', []):
+            num = call.get('call_number')
+            if is_hidden_lesson(num, weekday_num, user_8th_day, has_8th):
+                continue
+            time_start = call.get('time_start') or ''
+            for subj in call.get('subjects', []):
+                name = subj.get('subject_name', 'Невідомо')
+                room = subj.get('room', '') or (subj.get('classroom') or {}).get('name', '') or ''
+                room_number = re.sub(r'[^\d]', '', str(room)) if room else ''
 
-            # Форматування дати
-            date_obj = datetime.strptime(date, '%Y-%m-%d')
-            day_name = WEEKDAYS[date_obj.weekday()]
-            weekday_num = date_obj.weekday()  # 0=Понедельник, 4=Пятница
-            
-            # Получаем настройку дня с 8 уроками для пользователя
-            user_8th_day, has_8th = get_user_8th_lesson_day(user_id)
-
-            message = f"📅 *{date_obj.strftime('%d.%m')}* • {day_name}\n\n"
-
-            has_lessons = False
-            for day in data.get('dates', []):
-                for call in day.get('calls', []):
-                    num = call.get('call_number')
-                    # Пропускаем уроки с номером 8 и больше в зависимости от настройки пользователя
-                    if num is not None and num >= 8:
-                        if has_8th == 0:
-                            # У пользователя нет 8 уроков - пропускаем все 8+
-                            continue
-                        elif has_8th == 1 and user_8th_day is not None:
-                            # У пользователя есть 8 уроков только в определенный день
-                            if weekday_num != user_8th_day:
-                                continue
-                    
-                    time_start = call.get('time_start') or ''
-                    time_end = call.get('time_end') or ''
-                    for subj in call.get('subjects', []):
-                        has_lessons = True
-                        name = subj.get('subject_name', 'Невідомо')
-                        room = subj.get('room', '') or (subj.get('classroom') or {}).get('name', '') or ''
-                        room_number = re.sub(r'[^\d]', '', str(room)) if room else ''
-
-                        # Компактный вывод в одну-две строки, всегда показываем 🚪
-                        room_str = f" 🚪{room_number}" if room_number else " 🚪—"
-                        message += f"`{num}.` *{time_start}* {name}{room_str}\n"
-
-                        # ДЗ — показываем всегда
-                        key = (name, num)
-                        if key in homework_dict:
-                            message += f"    📝 _{homework_dict[key]}_\n"
-                        else:
-                            message += "    📝 —\n"
+                # Компактный вывод в одну-две строки, всегда показываем 🚪
+                room_str = f" 🚪{room_number}" if room_number else " 🚪—"
+                lines.append(f"`{num}.` *{time_start}* {name}{room_str}")
 
-            if not has_lessons:
-                message = f"🌴 *{date_obj.strftime('%d.%m')}* • {day_name}\nУроків немає!"
+                # ДЗ — показываем всегда
+                lines.append(f"    📝 _{homework_dict[(name, num)]}_" if (name, num) in homework_dict else "    📝 —")
 
-            # Inline-кнопки с днями недели (компактно в один ряд)
-            days_kb = InlineKeyboardMarkup([[
-                InlineKeyboardButton("Пн", callback_data="schedule:Понеділок"),
-                InlineKeyboardButton("Вт", callback_data="schedule:Вівторок"),
-                InlineKeyboardButton("Ср", callback_data="schedule:Середа"),
-                InlineKeyboardButton("Чт", callback_data="schedule:Четвер"),
-                InlineKeyboardButton("Пт", callback_data="schedule:П'ятниця")
-            ]])
+    if len(lines) == 1:
+        return f"🌴 *{date_obj.strftime('%d.%m')}* • {day_name}\nУроків немає!"
+    return "\n".join(lines) + "\n"
 
-            if hasattr(query_or_update, 'edit_message_text'):
-                try:
-                    await query_or_update.edit_message_text(message, parse_mode=ParseMode.MARKDOWN, reply_markup=days_kb)
-                except BadRequest as e:
-                    # Игнорируем ошибку "Message is not modified" при повторном нажатии на тот же день
-                    if "message is not modified" in str(e).lower():
-                        # Просто отвечаем на callback, чтобы убрать индикатор загрузки
-                        try:
-                            await query_or_update.answer()
-                        except:
-                            pass
-                    else:
-                        raise
-            else:
-                await query_or_update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, reply_markup=days_kb)
-        else:
-            text = f"❌ Не вдалось отримати розклад (код: {r.status_code})"
-            if hasattr(query_or_update, 'edit_message_text'):
-                try:
-                    await query_or_update.edit_message_text(text)
-                except BadRequest as e:
-                    if "message is not modified" in str(e).lower():
-                        try:
-                            await query_or_update.answer()
-                        except:
-                            pass
-                    else:
-                        raise
-            else:
-                await query_or_update.message.reply_text(text)
+
+async def schedule_for_date(query_or_update, context: ContextTypes.DEFAULT_TYPE, date: str):
+    """Отримує розклад на конкретну дату (компактне форматування + домашка прив'язана до конкретного уроку)"""
+    user_id = (query_or_update.from_user.id if hasattr(query_or_update, 'from_user')
+               else query_or_update.effective_user.id)
+
+    session = get_session(user_id)
+    if not session:
+        await edit_or_reply(query_or_update, '❌ Спочатку увійдіть: /start')
+        return
+
+    try:
+        timetable, diary, error = await get_schedule_day(user_id, session, date, context)
+        if error == 'expired':
+            await edit_or_reply(query_or_update, '❌ Сесія застаріла. Використайте /logout та /start')
+            return
+        if timetable is None:
+            await edit_or_reply(query_or_update, f"❌ Не вдалось отримати розклад (код: {error})")
+            return
+
+        user_8th_day, has_8th = get_user_8th_lesson_day(user_id)
+        # Повторне натискання того ж дня з тими ж даними не рендерить і не редагує повідомлення
+        message, digest = render_cached('schedule', render_schedule, date, timetable, diary, user_8th_day, has_8th)
+        await edit_or_reply(query_or_update, message, digest, parse_mode=ParseMode.MARKDOWN, reply_markup=SCHEDULE_DAYS_KB)
 
     except Exception as e:
-        text = f"❌ Помилка: {e}"
-        if hasattr(query_or_update, 'edit_message_text'):
-            try:
-                await query_or_update.edit_message_text(text)
-            except BadRequest as e:
-                if "message is not modified" in str(e).lower():
-                    try:
-                        await query_or_update.answer()
-                    except:
-                        pass
-                else:
-                    raise
-        else:
-            await query_or_update.message.reply_text(text)
+        await edit_or_reply(query_or_update, f"❌ Помилка: {e}")
+
+
+def render_homework(date: str, data: dict, user_8th_day, has_8th) -> str:
+    """Markdown-список домашніх завдань на день"""
+    date_obj = datetime.strptime(date, '%Y-%m-%d')
+    day_name = WEEKDAYS[date_obj.weekday()]
+    weekday_num = date_obj.weekday()  # 0=Понедельник, 4=Пятница
+
+    message = f"📚 *Домашнє завдання на {date_obj.strftime('%d.%m.%Y')}* ({day_name})\n\n"
+
+    has_homework = False
+    for day in data.get('dates', []):
+        for call in day.get('calls', []):
+            num = call.get('call_number')
+            if is_hidden_lesson(num, weekday_num, user_8th_day, has_8th):
+                continue
+            time_start = call.get('time_start') or ''
+            time_end = call.get('time_end') or ''
+            for subj in call.get('subjects', []):
+                name = subj.get('subject_name', 'Невідомо')
+                tasks = subj.get('hometask', []) or []
+                tasks_filtered = [str(t).strip() for t in tasks if t and str(t).strip()]
+                if tasks_filtered:
+                    has_homework = True
+                    message += f"*{num}. {time_start}-{time_end}*\n"
+                    message += f"📖 {name}\n"
+                    hw_text = "\n".join(tasks_filtered)
+                    message += f"ДЗ: {hw_text}\n\n"
+
+    if not has_homework:
+        message = f"✅ На {date_obj.strftime('%d.%m.%Y')} ({day_name}) домашки немає!"
+    return message
+
 
 async def homework_for_date(query_or_update, context: ContextTypes.DEFAULT_TYPE, date: str):
     """Отримує домашнє завдання на конкретну дату"""
@@ -1888,101 +2523,275 @@ async def homework_for_date(query_or_update, context: ContextTypes.DEFAULT_TYPE,
 
     session = get_session(user_id)
     if not session:
-        text = '❌ Спочатку увійдіть: /start'
-        if hasattr(query_or_update, 'edit_message_text'):
-            await query_or_update.edit_message_text(text)
-        else:
-            await query_or_update.message.reply_text(text)
+        await edit_or_reply(query_or_update, '❌ Спочатку увійдіть: /start')
         return
 
     try:
-        r = get_scraper().post(
-            f"{API_BASE}/v1/schedule/diary",
+        timetable, diary, error = await get_schedule_day(user_id, session, date, context)
+        if error == 'expired':
+            await edit_or_reply(query_or_update, '❌ Сесія застаріла. Використайте /logout та /start')
+            return
+        if diary is None:
+            await edit_or_reply(query_or_update, '❌ Не вдалось отримати домашку')
+            return
+
+        user_8th_day, has_8th = get_user_8th_lesson_day(user_id)
+        message, digest = render_cached('homework', render_homework, date, diary, user_8th_day, has_8th)
+        await edit_or_reply(query_or_update, message, digest, parse_mode=ParseMode.MARKDOWN)
+
+    except Exception as e:
+        await edit_or_reply(query_or_update, f"❌ Помилка: {e}")
+
+# ============== ОЦІНКИ ==============
+
+GRADES_URL = "https://nz.ua/schedule/grades-statement"
+WEB_LOGIN_URL = "https://nz.ua/login"
+WEB_HEADERS = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': GRADES_URL}
+# Джерела оцінок у порядку спроб
+GRADE_SOURCES = ('api', 'html')
+
+
+class GradesResult(NamedTuple):
+    """Результат get_marks: оцінки по предметах і звідки вони взялися"""
+    subjects: dict          # {предмет: [Mark, ...]}
+    source: Optional[str]   # 'api' | 'html' | None (жодне джерело не відповіло)
+    start: str              # фактичний діапазон (для HTML — видимий на сторінці)
+    end: str
+    dated: bool             # чи мають HTML-оцінки власні дати
+    error: Optional[str]
+
+
+def school_year_range(today: datetime = None):
+    """(1 серпня поточного навчального року, сьогодні) у форматі YYYY-MM-DD"""
+    today = today or datetime.now()
+    aug1 = datetime(today.year if today.month >= 8 else today.year - 1, 8, 1)
+    return aug1.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+
+
+def _download_api_marks(session, start: str, end: str):
+    """Блокуючий виклик: (status_code, json | None) від student-performance"""
+    with get_scraper() as scraper:
+        r = scraper.post(
+            f"{API_BASE}/v1/schedule/student-performance",
             headers={"Authorization": f"Bearer {session['token']}"},
-            json={"student_id": session['student_id'], "start_date": date, "end_date": date}
+            json={"student_id": session['student_id'], "start_date": start, "end_date": end},
+            timeout=SCRAPER_TIMEOUT,
         )
+        if r.status_code != 200:
+            return r.status_code, None
+        return 200, r.json()
 
-        if r.status_code == 401:
-            new_session = await refresh_session(user_id)
-            if new_session:
-                r = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/diary",
-                    headers={"Authorization": f"Bearer {new_session['token']}"},
-                    json={"student_id": new_session['student_id'], "start_date": date, "end_date": date}
-                )
-            else:
-                text = '❌ Сесія застаріла. Використайте /logout та /start'
-                if hasattr(query_or_update, 'edit_message_text'):
-                    await query_or_update.edit_message_text(text)
-                else:
-                    await query_or_update.message.reply_text(text)
-                return
 
-        if r.status_code == 200:
-            data = r.json()
-            date_obj = datetime.strptime(date, '%Y-%m-%d')
-            day_name = WEEKDAYS[date_obj.weekday()]
-            weekday_num = date_obj.weekday()  # 0=Понедельник, 4=Пятница
-            
-            # Получаем настройку дня с 8 уроками для пользователя
-            user_8th_day, has_8th = get_user_8th_lesson_day(user_id)
-            
-            message = f"📚 *Домашнє завдання на {date_obj.strftime('%d.%m.%Y')}* ({day_name})\n\n"
-
-            has_homework = False
-            for day in data.get('dates', []):
-                for call in day.get('calls', []):
-                    num = call.get('call_number')
-                    # Пропускаем уроки с номером 8 и больше в зависимости от настройки пользователя
-                    if num is not None and num >= 8:
-                        if has_8th == 0:
-                            # У пользователя нет 8 уроков - пропускаем все 8+
-                            continue
-                        elif has_8th == 1 and user_8th_day is not None:
-                            # У пользователя есть 8 уроков только в определенный день
-                            if weekday_num != user_8th_day:
-                                continue
-                    
-                    time_start = call.get('time_start') or ''
-                    time_end = call.get('time_end') or ''
-                    for subj in call.get('subjects', []):
-                        name = subj.get('subject_name', 'Невідомо')
-                        tasks = subj.get('hometask', []) or []
-                        tasks_filtered = [str(t).strip() for t in tasks if t and str(t).strip()]
-                        if tasks_filtered:
-                            has_homework = True
-                            message += f"*{num}. {time_start}-{time_end}*\n"
-                            message += f"📖 {name}\n"
-                            hw_text = "\n".join(tasks_filtered)
-                            message += f"ДЗ: {hw_text}\n\n"
-
-            if not has_homework:
-                message = f"✅ На {date_obj.strftime('%d.%m.%Y')} ({day_name}) домашки немає!"
-
-            if hasattr(query_or_update, 'edit_message_text'):
-                await query_or_update.edit_message_text(message, parse_mode=ParseMode.MARKDOWN)
-            else:
-                await query_or_update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-        else:
-            text = '❌ Не вдалось отримати домашку'
-            if hasattr(query_or_update, 'edit_message_text'):
-                await query_or_update.edit_message_text(text)
-            else:
-                await query_or_update.message.reply_text(text)
+def api_marks_to_subjects(data: dict) -> dict:
+    """JSON student-performance -> {предмет: [Mark, ...]} (предмети без оцінок теж)"""
+    subjects = {}
+    for subj in (data or {}).get('subjects', []):
+        name = (subj.get('subject_name') or '').strip()
+        if name:
+            subjects[name] = [to_mark(m) for m in subj.get('marks', []) or []]
+    return subjects
+
+
+def _is_grades_page(page) -> bool:
+    return page is not None and page.status_code == 200 and ('Виписка оцінок' in page.text or 'Отримані результати' in page.text)
+
+
+def _fetch_grades_page(scraper, session, params: dict, login: bool):
+    """Блокуючий виклик: HTML виписки оцінок або None; login=True — спершу вхід на сайт"""
+    if login:
+        page = scraper.get(WEB_LOGIN_URL, timeout=SCRAPER_TIMEOUT, headers=WEB_HEADERS)
+        csrf = extract_login_form(page.content).csrf
+        login_data = {
+            "LoginForm[login]": session['username'],
+            "LoginForm[password]": session['password'],
+            "LoginForm[rememberMe]": "1"
+        }
+        lheaders = {'Referer': GRADES_URL}
+        if csrf:
+            login_data['_csrf'] = csrf
+            lheaders['X-CSRF-Token'] = csrf
+        scraper.post(WEB_LOGIN_URL, data=login_data, headers=lheaders, timeout=SCRAPER_TIMEOUT)
+    page = fetch_html_until(scraper, GRADES_URL, GRADES_PAGE_MARKERS, params=params, timeout=SCRAPER_TIMEOUT, headers=WEB_HEADERS)
+    return page.text if _is_grades_page(page) else None
+
+
+async def load_grades_html(session, params: dict):
+    """(html | None, error): до GRADES_HTML_ATTEMPTS входів на сайт з експоненційною паузою між ними"""
+    error = None
+    with get_scraper() as scraper:
+        for attempt in range(GRADES_HTML_ATTEMPTS + 1):
+            if attempt > 1:
+                await asyncio.sleep(GRADES_RETRY_BACKOFF * 2 ** (attempt - 2))
+            try:
+                # Перша спроба — без логіну, далі — вхід і повторний запит; cookies спільні для всіх спроб
+                html = await asyncio.to_thread(_fetch_grades_page, scraper, session, params, attempt > 0)
+                if html:
+                    return html, None
+            except Exception as e:
+                error = str(e)
+                grades_log.debug("grades-statement attempt %s failed: %s", attempt, e)
+    return None, error
+
 
+def filter_marks_by_range(subs: dict, start: str, end: str) -> dict:
+    """Лишає оцінки з датою в [start, end] і всі оцінки без дати; порожні предмети відкидаються"""
+    filtered = {}
+    for name, marks in subs.items():
+        kept = [m for m in marks if not m.date or start <= m.date <= end]
+        if kept:
+            filtered[name] = kept
+    return filtered
+
+
+def _count_marks(subjects: dict, start: str = None, end: str = None) -> int:
+    """Кількість оцінок; з start/end — лише з датою в діапазоні (і без дати)"""
+    if start is None:
+        return sum(len(marks) for marks in subjects.values())
+    return sum(1 for marks in subjects.values() for m in marks if not m.date or start <= m.date <= end)
+
+
+async def _load_api_marks(user_id: int, session, start: str, end: str):
+    """(GradesResult | None, error); error == 'expired', якщо токен не вдалось оновити"""
+    try:
+        status, data = await asyncio.to_thread(_download_api_marks, session, start, end)
+        if status == 401:
+            grades_log.info("API returned 401, attempting refresh")
+            session = await refresh_session(user_id)
+            if not session:
+                return None, 'expired'
+            status, data = await asyncio.to_thread(_download_api_marks, session, start, end)
     except Exception as e:
-        text = f"❌ Помилка: {e}"
-        if hasattr(query_or_update, 'edit_message_text'):
-            await query_or_update.edit_message_text(text)
+        grades_log.warning("API request failed: %s", e)
+        return None, str(e)
+    if status != 200:
+        grades_log.warning("API response not OK: %s", status)
+        return None, f"API {status}"
+    return GradesResult(api_marks_to_subjects(data), 'api', start, end, False, None), None
+
+
+async def _load_html_marks(session, start: str, end: str, exact_range: bool):
+    """(GradesResult | None, error) з HTML-виписки оцінок"""
+    params = {'student_id': session['student_id']}
+    if exact_range:
+        params['date_from'] = start
+        params['date_to'] = end
+    html, error = await load_grades_html(session, params)
+    if not html:
+        grades_log.warning("HTML loading failed: %s", error)
+        return None, error
+    sd, ed, subs = await asyncio.to_thread(parse_grades_from_html, html)
+    grades_log.debug("HTML parsed: %s subjects found, date range: %s - %s", len(subs), sd, ed)
+    if not subs:
+        grades_log.warning("HTML parser returned 0 subjects!")
+    if not exact_range and sd and ed:
+        # Без явного діапазону показуємо період, який видно на сторінці
+        start, end = sd, ed
+    dated = any(m.date for marks in subs.values() for m in marks)
+    return GradesResult(filter_marks_by_range(subs, start, end), 'html', start, end, dated, None), None
+
+
+async def _probe_grade_sources(user_id: int, session, start: str, end: str, exact_range: bool):
+    """Опитує обидва джерела одночасно й запам'ятовує те, що дає повні дані.
+
+    API вважається повним, якщо за видимий на HTML-сторінці період у ньому не менше оцінок, ніж на сторінці.
+    """
+    (api, api_error), (html, html_error) = await asyncio.gather(
+        _load_api_marks(user_id, session, start, end),
+        _load_html_marks(session, start, end, exact_range),
+    )
+    if api_error == 'expired':
+        return GradesResult({}, None, start, end, False, 'expired')
+    api_count = _count_marks(api.subjects) if api else 0
+    html_count = _count_marks(html.subjects) if html else 0
+    if html_count and (not api_count or _count_marks(api.subjects, html.start, html.end) < html_count):
+        chosen = html
+    elif api is not None:
+        chosen = api
+    else:
+        chosen = html
+    student_id = session['student_id']
+    if chosen is not None and (api_count or html_count):
+        pref = record_grade_sources(student_id, {'api': bool(api_count), 'html': bool(html_count)}, chosen.source, probed=True)
+        grades_log.info("Grade source for student %s: %s (api %s marks, html %s marks; hit rate api %.0f%%, html %.0f%%)",
+                        student_id, chosen.source, api_count, html_count,
+                        pref.hit_rate('api') * 100, pref.hit_rate('html') * 100)
+    return chosen or GradesResult({}, None, start, end, False, html_error or api_error)
+
+
+async def _load_marks(user_id: int, session, start: str, end: str, sources, exact_range: bool):
+    student_id = session['student_id']
+    pref = get_grade_source(student_id)
+    if len(sources) > 1 and (pref is None or time.time() - pref.probed_at >= GRADE_SOURCE_REPROBE):
+        return await _probe_grade_sources(user_id, session, start, end, exact_range)
+
+    # Спершу джерело, що останнім дало повні дані; інше — лише якщо воно не відповіло або порожнє
+    order = sorted(sources, key=lambda s: s != pref.source) if pref is not None else list(sources)
+    outcomes = {}
+    result = empty = None
+    error = None
+    for source in order:
+        if source == 'api':
+            result, source_error = await _load_api_marks(user_id, session, start, end)
+            if source_error == 'expired':
+                return GradesResult({}, None, start, end, False, 'expired')
         else:
-            await query_or_update.message.reply_text(text)
+            result, source_error = await _load_html_marks(session, start, end, exact_range)
+        outcomes[source] = result is not None and _count_marks(result.subjects) > 0
+        if outcomes[source]:
+            break
+        error = source_error or error
+        if result is not None and empty is None:
+            empty = result
+        result = None
+    if result is None and empty is not None:
+        # Обидва джерела без оцінок: показуємо порожній період, але не зараховуємо це джерелу як влучання
+        # і не перемикаємо на нього (порожня відповідь може бути і збоєм сайту чи API)
+        return empty
+    if len(sources) > 1 and result is not None and pref is not None and result.source != pref.source:
+        grades_log.info("Grade source for student %s switched: %s -> %s", student_id, pref.source, result.source)
+    record_grade_sources(student_id, outcomes, result.source if result is not None and len(sources) > 1 else None)
+    return result or GradesResult({}, None, start, end, False, error)
+
+
+# (student_id, start, end, sources, exact_range) -> GradesResult
+_GRADES_CACHE = LRUCache(PREFS_CACHE_SIZE, ttl=GRADES_CACHE_TTL)
+_GRADES_JOBS = {}
+
+
+async def get_marks(user_id: int, session, start: str, end: str, *, sources=GRADE_SOURCES,
+                    exact_range: bool = False) -> GradesResult:
+    """Оцінки учня за [start, end].
+
+    Запит іде одразу до джерела, яке для цього учня останнім дало повні дані (get_grade_source);
+    інше джерело читається, лише якщо перше не відповіло або повернуло порожній результат.
+    Раз на GRADE_SOURCE_REPROBE обидва джерела опитуються й порівнюються заново.
+    Непорожній результат кешується на GRADES_CACHE_TTL і записується у сховище оцінок; однакові
+    одночасні запити виконуються один раз.
+    """
+    key = (str(session['student_id']), start, end, tuple(sources), exact_range)
+    cached = _GRADES_CACHE.get(key)
+    if cached is not None:
+        return cached
+    job = _GRADES_JOBS.get(key)
+    if job is None:
+        job = asyncio.ensure_future(_load_marks(user_id, session, start, end, tuple(sources), exact_range))
+        _GRADES_JOBS[key] = job
+        job.add_done_callback(lambda _: _GRADES_JOBS.pop(key, None))
+    result = await asyncio.shield(job)
+    # Відповідь без жодної оцінки не кешуємо й не записуємо: store_marks замінив би нею збережені оцінки періоду
+    if result.source is not None and _count_marks(result.subjects):
+        if key not in _GRADES_CACHE:
+            _GRADES_CACHE.set(key, result)
+            await asyncio.to_thread(store_marks, session['student_id'], result.subjects, result.start, result.end)
+    return result
+
 
 # ============== СЕРЕДНІЙ БАЛ ==============
 
 async def avg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показує оцінки та середній бал"""
     try:
-        print(f"[AVG] called by user={update.effective_user and update.effective_user.id} args={context.args}")
+        avg_log.debug("called by user=%s args=%s", update.effective_user and update.effective_user.id, context.args)
     except Exception:
         pass
     session = get_session(update.effective_user.id)
@@ -1994,7 +2803,7 @@ async def avg(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
     try:
-        print(f"[AVG] session for user {update.effective_user and update.effective_user.id}: {bool(session)}")
+        avg_log.debug("session for user %s: %s", update.effective_user and update.effective_user.id, bool(session))
     except Exception:
         pass
 
@@ -2024,449 +2833,121 @@ async def avg(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Неправильний формат дат. Використовуйте YYYY-MM-DD: `/avg 2025-08-21 2025-12-31`")
             return
 
-    # Беремо оцінки з початку навчального року (1-го серпня/початок підготовки) — використовуємо Aug 1 як дефолт
-    today = datetime.now()
-    year = today.year
-    aug1 = datetime(year, 8, 1)
-    if today < aug1:
-        aug1 = datetime(year - 1, 8, 1)
-
-    default_start = aug1.strftime('%Y-%m-%d')
+    # Беремо оцінки з початку навчального року (1 серпня)
+    default_start, today_str = school_year_range()
     start = start_arg or default_start
-    end = end_arg or datetime.now().strftime('%Y-%m-%d')
+    end = end_arg or today_str
 
     # валідація діапазону
-    try:
-        s_dt = datetime.strptime(start, '%Y-%m-%d')
-        e_dt = datetime.strptime(end, '%Y-%m-%d')
-        if e_dt < s_dt:
-            await update.message.reply_text("❌ 'end' менша за 'start'. Перевірте порядок дат.")
-            return
-    except Exception:
-        await update.message.reply_text("❌ Невірні дати")
+    if end < start:
+        await update.message.reply_text("❌ 'end' менша за 'start'. Перевірте порядок дат.")
         return
 
     try:
-        last_exc = None
-        # First, try to use the API response
-        r = get_scraper().post(
-            f"{API_BASE}/v1/schedule/student-performance",
-            headers={"Authorization": f"Bearer {session['token']}"},
-            json={
-                "student_id": session['student_id'],
-                "start_date": start,
-                "end_date": end
-            }
+        exact_range = bool(start_arg or end_arg)
+        # Джерело (API чи HTML-виписка) обирає get_marks за збереженою для учня перевагою
+        result = await get_marks(
+            update.effective_user.id, session, start, end,
+            sources=('api',) if force_api else GRADE_SOURCES,
+            exact_range=exact_range,
         )
+        if result.error == 'expired':
+            await update.message.reply_text("❌ Сесія застаріла. Використайте /logout та /start")
+            return
 
-        # Якщо токен застарів, оновлюємо
-        if r.status_code == 401:
-                print(f"[AVG] API returned 401, attempting refresh")
-                new_session = await refresh_session(update.effective_user.id)
-                if new_session:
-                    r = get_scraper().post(
-                        f"{API_BASE}/v1/schedule/student-performance",
-                        headers={"Authorization": f"Bearer {new_session['token']}"},
-                        json={
-                            "student_id": new_session['student_id'],
-                            "start_date": start,
-                            "end_date": end
-                        }
-                    )
-                else:
-                    await update.message.reply_text("❌ Сесія застаріла. Використайте /logout та /start")
-                    return
-
-        # Initialize variables
-        use_sources = None
-        api_data = None
-        used_api_due_to_html_failure = False
-        total_api_marks = 0
-
-        try:
-            print(f"[AVG] API status: {r.status_code}")
-            if r.status_code == 200:
-                try:
-                    api_preview = str(r.json())[:200]
-                except Exception:
-                    api_preview = str(r.text)[:200]
-                print(f"[AVG] API preview: {api_preview}")
-            else:
-                print(f"[AVG] API response not OK: {r.status_code} - {str(r.text)[:200]}")
-        except Exception as e:
-            print(f"[AVG] Error inspecting API response: {e}")
-        
-        # Parse API data if status is 200
-        if r.status_code == 200:
-            try:
-                api_data = r.json()
-                # Count API marks
-                total_api_marks = 0
-                for subj in api_data.get('subjects', []):
-                    total_api_marks += len(subj.get('marks', []) or [])
-                # Prefer API when forced or when user provided specific dates
-                if force_api or start_arg or end_arg:
-                    use_sources = 'api'
-                    print(f"[AVG] Using API (forced or date args): force_api={force_api}, start_arg={start_arg}, end_arg={end_arg}")
-                elif total_api_marks >= 15:
-                    use_sources = 'api'
-                    print(f"[AVG] Using API (enough marks: {total_api_marks})")
-                # If API returned empty result and no date args, try HTML as fallback
-                elif total_api_marks == 0 and not (start_arg or end_arg):
-                    use_sources = None  # Will try HTML
-                    print(f"[AVG] API returned empty ({total_api_marks} marks), will try HTML fallback")
-                else:
-                    use_sources = None  # Will try HTML
-                    print(f"[AVG] API has {total_api_marks} marks (< 15), will try HTML fallback")
-            except Exception as e:
-                print(f"[AVG] Error parsing API JSON: {e}")
-                api_data = None
-
-            # If API doesn't provide full history, try grades-statement HTML page
-            grades_html = None
-            # whether any per-mark dates were parsed from grades-statement tokens
-            grades_html_any_dates = False
-            if use_sources != 'api':
-                print(f"[AVG] Attempting to load HTML grades-statement...")
-                try:
-                    # Build URL and params; the site accepts date_from/date_to query params
-                    grades_url = f"https://nz.ua/schedule/grades-statement"
-                    params = {'student_id': session['student_id']}
-                    if start_arg:
-                        params['date_from'] = start_arg
-                    if end_arg:
-                        params['date_to'] = end_arg
-
-                    gresp = None
-                    last_exc = None
-                    headers = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': grades_url}
-                    # Створюємо один scraper для всієї сесії веб-логіну
-                    web_scraper = get_scraper()
-                    for attempt in range(4):
-                        try:
-                            gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                            if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                grades_html = gresp.text
-                                break
-                        except Exception as exc:
-                            last_exc = exc
-
-                        # Try logging in and retry
-                        try:
-                            login_url = "https://nz.ua/login"
-                            page = web_scraper.get(login_url, timeout=10, headers=headers)
-                            csrf = None
-                            from bs4 import BeautifulSoup
-                            login_soup = BeautifulSoup(page.text, 'html.parser')
-                            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-                            if meta_csrf:
-                                csrf = meta_csrf.get('content')
-                            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-                            if hidden_csrf and hidden_csrf.get('value'):
-                                csrf = hidden_csrf.get('value')
-
-                            login_data = {
-                                "LoginForm[login]": session['username'],
-                                "LoginForm[password]": session['password'],
-                                "LoginForm[rememberMe]": "1"
-                            }
-                            lheaders = {'Referer': grades_url}
-                            if csrf:
-                                login_data['_csrf'] = csrf
-                                lheaders['X-CSRF-Token'] = csrf
-
-                            web_scraper.post(login_url, data=login_data, headers=lheaders, timeout=10)
-                            # retry fetch after login
-                            try:
-                                gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                                if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                    grades_html = gresp.text
-                                    break
-                            except Exception as exc:
-                                last_exc = exc
-                        except Exception as exc:
-                            last_exc = exc
-
-                        time.sleep(1)
-
-                    # final fallback: if grades-statement failed but we have API results, use API instead
-                    if not grades_html and api_data and total_api_marks > 0:
-                        use_sources = 'api'
-                        used_api_due_to_html_failure = True
-                        print(f"[AVG] HTML failed, falling back to API ({total_api_marks} marks)")
-                    elif grades_html:
-                        print(f"[AVG] HTML loaded successfully")
-                    else:
-                        print(f"[AVG] HTML loading failed")
-                except Exception as e:
-                    grades_html = None
-                    print(f"[AVG] HTML loading exception: {e}")
-            
-            # If API was selected but returned empty, try HTML as fallback (if no date args)
-            # This should not happen often since we set use_sources = None above when API is empty,
-            # but handle it just in case
-            if use_sources == 'api' and api_data and total_api_marks == 0 and not (start_arg or end_arg) and not force_api:
-                print(f"[AVG] API was selected but empty, switching to HTML fallback")
-                use_sources = None  # Will try HTML instead
-                # Try to get HTML if we haven't already
-                if not grades_html:
-                    try:
-                        grades_url = f"https://nz.ua/schedule/grades-statement"
-                        params = {'student_id': session['student_id']}
-                        headers = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': grades_url}
-                        gresp = get_scraper().get(grades_url, params=params, timeout=10, headers=headers)
-                        if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                            grades_html = gresp.text
-                            print(f"[AVG] HTML loaded in fallback attempt")
-                    except Exception as e:
-                        print(f"[AVG] HTML fallback exception: {e}")
-
-            # choose source and parse
-            parsed_range = (start, end)
-            subjects_parsed = None
-            if use_sources == 'api' and api_data and total_api_marks > 0:
-                # build subjects from API
-                parsed_range = (start, end)
-                subjects_parsed = {}
-                for subj in api_data.get('subjects', []):
-                    name = subj.get('subject_name', '').strip()
-                    marks = subj.get('marks', []) or []
-                    if name:
-                        # convert marks to strings/tokens
-                        tokens = []
-                        for m in marks:
-                            if isinstance(m, (str, int, float)):
-                                tokens.append(str(m))
-                            else:
-                                sig, disp = _extract_mark_info(m)
-                                tokens.append(disp)
-                        subjects_parsed[name] = tokens
-            elif grades_html:
-                print(f"[AVG] Parsing HTML grades-statement...")
-                sd, ed, subs = parse_grades_from_html(grades_html)
-                print(f"[AVG] HTML parsed: {len(subs)} subjects found, date range: {sd} - {ed}")
-                
-                # If no subjects found, log more details
-                if not subs:
-                    print(f"[AVG] WARNING: HTML parser returned 0 subjects!")
-                    # Try to check if HTML contains the table
-                    if 'marks-report' in grades_html:
-                        print(f"[AVG] HTML contains 'marks-report' table")
-                    if '<table' in grades_html:
-                        print(f"[AVG] HTML contains table elements")
-                    # Log first 500 chars of HTML for debugging
-                    print(f"[AVG] HTML preview (first 500 chars): {grades_html[:500]}")
-                
-                # If user provided explicit dates, keep them; otherwise use the visible page range if present
-                if not (start_arg or end_arg) and sd and ed:
-                    parsed_range = (sd, ed)
-                    # Also update the filter range to match HTML page range when no args provided
-                    try:
-                        s_dt = datetime.strptime(sd, '%Y-%m-%d')
-                        e_dt = datetime.strptime(ed, '%Y-%m-%d')
-                        print(f"[AVG] Using HTML page date range for filtering: {sd} - {ed}")
-                    except Exception:
-                        pass  # Keep original range
-
-                # subs: {subject: [(token, date_iso_or_None), ...]}
-                subjects_parsed = {}
-                any_token_dates = False
-                for name, toks in subs.items():
-                    filtered = []
-                    for tok_item in toks:
-                        if isinstance(tok_item, (list, tuple)) and len(tok_item) >= 2:
-                            tok_text, tok_date = tok_item[0], tok_item[1]
-                        else:
-                            tok_text, tok_date = str(tok_item), None
-
-                        if tok_date:
-                            any_token_dates = True
-                            try:
-                                dt = datetime.strptime(tok_date, '%Y-%m-%d')
-                                if s_dt <= dt <= e_dt:
-                                    filtered.append(tok_text)
-                                else:
-                                    # outside requested range -> skip
-                                    pass
-                            except Exception:
-                                # if we can't parse, include it
-                                filtered.append(tok_text)
-                        else:
-                            # no per-mark date available -> can't filter reliably, include
-                            # When no date args provided, include all marks from HTML
-                            if not (start_arg or end_arg):
-                                filtered.append(tok_text)
-                            else:
-                                # When date args provided but no per-mark dates, include anyway
-                                # (HTML page should already be filtered by date_from/date_to params)
-                                filtered.append(tok_text)
-
-                    if filtered:
-                        subjects_parsed[name] = filtered
-                        print(f"[AVG] Subject '{name}': {len(filtered)} marks after filtering")
-
-                # remember whether we had any per-mark dates for post-processing note
-                grades_html_any_dates = any_token_dates
-                print(f"[AVG] After filtering by date range: {len(subjects_parsed)} subjects with marks")
-
-            if not subjects_parsed:
-                print(f"[AVG] No subjects parsed from any source")
-                # Check if API was used but returned empty
-                if use_sources == 'api' and api_data and total_api_marks == 0:
-                    err_msg = '❌ Не знайдено оцінок'
-                    if start_arg or end_arg:
-                        err_msg += f' за вказаний період ({start} — {end})'
-                    elif force_api:
-                        err_msg += ' (API повернув порожній результат)'
-                    else:
-                        err_msg += ' за поточний навчальний рік'
-                    if not (start_arg or end_arg) and not force_api:
-                        err_msg += '\n\n💡 Спробуйте вказати конкретний діапазон дат:\n`/avg 2025-12-19 2025-12-31`'
-                    await update.message.reply_text(err_msg)
-                    return
-                
-                # fallback response
-                err_msg = '❌ Не вдалось отримати оцінки'
-                if start_arg or end_arg:
+        subjects_parsed = result.subjects
+        parsed_range = (result.start, result.end)
+        if not subjects_parsed:
+            avg_log.info("No subjects parsed from any source")
+            if result.source == 'api':
+                err_msg = '❌ Не знайдено оцінок'
+                if exact_range:
                     err_msg += f' за вказаний період ({start} — {end})'
+                elif force_api:
+                    err_msg += ' (API повернув порожній результат)'
                 else:
-                    err_msg += ' (немає оцінок за поточний навчальний рік)'
-                try:
-                    if last_exc:
-                        err_msg += f"\n_Деталі: {str(last_exc)}_"
-                except Exception:
-                    pass
-                if not (start_arg or end_arg):
+                    err_msg += ' за поточний навчальний рік'
+                if not exact_range and not force_api:
                     err_msg += '\n\n💡 Спробуйте вказати конкретний діапазон дат:\n`/avg 2025-12-19 2025-12-31`'
-                err_msg += '\nАбо спробуйте `/avg --force-api`'
                 await update.message.reply_text(err_msg)
                 return
 
-            # compute averages from subjects_parsed
-            message = f"📅 Діапазон дат: {parsed_range[0]} — {parsed_range[1]}\n\n📊 Середній бал по предметам:\n\n"
-            total = 0.0
-            count = 0
-            subjects_data = []
-
-            for name, tokens in subjects_parsed.items():
-                subj_numeric_sum = 0.0
-                subj_numeric_count = 0
-                subj_non_numeric = {}
-                for tok in tokens:
-                    val = _extract_numeric_from_mark(tok)
-                    if val is not None:
-                        subj_numeric_sum += val
-                        subj_numeric_count += 1
-                        total += val
-                        count += 1
-                    else:
-                        subj_non_numeric[tok] = subj_non_numeric.get(tok, 0) + 1
+            err_msg = '❌ Не вдалось отримати оцінки'
+            if exact_range:
+                err_msg += f' за вказаний період ({start} — {end})'
+            else:
+                err_msg += ' (немає оцінок за поточний навчальний рік)'
+            if result.error:
+                err_msg += f"\n_Деталі: {result.error}_"
+            if not exact_range:
+                err_msg += '\n\n💡 Спробуйте вказати конкретний діапазон дат:\n`/avg 2025-12-19 2025-12-31`'
+            err_msg += '\nАбо спробуйте `/avg --force-api`'
+            await update.message.reply_text(err_msg)
+            return
 
-                if subj_numeric_count > 0:
-                    avg_mark = subj_numeric_sum / subj_numeric_count
-                    subjects_data.append({'name': name, 'avg': avg_mark, 'count': subj_numeric_count})
-                else:
-                    if len(tokens) == 0:
-                        subjects_data.append({'name': name, 'avg': None, 'count': 0, 'note': 'нема оцінок'})
-                    else:
-                        tokens_sorted = sorted(subj_non_numeric.items(), key=lambda x: -x[1])
-                        tokens_summary = ', '.join([t[0] for t in tokens_sorted[:3]])
-                        subjects_data.append({'name': name, 'avg': None, 'count': len(tokens), 'note': f'ненумерічні оцінки: {tokens_summary}'})
-
-            # Sort numeric subjects by avg desc, then non-numeric/empty at the bottom
-            numeric = [s for s in subjects_data if s.get('avg') is not None]
-            nonnum = [s for s in subjects_data if s.get('avg') is None]
-            numeric.sort(key=lambda x: x['avg'], reverse=True)
-
-            lines = []
-            for s in numeric + nonnum:
-                if s.get('avg') is not None:
-                    lines.append(f"{s['name']}: {s['avg']:.2f} ({s['count']} оцінок)")
+        # За весь навчальний рік середні беруться з агрегатів mark_stats (без проходу по оцінках);
+        # для іншого періоду агрегати рахуються з отриманих оцінок
+        stored = {}
+        if parsed_range == (start, end) and start == default_start:
+            stored = await asyncio.to_thread(get_mark_stats, session['student_id'], start)
+        message = f"📅 Діапазон дат: {parsed_range[0]} — {parsed_range[1]}\n\n📊 Середній бал по предметам:\n\n"
+        total = 0.0
+        count = 0
+        subjects_data = []
+
+        for name, marks in subjects_parsed.items():
+            stats = stored.get(name) or SubjectStats.fold(marks)
+            if stats.count > 0:
+                total += stats.total
+                count += stats.count
+                subjects_data.append({'name': name, 'avg': stats.avg, 'count': stats.count})
+            elif stats.marks == 0:
+                subjects_data.append({'name': name, 'avg': None, 'count': 0, 'note': 'нема оцінок'})
+            else:
+                tokens_sorted = sorted(stats.other.items(), key=lambda x: -x[1])
+                tokens_summary = ', '.join([t[0] for t in tokens_sorted[:3]])
+                subjects_data.append({'name': name, 'avg': None, 'count': stats.marks, 'note': f'ненумерічні оцінки: {tokens_summary}'})
+
+        # Sort numeric subjects by avg desc, then non-numeric/empty at the bottom
+        numeric = [s for s in subjects_data if s.get('avg') is not None]
+        nonnum = [s for s in subjects_data if s.get('avg') is None]
+        numeric.sort(key=lambda x: x['avg'], reverse=True)
+
+        lines = []
+        for s in numeric + nonnum:
+            if s.get('avg') is not None:
+                lines.append(f"{s['name']}: {s['avg']:.2f} ({s['count']} оцінок)")
+            else:
+                if s.get('note'):
+                    lines.append(f"{s['name']}: — ({s['note']})")
                 else:
-                    if s.get('note'):
-                        lines.append(f"{s['name']}: — ({s['note']})")
-                    else:
-                        lines.append(f"{s['name']}: — (нема оцінок)")
+                    lines.append(f"{s['name']}: — (нема оцінок)")
 
-            message += "\n".join(lines)
+        message += "\n".join(lines)
 
-            if count > 0:
-                overall = total / count
-                message += f"\n\n📈 *Загальний середній: {overall:.2f}*"
-            else:
-                message += "\n\n📈 *Загальний середній: —*"
+        if count > 0:
+            overall = total / count
+            message += f"\n\n📈 *Загальний середній: {overall:.2f}*"
+        else:
+            message += "\n\n📈 *Загальний середній: —*"
 
-            # Відправляємо результат (без указания источника данных)
+        # Відправляємо результат (без указания источника данных)
 
-            # If using grades-statement as fallback and user asked for a specific range, warn when per-mark dates are missing
-            try:
-                if use_sources != 'api' and grades_html and (start_arg or end_arg) and not grades_html_any_dates:
-                    message += "\n\n_Примітка: у даних grades-statement немає дат для окремих оцінок, тому показані всі наявні оцінки за видимий період._"
-            except Exception:
-                pass
+        # If using grades-statement as fallback and user asked for a specific range, warn when per-mark dates are missing
+        try:
+            if result.source == 'html' and exact_range and not result.dated:
+                message += "\n\n_Примітка: у даних grades-statement немає дат для окремих оцінок, тому показані всі наявні оцінки за видимий період._"
+        except Exception:
+            pass
 
-            await update.message.reply_text(message)
+        await update.message.reply_text(message)
     except Exception as e:
         await update.message.reply_text(f"❌ Помилка: {e}")
 
 # ============== НОВИНИ ==============
 
-def parse_news_from_html(html: str) -> list:
-    """Парсить новини з HTML сторінки NZ.UA"""
-    news_items = []
-    
-    # Шукаємо блок "Мої новини"
-    if 'Мої новини' not in html:
-        return []
-    
-    # Витягуємо текст після "Мої новини"
-    start_idx = html.find('Мої новини')
-    end_idx = html.find('Показано новин')
-    
-    if end_idx == -1:
-        news_section = html[start_idx:]
-    else:
-        news_section = html[start_idx:end_idx]
-    
-    # Патерн для парсингу різних типів новин
-    # 1. Звичайні оцінки: "Ім'я Прізвище Побатькові ІмяПрізвищеПобатькові 19 грудня о 10:06 Ви отримали оцінку 7 з предмету: Німецька мова, Семестрова"
-    pattern1 = r'([А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+)\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+(\d+\s+[а-яіїєґʼ]+\s+о\s+\d+:\d+)\s+(Ви отримали оцінку\s+[\wА-ЯІЇЄҐа-яіїєґ/]+\s+з предмету:\s+[^,]+,\s+[^\n]+)'
-    
-    # 2. Зміна оцінки: "Оцінка змінена на 7 з предмету: ..."
-    pattern2 = r'([А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+)\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+[А-ЯІЇЄҐ][а-яіїєґʼ]+\s+(\d+\s+[а-яіїєґʼ]+\s+о\s+\d+:\d+)\s+(Оцінка змінена на\s+[\wА-ЯІЇЄҐа-яіїєґ/]+\s+з предмету:\s+[^,]+,\s+[^\n]+)'
-    
-    # Шукаємо всі співпадіння
-    for pattern in [pattern1, pattern2]:
-        matches = re.finditer(pattern, news_section)
-        
-        for match in matches:
-            teacher = match.group(1).strip()
-            date_time = match.group(2).strip()
-            full_message = match.group(3).strip()
-            
-            # Парсимо оцінку, предмет та тип
-            if 'Ви отримали оцінку' in full_message:
-                grade_match = re.search(r'оцінку\s+([\wА-ЯІЇЄҐа-яіїєґ/]+)\s+з предмету:\s+([^,]+),\s+(.+)', full_message)
-            elif 'Оцінка змінена на' in full_message:
-                grade_match = re.search(r'змінена на\s+([\wА-ЯІЇЄҐа-яіїєґ/]+)\s+з предмету:\s+([^,]+),\s+(.+)', full_message)
-            else:
-                continue
-            
-            if grade_match:
-                grade = grade_match.group(1).strip()
-                subject = grade_match.group(2).strip()
-                grade_type = grade_match.group(3).strip()
-                
-                news_items.append({
-                    'teacher': teacher,
-                    'date': date_time,
-                    'grade': grade,
-                    'subject': subject,
-                    'type': grade_type,
-                    'is_changed': 'Оцінка змінена' in full_message
-                })
-    
-    return news_items
+# Останні показані новини учня (student_id); перша з них — маркер "вже бачив"
+_NEWS_CACHE = LRUCache(PREFS_CACHE_SIZE)
 
 def format_grade_type(grade_type):
     """Форматирует тип оценки"""
@@ -2486,6 +2967,15 @@ def format_grade_type(grade_type):
     else:
         return f"за {grade_type.lower()}"
 
+def short_teacher_name(name: str) -> str:
+    """'Прізвище Ім'я По батькові' -> 'Прізвище І.П.'"""
+    name_parts = name.split()
+    if len(name_parts) >= 3:
+        return f"{name_parts[0]} {name_parts[1][0]}.{name_parts[2][0]}."
+    if len(name_parts) == 2:
+        return f"{name_parts[0]} {name_parts[1][0]}."
+    return name
+
 def format_news_message(news_items: list) -> str:
     """Форматує новини для відображення"""
     if not news_items:
@@ -2494,71 +2984,63 @@ def format_news_message(news_items: list) -> str:
     message = "📰 *НОВИНИ*\n\n"
     
     for item in news_items[:10]:
-        # Форматируем имя учителя (сокращаем)
-        teacher_name = item.get('teacher', '')
-        if teacher_name:
-            name_parts = teacher_name.split()
-            if len(name_parts) >= 3:
-                short_name = f"{name_parts[0]} {name_parts[1][0]}.{name_parts[2][0]}."
-            elif len(name_parts) == 2:
-                short_name = f"{name_parts[0]} {name_parts[1][0]}."
-            else:
-                short_name = teacher_name
-        else:
-            short_name = "—"
-        
-        date_str = item.get('date', '')
-        grade = item.get('grade', '')
-        subject = item.get('subject', '')
-        grade_type = item.get('type', '')
-        formatted_type = format_grade_type(grade_type)
+        short_name = short_teacher_name(item.teacher) if item.teacher else "—"
+        formatted_type = format_grade_type(item.grade_type or '')
         
         # Форматуємо повідомлення
-        if item.get('is_changed'):
-            message += f"• {short_name} - {date_str}, змінила Вам оцінку на \"{grade}\" з \"{subject}\", {formatted_type}\n\n"
+        if item.is_changed:
+            message += f"• {short_name} - {item.date}, змінила Вам оцінку на \"{item.grade}\" з \"{item.subject}\", {formatted_type}\n\n"
         else:
-            message += f"• {short_name} - {date_str}, поставила Вам оцінку \"{grade}\" з \"{subject}\", {formatted_type}\n\n"
+            message += f"• {short_name} - {item.date}, поставила Вам оцінку \"{item.grade}\" з \"{item.subject}\", {formatted_type}\n\n"
     
     if len(news_items) > 10:
         message += f"_...та ще {len(news_items) - 10} новин_"
     
     return message
 
-async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показує новини з NZ.UA"""
-    session = get_session(update.effective_user.id)
-    if not session:
-        await update.message.reply_text("❌ Спочатку увійди: /start")
-        return
-
-    msg = await update.message.reply_text("🔄 Завантажую новини...")
+def render_news_list(items: list, new_keys: list, total: int, limit: int) -> str:
+    """Markdown-список новин; new_keys позначаються 🆕"""
+    out_lines = []
+    for item in items:
+        short_name = short_teacher_name(item.teacher)
+        mark_new = "🆕 " if item.key in new_keys else ""
+        if item.grade:
+            formatted_type = format_grade_type(item.grade_type)
+            verb = "змінила Вам оцінку на" if item.is_changed else "поставила Вам оцінку"
+            out_lines.append(f"• {mark_new}{short_name} - {item.date}, {verb} \"{item.grade}\" з \"{item.subject}\", {formatted_type}")
+        else:
+            # Для інших новин використовуємо старий формат
+            text = html.escape(item.text)
+            if item.link:
+                text = text.replace(
+                    "Дистанційне завдання",
+                    f'<a href="{html.escape(item.link)}">Дистанційне завдання</a>'
+                )
+            out_lines.append(f"• {mark_new}*{html.escape(item.teacher)}* — {html.escape(item.date)}\n{text}".strip())
 
-    try:
-        from bs4 import BeautifulSoup
+    result = "📰 *НОВИНИ*\n\n" + "\n\n".join(out_lines)
+    if total > limit:
+        result += f"\n\n_...та ще {total - limit} новин_"
+    return result
 
-        login_url = "https://nz.ua/login"
-        
-        # Створюємо один scraper для всієї сесії веб-логіну
-        web_scraper = get_scraper()
+def download_news_page(session):
+    """Логіниться на nz.ua і повертає сторінку новин (StreamedPage) або None (блокуючий виклик)"""
+    login_url = "https://nz.ua/login"
 
+    # Один scraper для всієї сесії веб-логіну
+    with get_scraper() as web_scraper:
         # Спроба: спочатку отримати сторінку логіну і витягти CSRF токен
         try:
-            login_page = web_scraper.get(login_url)
-            login_soup = BeautifulSoup(login_page.text, "html.parser")
-            csrf = None
-            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-            if meta_csrf:
-                csrf = meta_csrf.get('content')
-            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-            if hidden_csrf and hidden_csrf.get('value'):
-                csrf = hidden_csrf.get('value')
+            login_page = web_scraper.get(login_url, timeout=SCRAPER_TIMEOUT)
+            login_form = extract_login_form(login_page.content)
+            csrf = login_form.csrf
 
             if csrf:
-                print(f"[NEWS] Found CSRF token")
+                news_log.debug("Found CSRF token")
             else:
-                print(f"[NEWS] CSRF token not found on login page")
+                news_log.warning("CSRF token not found on login page")
         except Exception as e:
-            print(f"[NEWS] Could not fetch login page: {e}")
+            news_log.warning("Could not fetch login page: %s", e)
             csrf = None
 
         # Підготовка даних для логіну
@@ -2573,10 +3055,10 @@ async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             headers['X-CSRF-Token'] = csrf
 
         # Виконуємо логін (спробуємо один раз, потім перевіримо сторінку новин)
-        r_login = web_scraper.post(login_url, data=login_data, headers=headers)
-        print(f"[NEWS] Login status: {r_login.status_code}, URL after login: {r_login.url}")
+        r_login = web_scraper.post(login_url, data=login_data, headers=headers, timeout=SCRAPER_TIMEOUT)
+        news_log.info("Login status: %s, URL after login: %s", r_login.status_code, r_login.url)
         try:
-            print("[NEWS] Cookies after login:", web_scraper.cookies.get_dict())
+            news_log.debug("Cookies after login: %s", sorted(web_scraper.cookies.get_dict()))
         except Exception:
             pass
 
@@ -2588,28 +3070,42 @@ async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for ep in endpoints:
             url = urljoin(base_url, ep)
             try:
-                resp = web_scraper.get(url)
-                print(f"[NEWS] GET {url} -> {resp.status_code}")
-                if resp.status_code == 200 and 'Мої новини' in resp.text or 'school-news-list' in resp.text:
-                    news_resp = resp
-                    break
+                resp = fetch_html_until(web_scraper, url, NEWS_PAGE_MARKERS, timeout=SCRAPER_TIMEOUT)
+                news_log.debug("GET %s -> %s%s", url, resp.status_code, ' (stopped at end of news)' if resp.truncated else '')
+                if resp.status_code == 200 and ('Мої новини' in resp.text or 'school-news-list' in resp.text):
+                    return resp
                 # keep last 200 response for debugging
                 if resp.status_code == 200 and news_resp is None:
                     news_resp = resp
             except Exception as e:
-                print(f"[NEWS] Error fetching {url}: {e}")
+                news_log.warning("Error fetching %s: %s", url, e)
+        return news_resp
 
+async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показує новини з NZ.UA"""
+    session = get_session(update.effective_user.id)
+    if not session:
+        await update.message.reply_text("❌ Спочатку увійди: /start")
+        return
+
+    msg = await update.message.reply_text("🔄 Завантажую новини...")
+
+    try:
+        news_resp = await asyncio.to_thread(download_news_page, session)
         if not news_resp:
             await msg.edit_text('❌ Не вдалось отримати сторінку новин (мережна помилка)')
             return
 
-        # Парсимо HTML і шукаємо блок новин
-        soup = BeautifulSoup(news_resp.text, "html.parser")
-        root = soup.find("div", id="school-news-list")
+        # Один прохід по school-news-list; при повторному перегляді зупиняємось на останній баченій новині
+        student_id = session['student_id']
+        limit = 10
+        cached_items = _NEWS_CACHE.get(student_id) or []
+        marker = cached_items[0].key if cached_items else None
+        items, found_list, reached_marker = parse_news_page(news_resp.text, stop_at=marker, limit=limit)
 
         # Якщо блоку немає — спробуємо парсити текстовий варіант (функція parse_news_from_html)
-        if not root:
-            print("[NEWS] Container 'school-news-list' not found, falling back to regex parser")
+        if not found_list:
+            news_log.warning("Container 'school-news-list' not found, falling back to text parser")
             parsed = parse_news_from_html(news_resp.text)
             if parsed:
                 await update.message.reply_text(format_news_message(parsed))
@@ -2618,90 +3114,23 @@ async def news_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await msg.edit_text('📰 Новин поки немає або не вдалось увійти на сайт (перевірте лог на сервері)')
             return
 
-        items = root.select("div.news-page__item")
+        seen_keys = {item.key for item in cached_items}
+        new_keys = {item.key for item in items} - seen_keys if cached_items else set()
+        if reached_marker:
+            news_log.info("%s new items since last view", len(items))
+            items = (items + cached_items)[:limit]
         if not items:
             await msg.edit_text('📰 Новин поки немає')
             return
+        _NEWS_CACHE.set(student_id, items)
+        total = count_news_items(news_resp.text)
 
-        out_lines = []
-        base = "https://nz.ua"
-        limit = 10
-
-        for item in items[:limit]:
-            name_el = item.select_one(".news-page__header .news-page__name")
-            date_el = item.select_one(".news-page__header .news-page__date")
-            desc_el = item.select_one(".news-page__desc")
-
-            name = name_el.get_text(strip=True) if name_el else "—"
-            date = date_el.get_text(strip=True) if date_el else ""
-
-            text = ""
-            text_raw = ""  # Неэкранированный текст для поиска паттернов
-            if desc_el:
-                for br in desc_el.find_all("br"):
-                    br.replace_with("\n")
-                # беремо HTML фрагмент для збереження лінків, але ескейпимо текст
-                inner_html = ''.join(str(x) for x in desc_el.contents)
-                text_raw = BeautifulSoup(inner_html, "html.parser").get_text(" ", strip=True)
-                text = html.escape(text_raw)
-                link_tag = desc_el.find("a", href=True)
-                if link_tag:
-                    link = urljoin(base, link_tag["href"])
-                    text = text.replace(
-                        "Дистанційне завдання",
-                        f'<a href="{html.escape(link)}">Дистанційне завдання</a>'
-                    )
-
-            # Форматируем имя учителя (сокращаем)
-            name_parts = name.split()
-            if len(name_parts) >= 3:
-                short_name = f"{name_parts[0]} {name_parts[1][0]}.{name_parts[2][0]}."
-            elif len(name_parts) == 2:
-                short_name = f"{name_parts[0]} {name_parts[1][0]}."
-            else:
-                short_name = name
-            
-            # Используем неэкранированный текст для поиска паттернов
-            search_text = text_raw if text_raw else text
-            
-            # Ищем паттерн "Ви отримали оцінку X з предмету: Y, Z"
-            grade_pattern = r'Ви отримали оцінку\s+([\wА-ЯІЇЄҐа-яіїєґ/]+)\s+з предмету:\s+([^,]+),\s+(.+)'
-            match = re.search(grade_pattern, search_text)
-            if match:
-                grade = match.group(1)
-                subject = match.group(2).strip()
-                grade_type = match.group(3).strip()
-                formatted_type = format_grade_type(grade_type)
-                formatted_text = f"{short_name} - {date}, поставила Вам оцінку \"{grade}\" з \"{subject}\", {formatted_type}"
-                out_lines.append(f"• {formatted_text}".strip())
-            else:
-                # Ищем паттерн "Оцінка змінена на X з предмету: Y, Z"
-                changed_pattern = r'Оцінка змінена на\s+([\wА-ЯІЇЄҐа-яіїєґ/]+)\s+з предмету:\s+([^,]+),\s+(.+)'
-                match_changed = re.search(changed_pattern, search_text)
-                if match_changed:
-                    grade = match_changed.group(1)
-                    subject = match_changed.group(2).strip()
-                    grade_type = match_changed.group(3).strip()
-                    formatted_type = format_grade_type(grade_type)
-                    formatted_text = f"{short_name} - {date}, змінила Вам оцінку на \"{grade}\" з \"{subject}\", {formatted_type}"
-                    out_lines.append(f"• {formatted_text}".strip())
-                else:
-                    # Для других новостей используем старый формат
-                    out_lines.append(f"• *{html.escape(name)}* — {html.escape(date)}\n{text}".strip())
-
-        result = "📰 *НОВИНИ*\n\n" + "\n\n".join(out_lines)
-        if len(items) > limit:
-            result += f"\n\n_...та ще {len(items) - limit} новин_"
-
+        result, _ = render_cached('news', render_news_list, items, sorted(new_keys), total, limit)
         await msg.edit_text(result, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
 
-    except ImportError:
-        await msg.edit_text("❌ Потрібно встановити BeautifulSoup: pip install beautifulsoup4")
     except Exception as e:
         await msg.edit_text(f"❌ Помилка при отриманні новин: {e}")
-        print(f"[NEWS ERROR] {e}")
-        import traceback
-        traceback.print_exc()
+        news_log.exception("news_cmd failed: %s", e)
 
 # ============== ІНШІ КОМАНДИ ==============
 
@@ -2716,6 +3145,127 @@ async def vip_request_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     context.user_data['step'] = 'vip_request' 
 
+# --- Сторінки адмінських списків ---
+
+def _page_nav_row(prefix: str, prev_cursor, next_cursor) -> list:
+    row = []
+    if prev_cursor:
+        row.append(InlineKeyboardButton("⬅️ Новіші", callback_data=f"{prefix}:p:{prev_cursor}"))
+    if next_cursor:
+        row.append(InlineKeyboardButton("Старіші ➡️", callback_data=f"{prefix}:n:{next_cursor}"))
+    return row
+
+
+def _fetch_page_or_first(*args, cursor=None, direction='n', **kwargs):
+    """Як fetch_keyset_page, але при порожній сторінці за курсором повертає першу сторінку"""
+    rows, prev_c, next_c = fetch_keyset_page(*args, cursor=cursor, direction=direction, **kwargs)
+    if not rows and cursor:
+        rows, prev_c, next_c = fetch_keyset_page(*args, **kwargs)
+    return rows, prev_c, next_c
+
+
+def build_tickets_page(state: str, cursor: str = None, direction: str = 'n'):
+    """Повертає (text, markup) для сторінки звернень або (None, None), якщо звернень немає"""
+    where, params = '', ()
+    if state in ('open', 'closed'):
+        where, params = 'status = ?', (state,)
+    rows, prev_c, next_c = _fetch_page_or_first(
+        'support_tickets', 'id, user_id, substr(message,1,80), created_at', where, params,
+        cursor=cursor, direction=direction)
+    if not rows:
+        return None, None
+    lines = []
+    kb_buttons = []
+    for tid, uid, snip, created in rows:
+        lines.append(f"#{tid} — {uid} — {created} — {snip}")
+        kb_buttons.append([InlineKeyboardButton(f"Тикет #{tid}", callback_data=f"admin:view_ticket:{tid}")])
+    nav = _page_nav_row(f"admin_menu:list_tickets:{state}", prev_c, next_c)
+    if nav:
+        kb_buttons.append(nav)
+    kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:list_tickets")])
+    text = f"📭 Останні звернення ({state}):\n\n" + "\n".join(lines)
+    return text, InlineKeyboardMarkup(kb_buttons)
+
+
+def build_vip_requests_page(cursor: str = None, direction: str = 'n'):
+    rows, prev_c, next_c = _fetch_page_or_first(
+        'vip_requests', 'id, user_id, substr(contact_text,1,50), created_at', cursor=cursor, direction=direction)
+    if not rows:
+        return None, None
+    lines = []
+    kb_buttons = []
+    for req_id, uid, text_preview, created in rows:
+        lines.append(f"#{req_id} — {uid} — {created}\n{text_preview or 'Без тексту'}")
+        kb_buttons.append([
+            InlineKeyboardButton(f"Заявка #{req_id}", callback_data=f"admin:view_vip_request:{req_id}"),
+            InlineKeyboardButton("✅ 30д", callback_data=f"admin:grant_vip:{uid}:30")
+        ])
+    nav = _page_nav_row("admin_menu:vip_requests", prev_c, next_c)
+    if nav:
+        kb_buttons.append(nav)
+    kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")])
+    return '📋 Заявки на VIP:\n\n' + '\n\n'.join(lines), InlineKeyboardMarkup(kb_buttons)
+
+
+def build_vips_page(manage: bool = False, cursor: str = None, direction: str = 'n'):
+    """Сторінка VIP-користувачів; manage=True додає кнопки керування"""
+    rows, prev_c, next_c = _fetch_page_or_first(
+        'vip_users', 'user_id, expires_at', id_col='user_id', cursor=cursor, direction=direction)
+    if not rows:
+        return None, None
+    now = now_kyiv()
+    lines = []
+    kb_buttons = []
+    for uid, raw_expires in rows:
+        expires = _parse_vip_expires(raw_expires)
+        expires_text = expires.strftime('%Y-%m-%d') if expires else 'Не встановлено'
+        if manage:
+            lines.append(f"{uid} — до {expires_text}")
+            kb_buttons.append([
+                InlineKeyboardButton(f"👤 {uid}", callback_data=f"admin:view_vip_user:{uid}"),
+                InlineKeyboardButton("❌", callback_data=f"admin:revoke_vip:{uid}")
+            ])
+        else:
+            if expires is None:
+                status = "❓"
+            elif expires > now:
+                status = "✅ Активний"
+            else:
+                status = "❌ Закінчився"
+            lines.append(f"{uid} — {expires_text} {status}")
+    nav = _page_nav_row("admin_menu:manage_vips" if manage else "admin_menu:list_vips", prev_c, next_c)
+    if nav:
+        kb_buttons.append(nav)
+    kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")])
+    title = '👥 *Управління VIP-користувачами*' if manage else '👥 *VIP-користувачі:*'
+    return title + '\n\n' + '\n'.join(lines), InlineKeyboardMarkup(kb_buttons)
+
+
+def build_admin_actions_page(cursor: str = None, direction: str = 'n'):
+    rows, prev_c, next_c = _fetch_page_or_first(
+        'admin_actions', 'id, admin_id, action, target_user, ticket_id, substr(details,1,60), created_at',
+        cursor=cursor, direction=direction)
+    if not rows:
+        return None, None
+    lines = []
+    for aid, admin_id, action_name, target_user, ticket_id, details, created in rows:
+        parts = [f"#{aid}", f"admin:{admin_id}", action_name]
+        if target_user:
+            parts.append(f"user:{target_user}")
+        if ticket_id:
+            parts.append(f"ticket:{ticket_id}")
+        if details:
+            parts.append(details)
+        parts.append(str(created))
+        lines.append(" — ".join(parts))
+    kb_buttons = []
+    nav = _page_nav_row("admin_menu:view_actions", prev_c, next_c)
+    if nav:
+        kb_buttons.append(nav)
+    kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")])
+    return "🗂️ Останні дії адміністраторів:\n\n" + "\n".join(lines), InlineKeyboardMarkup(kb_buttons)
+
+
 async def list_tickets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /list_tickets - показує останні звернення (тільки для адмінів)
 
@@ -2735,54 +3285,23 @@ async def list_tickets_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Невідомий фільтр. Використовуйте: open|closed|all")
             return
 
-    conn = get_db_connection()
-    c = conn.cursor()
-    if state == 'open':
-        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets WHERE COALESCE(status,'open') = 'open' ORDER BY created_at DESC LIMIT 200")
-    elif state == 'closed':
-        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets WHERE COALESCE(status,'open') = 'closed' ORDER BY created_at DESC LIMIT 200")
-    else:
-        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets ORDER BY created_at DESC LIMIT 200")
-
-    rows = c.fetchall()
-    conn.close()
-
-    if not rows:
+    text, kb = build_tickets_page(state)
+    if not text:
         await update.message.reply_text("📭 Звернень поки немає")
         return
 
-    lines = []
-    kb_buttons = []
-    for r in rows:
-        tid, uid, snip, created = r
-        lines.append(f"#{tid} — {uid} — {created} — {snip}")
-        kb_buttons.append([InlineKeyboardButton(f"Тикет #{tid}", callback_data=f"admin:view_ticket:{tid}")])
-
-    text = f"📭 Останні звернення ({state}):\n\n" + "\n".join(lines)
-    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(kb_buttons))
+    await update.message.reply_text(text, reply_markup=kb)
 
 
 async def vip_menu_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показує VIP-меню (тільки для активних VIP)"""
     user_id = update.effective_user.id
-    if not is_vip_user(user_id):
+    expires = get_vip_expires(user_id)
+    if expires is None:
         await update.message.reply_text(VIP_TEXT)
         return
 
-    # Получаем информацию о VIP статусе
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT expires_at FROM vip_users WHERE user_id = ?', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    
-    expires_text = "Не встановлено"
-    if row and row[0]:
-        try:
-            expires = datetime.fromisoformat(row[0])
-            expires_text = expires.strftime('%d.%m.%Y %H:%M')
-        except:
-            expires_text = str(row[0])
+    expires_text = expires.strftime('%d.%m.%Y %H:%M')
 
     def build_keyboard(uid):
         s = get_all_vip_settings(uid)
@@ -2811,27 +3330,12 @@ async def admin_menu_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Тільки адміністратори можуть користуватися цим меню")
         return
 
-    # Получаем статистику
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Статистика пользователей
-    c.execute('SELECT COUNT(DISTINCT user_id) FROM sessions')
-    total_users = c.fetchone()[0] or 0
-    
-    # Статистика VIP
-    c.execute('SELECT COUNT(*) FROM vip_users WHERE expires_at > ?', (datetime.now().isoformat(),))
-    active_vips = c.fetchone()[0] or 0
-    
-    # Статистика тикетов
-    c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'open'")
-    open_tickets = c.fetchone()[0] or 0
-    
-    # Статистика заявок на VIP
-    c.execute('SELECT COUNT(*) FROM vip_requests')
-    vip_requests = c.fetchone()[0] or 0
-    
-    conn.close()
+    # Получаем статистику (материализованные счётчики)
+    stats = get_admin_stats()
+    total_users = stats.get('total_users', 0)
+    active_vips = stats.get('active_vips', 0)
+    open_tickets = stats.get('open_tickets', 0)
+    vip_requests = stats.get('vip_requests', 0)
 
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_menu:stats")],
@@ -2860,62 +3364,96 @@ async def vip_actions_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Тільки адміни можуть переглядати лог дій")
         return
 
+    text, kb = build_admin_actions_page()
+    if not text:
+        await update.message.reply_text("ℹ️ Записів дій адміністраторів поки немає")
+        return
+
+    await update.message.reply_text(text, reply_markup=kb)
+
+
+# --- Кеш табеля ---
+# Табель змінюється кілька разів на рік: зберігаємо хеш блоку табеля та готовий текст,
+# щоб незмінена сторінка не парсилась і не рендерилась повторно.
+
+_REPORT_CARD_REFRESHING = set()
+
+
+def report_card_content_hash(page: str):
+    """Хеш лише блоку табеля (решта сторінки містить CSRF-токени та інші змінні частини)"""
+    start = page.find('Табель')
+    if start == -1:
+        return None
+    end = page.find('</table>', start)
+    segment = page[start:] if end == -1 else page[start:end]
+    return hashlib.sha256(segment.encode('utf-8')).hexdigest()
+
+
+def get_cached_report_card(student_id):
+    """Повертає {'content_hash', 'rendered', 'fetched_at'} або None"""
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('SELECT id, admin_id, action, target_user, ticket_id, details, created_at FROM admin_actions ORDER BY created_at DESC LIMIT 50')
-    rows = c.fetchall()
+    c.execute('SELECT content_hash, rendered, fetched_at FROM report_cards WHERE student_id = ?', (str(student_id),))
+    row = c.fetchone()
     conn.close()
+    if not row:
+        return None
+    rendered = decrypt_data(row[1])
+    if rendered is None:
+        return None
+    return {'content_hash': row[0], 'rendered': rendered, 'fetched_at': row[2]}
 
-    if not rows:
-        await update.message.reply_text("ℹ️ Записів дій адміністраторів поки немає")
-        return
 
-    lines = []
-    for r in rows:
-        aid, admin_id, action, target_user, ticket_id, details, created = r
-        parts = [f"#{aid}", f"admin:{admin_id}", action]
-        if target_user:
-            parts.append(f"user:{target_user}")
-        if ticket_id:
-            parts.append(f"ticket:{ticket_id}")
-        if details:
-            parts.append(details)
-        parts.append(str(created))
-        lines.append(" — ".join(parts))
+def save_report_card(student_id, content_hash: str, results: list, rendered: str):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT OR REPLACE INTO report_cards (student_id, content_hash, parsed, rendered, fetched_at)
+                 VALUES (?, ?, ?, ?, ?)''',
+              (str(student_id), content_hash, encrypt_data(json.dumps(results, ensure_ascii=False)),
+               encrypt_data(rendered), int(time.time())))
+    conn.commit()
+    conn.close()
 
-    text = "🗂️ Останні дії адміністраторів:\n\n" + "\n".join(lines)
-    await update.message.reply_text(text)
 
+def touch_report_card(student_id):
+    """Позначає кеш табеля як щойно перевірений"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('UPDATE report_cards SET fetched_at = ? WHERE student_id = ?', (int(time.time()), str(student_id)))
+    conn.commit()
+    conn.close()
 
-async def report_card_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда для отримання табеля успішності"""
-    user_id = update.effective_user.id
-    session = get_session(user_id)
+
+def render_report_card(results: list) -> str:
+    """Форматує табель для Telegram (Markdown)"""
+    lines = ["📋 *Табель успішності*\n"]
+    lines.append("```")
     
-    if not session:
-        await update.message.reply_text("❌ Спочатку увійдіть: /start")
-        return
+    for item in results:
+        subject = item['subject']
+        grade = item['semester_1']
+        if len(subject) > 30:
+            subject = subject[:27] + "..."
+        lines.append(f"{subject}: {grade}")
     
-    msg = await update.message.reply_text("🔄 Завантажую табель...")
+    lines.append("```")
     
-    try:
-        from bs4 import BeautifulSoup
-        
-        login_url = "https://nz.ua/login"
-        headers = {'User-Agent': 'nz-bot/1.0'}
-        
-        # Створюємо один scraper для всієї сесії веб-логіну
-        web_scraper = get_scraper()
-        login_page = web_scraper.get(login_url, headers=headers)
-        login_soup = BeautifulSoup(login_page.text, "html.parser")
-        
-        csrf = None
-        meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-        if meta_csrf:
-            csrf = meta_csrf.get('content')
-        hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-        if hidden_csrf and hidden_csrf.get('value'):
-            csrf = hidden_csrf.get('value')
+    with_grades = [r for r in results if r['semester_1'] != 'немає']
+    if with_grades:
+        avg_grade = sum(int(r['semester_1']) for r in with_grades) / len(with_grades)
+        lines.append(f"\n📊 Середній бал: *{avg_grade:.2f}*")
+    return "\n".join(lines)
+
+
+def download_report_card(session):
+    """Логіниться на nz.ua і повертає HTML табеля або None (блокуючий виклик)"""
+    login_url = "https://nz.ua/login"
+    headers = {'User-Agent': 'nz-bot/1.0'}
+    
+    with get_scraper() as web_scraper:
+        login_page = web_scraper.get(login_url, headers=headers, timeout=SCRAPER_TIMEOUT)
+        login_form = extract_login_form(login_page.content)
+        csrf = login_form.csrf
         
         login_data = {
             "LoginForm[login]": session['username'],
@@ -2926,42 +3464,86 @@ async def report_card_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             login_data['_csrf'] = csrf
             headers['X-CSRF-Token'] = csrf
         
-        web_scraper.post(login_url, data=login_data, headers=headers)
+        web_scraper.post(login_url, data=login_data, headers=headers, timeout=SCRAPER_TIMEOUT)
         
         report_url = "https://nz.ua/schedule/report-card"
-        report_resp = web_scraper.get(report_url, headers=headers)
-        
+        report_resp = fetch_html_until(web_scraper, report_url, REPORT_CARD_MARKERS, headers=headers, timeout=SCRAPER_TIMEOUT)
         if report_resp.status_code != 200 or 'Табель' not in report_resp.text:
+            return None
+        return report_resp.text
+
+
+def refresh_report_card(session):
+    """Завантажує табель і оновлює кеш. Повертає (status, rendered),
+    status: 'failed' | 'empty' | 'unchanged' | 'updated'"""
+    student_id = session['student_id']
+    page = download_report_card(session)
+    if not page:
+        return 'failed', None
+    
+    content_hash = report_card_content_hash(page)
+    cached = get_cached_report_card(student_id)
+    if cached and cached['content_hash'] == content_hash:
+        touch_report_card(student_id)
+        return 'unchanged', cached['rendered']
+    
+    results = parse_report_card(page)
+    if not results:
+        return 'empty', None
+    rendered = render_report_card(results)
+    save_report_card(student_id, content_hash, results, rendered)
+    report_card_log.info("Cached new report card for student %s", student_id)
+    return 'updated', rendered
+
+
+async def _revalidate_report_card(msg, session):
+    """Фонова перевірка табеля після відповіді з кешу; редагує повідомлення, якщо табель змінився"""
+    student_id = session['student_id']
+    try:
+        status, rendered = await asyncio.to_thread(refresh_report_card, session)
+        if status == 'updated':
+            await msg.edit_text(rendered, parse_mode=ParseMode.MARKDOWN)
+    except Exception as e:
+        report_card_log.warning("Background refresh failed for student %s: %s", student_id, e)
+    finally:
+        _REPORT_CARD_REFRESHING.discard(student_id)
+
+
+async def report_card_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для отримання табеля успішності"""
+    user_id = update.effective_user.id
+    session = get_session(user_id)
+    
+    if not session:
+        await update.message.reply_text("❌ Спочатку увійдіть: /start")
+        return
+    
+    student_id = session['student_id']
+    cached = get_cached_report_card(student_id)
+    age = time.time() - cached['fetched_at'] if cached else None
+    if cached and age < REPORT_CARD_MAX_AGE:
+        msg = await update.message.reply_text(cached['rendered'], parse_mode=ParseMode.MARKDOWN)
+        if age >= REPORT_CARD_REVALIDATE_AFTER and student_id not in _REPORT_CARD_REFRESHING:
+            _REPORT_CARD_REFRESHING.add(student_id)
+            context.application.create_task(_revalidate_report_card(msg, session))
+        return
+    
+    msg = await update.message.reply_text("🔄 Завантажую табель...")
+    
+    try:
+        status, rendered = await asyncio.to_thread(refresh_report_card, session)
+        
+        if status == 'failed':
             await msg.edit_text("❌ Не вдалося завантажити табель. Спробуйте пізніше.")
             return
-        
-        results = parse_report_card(report_resp.text)
-        
-        if not results:
+        if status == 'empty':
             await msg.edit_text("📋 Табель порожній або не знайдено предметів.")
             return
         
-        lines = ["📋 *Табель успішності*\n"]
-        lines.append("```")
-        
-        for item in results:
-            subject = item['subject']
-            grade = item['semester_1']
-            if len(subject) > 30:
-                subject = subject[:27] + "..."
-            lines.append(f"{subject}: {grade}")
-        
-        lines.append("```")
-        
-        with_grades = [r for r in results if r['semester_1'] != 'немає']
-        if with_grades:
-            avg_grade = sum(int(r['semester_1']) for r in with_grades) / len(with_grades)
-            lines.append(f"\n📊 Середній бал: *{avg_grade:.2f}*")
-        
-        await msg.edit_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+        await msg.edit_text(rendered, parse_mode=ParseMode.MARKDOWN)
         
     except Exception as e:
-        print(f"[REPORT_CARD] Error: {e}")
+        report_card_log.warning("Error: %s", e)
         await msg.edit_text(f"❌ Помилка: {e}")
 
 
@@ -3054,6 +3636,25 @@ async def revoke_vip_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
+async def rebuild_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Адмін команда: /rebuild_stats [student_id] — перераховує агрегати оцінок зі сховища і звіряє їх"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Тільки адміни можуть виконувати цю команду")
+        return
+
+    student_id = context.args[0] if context.args else None
+    await update.message.reply_text("🔄 Перераховую агрегати оцінок...")
+    try:
+        rows, mismatched = await asyncio.to_thread(rebuild_mark_stats, student_id)
+    except Exception as e:
+        admin_log.exception("Mark stats rebuild failed: %s", e)
+        await update.message.reply_text(f"❌ Помилка: {e}")
+        return
+    log_admin_action(update.effective_user.id, 'rebuild_stats', details=f'student_id={student_id or "all"} rows={rows} mismatched={mismatched}')
+    text = f"✅ Агрегати перераховано: {rows}"
+    text += f"\n⚠️ Розходилися з інкрементальними: {mismatched}" if mismatched else "\nРозбіжностей не знайдено"
+    await update.message.reply_text(text)
+
 async def ticket_close_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Адмін команда: /ticket_close <ticket_id> [note]"""
     if not is_admin(update.effective_user.id):
@@ -3123,72 +3724,563 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
 
-# ============== ОБРОБКА КНОПОК ==============
+# ============== ОБРОБКА КНОПОК ==============
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник кнопок з клавіатури"""
+    try:
+        button_log.info("from=%s text=%s", update.effective_user and update.effective_user.id, getattr(update.message, 'text', None), extra=SAMPLED)
+    except Exception:
+        pass
+    text = update.message.text
+
+    if text == "📅 Розклад":
+        # Сразу показываем расписание на сегодня с кнопками дней
+        today = datetime.now()
+        weekday = today.weekday()
+        
+        if weekday >= 5:  # Субота або Неділя
+            await update.message.reply_text(
+                f"🌴 *{WEEKDAYS[weekday]}* — вихідний",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=InlineKeyboardMarkup([
+                    [
+                        InlineKeyboardButton("Пн", callback_data="schedule:Понеділок"),
+                        InlineKeyboardButton("Вт", callback_data="schedule:Вівторок"),
+                        InlineKeyboardButton("Ср", callback_data="schedule:Середа"),
+                        InlineKeyboardButton("Чт", callback_data="schedule:Четвер"),
+                        InlineKeyboardButton("Пт", callback_data="schedule:П'ятниця")
+                    ]
+                ])
+            )
+        else:
+            await schedule_for_date(update, context, today.strftime('%Y-%m-%d'))
+    elif text == "📚 Домашка":
+        # Убрали отдельную кнопку, теперь только через Розклад
+        await show_weekday_keyboard(update, context, kind='schedule')
+    elif text == "📊 Середній бал":
+        # Показываем интерактивное меню для среднего бала
+        kb = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📊 За весь навчальний рік", callback_data="avg:full_year")],
+            [InlineKeyboardButton("📅 Вказати діапазон дат", callback_data="avg:custom_dates")],
+            [InlineKeyboardButton("❌ Скасувати", callback_data="avg:cancel")]
+        ])
+        await update.message.reply_text(
+            "📊 *Середній бал*\n\n"
+            "Оберіть опцію:\n\n"
+            "💡 _Або просто надішліть дати у форматі:_\n"
+            "`10.12.2025 20.12.2025`\n"
+            "або\n"
+            "`05.10.2025 25.11.2025`",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=kb
+        )
+    elif text == "📋 Табель":
+        await report_card_cmd(update, context)
+    elif text == "📰 Новини":
+        await news_cmd(update, context)
+    elif text == "💎 VIP" or text == "⭐️ VIP":
+        await vip_menu_cmd(update, context)
+    elif text == "✉️ Підтримка":
+        await support_cmd(update, context)
+    elif text == "🛠 Админ-меню":
+        if is_admin(update.effective_user.id):
+            await admin_menu_cmd(update, context)
+        else:
+            await update.message.reply_text("❌ Тільки для адміністраторів")
+    else:
+        await update.message.reply_text("❓ Не знаю такої кнопки. Використайте /help для довідки.")
+
+def render_analytics(subject_stats: dict, trends: dict = None) -> str:
+    """Markdown-аналітика за агрегатами {предмет: SubjectStats}: загальна статистика, топ-3,
+    предмети, що потребують уваги, і тренди семестру {предмет: SubjectTrend}"""
+    analytics_text = "🎯 *Аналітика успішності*\n\n"
+
+    if not subject_stats:
+        analytics_text += "❌ Оцінки не знайдено за цей період"
+    else:
+        numeric = {name: stats for name, stats in subject_stats.items() if stats.count}
+        if numeric:
+            count = sum(stats.count for stats in numeric.values())
+            overall_avg = sum(stats.total for stats in numeric.values()) / count
+            analytics_text += f"📊 *Загальна статистика:*\n"
+            analytics_text += f"• Середній бал: {overall_avg:.2f}\n"
+            analytics_text += f"• Всього оцінок: {count}\n"
+            analytics_text += f"• Мінімальна: {min(stats.min_value for stats in numeric.values())}\n"
+            analytics_text += f"• Максимальна: {max(stats.max_value for stats in numeric.values())}\n\n"
+
+            # Топ-3 и худшие предметы
+            sorted_subjects = sorted(numeric.items(), key=lambda x: x[1].avg, reverse=True)
+            analytics_text += "🏆 *Топ-3 предмети:*\n"
+            for i, (name, stats) in enumerate(sorted_subjects[:3], 1):
+                analytics_text += f"{i}. {name}: {stats.avg:.2f} ({stats.count} оцінок)\n"
+
+            if len(sorted_subjects) > 3:
+                analytics_text += "\n⚠️ *Потребують уваги:*\n"
+                for name, stats in sorted_subjects[-3:]:
+                    analytics_text += f"• {name}: {stats.avg:.2f}\n"
+        else:
+            analytics_text += "❌ Не знайдено числових оцінок"
+    if trends:
+        analytics_text += "\n" + render_trends(trends)
+    return analytics_text
+
+
+def render_trends(trends: dict) -> str:
+    """Тренди семестру: ковзне середнє, зміна за місяць, прогноз і скільки 12-к до наступного балу"""
+    lines = ["📈 *Тренди за семестр:*"]
+    for name, t in sorted(trends.items(), key=lambda x: x[1].mean, reverse=True):
+        parts = []
+        if t.slope is not None:
+            arrow = '↗' if t.slope > 0.1 else '↘' if t.slope < -0.1 else '→'
+            parts.append(f"{arrow} {t.slope:+.1f}/міс")
+        parts.append(f"останні: {t.moving_avg:.2f}")
+        parts.append(f"прогноз: {t.projection:.1f}")
+        if t.target is not None:
+            parts.append(f"до {t.target}: {t.needed}×12" if t.needed is not None else f"{t.target} недосяжно")
+        lines.append(f"• {name}: " + ", ".join(parts))
+    return "\n".join(lines) + "\n"
+
+
+def load_mark_series(student_ids, start: str, end: str) -> dict:
+    """{(student_id, предмет): [(date_iso, value), ...]} — числові оцінки з датою зі сховища, в порядку дат"""
+    ids = [str(sid) for sid in student_ids]
+    series = {}
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            c.execute(f'''SELECT student_id, subject, mark_date, value FROM marks
+                           WHERE student_id IN ({','.join('?' * len(chunk))}) AND value IS NOT NULL
+                             AND mark_date BETWEEN ? AND ?
+                           ORDER BY student_id, subject, mark_date, rowid''', (*chunk, start, end))
+            for sid, subject, mark_date, value in c.fetchall():
+                series.setdefault((sid, subject), []).append((mark_date, value))
+    finally:
+        conn.close()
+    return series
+
+
+# student_id -> (відбиток агрегатів і дати, {предмет: SubjectTrend})
+_TREND_CACHE = LRUCache(TREND_CACHE_SIZE)
+
+
+def _trend_fingerprint(subject_stats: dict, today) -> str:
+    # Тренди змінюються лише з новими оцінками (агрегати) або з датою (прогноз)
+    return content_digest('trends', today.isoformat(), subject_stats)
+
+
+def _semester_range(today):
+    sem_start, _ = semester_bounds(today)
+    return sem_start.isoformat(), today.isoformat()
+
+
+def get_trends(student_id, subject_stats: dict) -> dict:
+    """Блокуючий виклик: {предмет: SubjectTrend}; з кешу, якщо оцінки не змінились (див. prewarm_trends)"""
+    student_id = str(student_id)
+    today = now_kyiv().date()
+    fingerprint = _trend_fingerprint(subject_stats, today)
+    cached = _TREND_CACHE.get(student_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    series = load_mark_series([student_id], *_semester_range(today))
+    trends = {subject: t for (_, subject), t in compute_trends(series, today).items()}
+    _TREND_CACHE.set(student_id, (fingerprint, trends))
+    return trends
+
+
+def prewarm_trends(student_ids) -> int:
+    """Блокуючий виклик: тренди для всіх учнів одним векторним розрахунком; повертає кількість учнів"""
+    today = now_kyiv().date()
+    school_year = school_year_of(today.isoformat())
+    student_ids = [str(sid) for sid in student_ids]
+    # Інакше пакет витіснив би з кешу власні результати, щойно VIP більше, ніж записів у кеші
+    _TREND_CACHE.maxsize = max(_TREND_CACHE.maxsize, len(student_ids))
+    computed = compute_trends(load_mark_series(student_ids, *_semester_range(today)), today)
+    per_student = {sid: {} for sid in student_ids}
+    for (sid, subject), trend in computed.items():
+        per_student[sid][subject] = trend
+    for sid, trends in per_student.items():
+        fingerprint = _trend_fingerprint(get_mark_stats(sid, school_year), today)
+        _TREND_CACHE.set(sid, (fingerprint, trends))
+    return len(per_student)
+
+
+async def prewarm_trends_job(context: ContextTypes.DEFAULT_TYPE):
+    """Нічний пакет: тренди всіх активних VIP, щоб аналітика відкривалась без розрахунків.
+
+    Рахується лише з локального сховища оцінок, без звернень до nz.ua: для учнів, які давно не відкривали
+    бота, тренди відбивають останні збережені оцінки. Свіжі оцінки змінюють агрегати, тож при наступному
+    перегляді аналітики тренди такого учня перераховуються (див. get_trends).
+    """
+    try:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute('''SELECT DISTINCT s.student_id FROM sessions s JOIN vip_users v ON v.user_id = s.user_id
+                     WHERE v.expires_at > ? AND s.student_id IS NOT NULL''', (int(time.time()),))
+        student_ids = [row[0] for row in c.fetchall()]
+        conn.close()
+        started = time.perf_counter()
+        count = await asyncio.to_thread(prewarm_trends, student_ids)
+        vip_job_log.info("Trends pre-warmed for %s students in %.2f s", count, time.perf_counter() - started)
+    except Exception as e:
+        vip_job_log.exception("Trend pre-warm failed: %s", e)
+
+
+# ============== PDF-ЗВІТ ==============
+
+# digest (оцінки + період + ПІБ) -> (filename, bytes | file_id вже надісланого документа)
+_REPORT_CACHE = LRUCache(REPORT_CACHE_SIZE)
+# digest -> задача рендеру, щоб однакові запити не рендерилися паралельно
+_REPORT_JOBS = {}
+_REPORT_POOL = None
+_REPORT_POOL_LOCK = threading.Lock()
+
+
+def get_report_pool() -> ProcessPoolExecutor:
+    """Пул процесів для рендеру звітів (spawn: воркер не успадковує потоки й сокети бота)"""
+    global _REPORT_POOL
+    with _REPORT_POOL_LOCK:
+        if _REPORT_POOL is None:
+            _REPORT_POOL = ProcessPoolExecutor(max_workers=REPORT_WORKERS,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _REPORT_POOL
+
+
+def _reset_report_pool():
+    global _REPORT_POOL
+    with _REPORT_POOL_LOCK:
+        pool, _REPORT_POOL = _REPORT_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _render_in_pool(payload: dict):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_report_pool(), render_report, payload)
+    except BrokenProcessPool:
+        # Воркер впав (наприклад, через нестачу пам'яті) — наступний звіт створить новий пул
+        _reset_report_pool()
+        raise
+
+
+async def build_report(payload: dict):
+    """(filename, document) для payload з report_payload(); рендер — у пулі процесів, результат кешується"""
+    digest = content_digest('report', payload)
+    cached = _REPORT_CACHE.get(digest)
+    if cached is not None:
+        return cached
+    job = _REPORT_JOBS.get(digest)
+    if job is None:
+        job = asyncio.ensure_future(_render_in_pool(payload))
+        _REPORT_JOBS[digest] = job
+        job.add_done_callback(lambda _: _REPORT_JOBS.pop(digest, None))
+    ext, data = await asyncio.shield(job)
+    result = (f"report_{payload['end'].replace('-', '')}.{ext}", data)
+    if digest not in _REPORT_CACHE:
+        _REPORT_CACHE.set(digest, result)
+    return result
+
+
+async def _pdf_report_job(message, session, user_id: int):
+    """Фонова задача: збирає оцінки, рендерить звіт у процесі-воркері й надсилає документом"""
+    try:
+        start, end = school_year_range()
+        result = await get_marks(user_id, session, start, end)
+        subjects_parsed = result.subjects
+        if not subjects_parsed:
+            await message.edit_text("❌ Не вдалось отримати дані для звіту")
+            return
+
+        payload = report_payload(subjects_parsed, session.get('fio', '—'), result.start, result.end)
+        filename, document = await build_report(payload)
+        sent = await message.reply_document(document=document, filename=filename, caption="📑 Звіт про успішність")
+        if isinstance(document, bytes) and sent.document:
+            # Повторний запит з тими ж оцінками надішле вже завантажений файл за file_id
+            _REPORT_CACHE.set(content_digest('report', payload), (filename, sent.document.file_id))
+        await message.edit_text("✅ PDF-звіт готовий!" if filename.endswith('.pdf') else "✅ Звіт надіслано!")
+    except Exception as e:
+        vip_pdf_log.exception("Error: %s", e)
+        try:
+            await message.edit_text(f"❌ Помилка при створенні звіту: {e}")
+        except Exception:
+            pass
+
+
+# ============== РОЗСИЛКА ==============
+
+class TokenBucket:
+    """Асинхронний обмежувач частоти: rate дозволів на секунду, не більше burst поспіль.
+
+    pause() зупиняє всіх, хто чекає на дозвіл, до дедлайну (RetryAfter від Telegram діє на весь бот).
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self._updated = self._resume_at
+        self._tokens = 0.0
+
+    async def acquire(self):
+        # Лок робить чергу справедливою: дозволи видаються в порядку звернень
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._resume_at:
+                    await asyncio.sleep(self._resume_at - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Спільний для всіх розсилок, щоб кілька одночасних розсилок разом не перевищили ліміт
+_BROADCAST_LIMITER = TokenBucket(BROADCAST_RATE)
+# broadcast_id -> задача розсилки
+_BROADCAST_TASKS = {}
+
+BROADCAST_FIELDS = ('id', 'admin_id', 'text', 'status', 'total', 'sent', 'failed', 'last_user_id', 'chat_id', 'message_id')
+
+
+def create_broadcast(admin_id: int, text: str, chat_id: int = None, message_id: int = None) -> int:
+    now = int(time.time())
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM sessions')
+    total = c.fetchone()[0]
+    c.execute('''INSERT INTO broadcasts (admin_id, text, total, chat_id, message_id, created_at, updated_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)''', (admin_id, text, total, chat_id, message_id, now, now))
+    broadcast_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return broadcast_id
+
+
+def get_broadcast(broadcast_id: int) -> Optional[dict]:
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(BROADCAST_FIELDS)} FROM broadcasts WHERE id = ?", (broadcast_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(zip(BROADCAST_FIELDS, row)) if row else None
+
+
+def save_broadcast_progress(broadcast: dict):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('UPDATE broadcasts SET status = ?, sent = ?, failed = ?, last_user_id = ?, updated_at = ? WHERE id = ?',
+              (broadcast['status'], broadcast['sent'], broadcast['failed'], broadcast['last_user_id'],
+               int(time.time()), broadcast['id']))
+    conn.commit()
+    conn.close()
+
+
+def unfinished_broadcast_ids() -> list:
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+    ids = [row[0] for row in c.fetchall()]
+    conn.close()
+    return ids
+
+
+def _broadcast_recipients(after_user_id: int, limit: int) -> list:
+    """Наступна сторінка отримувачів (keyset по первинному ключу sessions)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT user_id FROM sessions WHERE user_id > ? ORDER BY user_id LIMIT ?', (after_user_id, limit))
+    ids = [row[0] for row in c.fetchall()]
+    conn.close()
+    return ids
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 60} хв {seconds % 60} с" if seconds >= 60 else f"{seconds} с"
+
+
+def render_broadcast_status(broadcast: dict, rate: float = 0.0, paused: bool = False) -> str:
+    done = broadcast['sent'] + broadcast['failed']
+    total = max(broadcast['total'], done)
+    if broadcast['status'] == 'done':
+        header = f"✅ *Розсилка #{broadcast['id']} завершена*"
+    elif paused:
+        header = f"⏸ *Розсилку #{broadcast['id']} призупинено*, вона продовжиться після перезапуску бота"
+    else:
+        header = f"📤 *Розсилка #{broadcast['id']}*"
+    lines = [
+        header, "",
+        f"📊 Оброблено: {done}/{total} ({done * 100 // total if total else 100}%)",
+        f"• Успішно: {broadcast['sent']}",
+        f"• Не вдалось: {broadcast['failed']}",
+    ]
+    if rate > 0:
+        speed = f"⚡ {rate:.1f} повідомлень/с"
+        if broadcast['status'] != 'done' and not paused and total > done:
+            speed += f", залишилось ~{_format_duration((total - done) / rate)}"
+        lines.append(speed)
+    return "\n".join(lines)
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    delay = exc.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+async def _send_broadcast_message(bot, user_id: int, text: str) -> bool:
+    """Надсилає повідомлення розсилки в межах _BROADCAST_LIMITER; True, якщо доставлено"""
+    for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+        await _BROADCAST_LIMITER.acquire()
+        try:
+            await bot.send_message(user_id, text)
+            return True
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            broadcast_log.warning("Flood control: pausing broadcasts for %.1f s", delay)
+            _BROADCAST_LIMITER.pause(delay)
+        except (Forbidden, BadRequest) as e:
+            # Бота заблоковано, чат видалено тощо — повтор не допоможе
+            broadcast_log.info("Skipping user %s: %s", user_id, e, extra=SAMPLED)
+            return False
+        except NetworkError as e:
+            broadcast_log.warning("Send to user %s failed (attempt %s): %s", user_id, attempt, e, extra=SAMPLED)
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except Exception as e:
+            broadcast_log.warning("Failed to send to user %s: %s", user_id, e, extra=SAMPLED)
+            return False
+    return False
+
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробник кнопок з клавіатури"""
+async def run_broadcast(application, broadcast_id: int):
+    """Розсилає повідомлення розсилки всім користувачам, починаючи після last_user_id.
+
+    Отримувачі читаються з БД сторінками й роздаються BROADCAST_CONCURRENCY воркерам. last_user_id
+    просувається лише по суцільному префіксу оброблених, тож після перезапуску нікого не буде пропущено
+    (повторно отримати повідомлення можуть лише ті, чиї відправки були в польоті).
+    """
+    broadcast = await asyncio.to_thread(get_broadcast, broadcast_id)
+    if not broadcast or broadcast['status'] != 'running':
+        return
+    bot = application.bot
+    queue = asyncio.Queue(maxsize=BROADCAST_BATCH_SIZE)
+    issued = deque()    # id отримувачів у порядку видачі, ще не зараховані в last_user_id
+    handled = set()
+    started, done_before = time.monotonic(), broadcast['sent'] + broadcast['failed']
+    shown = None
+
+    async def produce():
+        after = broadcast['last_user_id']
+        while application.running:
+            user_ids = await asyncio.to_thread(_broadcast_recipients, after, BROADCAST_BATCH_SIZE)
+            if not user_ids:
+                break
+            for uid in user_ids:
+                issued.append(uid)
+                await queue.put(uid)
+            after = user_ids[-1]
+        for _ in range(BROADCAST_CONCURRENCY):
+            await queue.put(None)
+
+    async def work():
+        while True:
+            uid = await queue.get()
+            if uid is None:
+                return
+            if not application.running:
+                # Бот зупиняється: решту черги не надсилаємо, її підхопить продовження розсилки
+                continue
+            if await _send_broadcast_message(bot, uid, broadcast['text']):
+                broadcast['sent'] += 1
+            else:
+                broadcast['failed'] += 1
+            handled.add(uid)
+
+    async def checkpoint(paused: bool = False):
+        nonlocal shown
+        while issued and issued[0] in handled:
+            handled.discard(issued[0])
+            broadcast['last_user_id'] = issued.popleft()
+        await asyncio.to_thread(save_broadcast_progress, broadcast)
+        if not broadcast['chat_id'] or not broadcast['message_id']:
+            return
+        elapsed = time.monotonic() - started
+        rate = (broadcast['sent'] + broadcast['failed'] - done_before) / elapsed if elapsed > 0 else 0.0
+        text = render_broadcast_status(broadcast, rate, paused)
+        if text == shown:
+            return
+        try:
+            await bot.edit_message_text(text, chat_id=broadcast['chat_id'], message_id=broadcast['message_id'],
+                                        parse_mode=ParseMode.MARKDOWN)
+            shown = text
+        except RetryAfter:
+            pass    # статус оновиться наступного разу
+        except Exception as e:
+            broadcast_log.warning("Could not update status of broadcast #%s: %s", broadcast_id, e, extra=SAMPLED)
+
+    broadcast_log.info("Broadcast #%s started after user %s", broadcast_id, broadcast['last_user_id'])
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(work()) for _ in range(BROADCAST_CONCURRENCY)]
     try:
-        print(f"[BUTTON] from={update.effective_user and update.effective_user.id} text={getattr(update.message, 'text', None)}")
-    except Exception:
-        pass
-    text = update.message.text
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=BROADCAST_PROGRESS_INTERVAL,
+                                               return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            if pending:
+                await checkpoint()
+        if application.running:
+            broadcast['status'] = 'done'
+        await checkpoint(paused=broadcast['status'] != 'done')
+        if broadcast['status'] == 'done':
+            broadcast_log.info("Broadcast #%s finished: sent=%s failed=%s", broadcast_id, broadcast['sent'], broadcast['failed'])
+            await asyncio.to_thread(log_admin_action, broadcast['admin_id'], 'broadcast',
+                                    details=f"broadcast #{broadcast_id}: sent to {broadcast['sent']} users")
+    except Exception as e:
+        # Статус лишається 'running' — розсилка продовжиться після перезапуску
+        broadcast_log.exception("Broadcast #%s interrupted: %s", broadcast_id, e)
+        try:
+            await checkpoint(paused=True)
+        except Exception:
+            pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        log_memory('admin_broadcast')
+
+
+def start_broadcast(application, broadcast_id: int):
+    """Запускає фонову задачу розсилки (якщо вона ще не виконується)"""
+    task = _BROADCAST_TASKS.get(broadcast_id)
+    if task is None or task.done():
+        task = application.create_task(run_broadcast(application, broadcast_id))
+        _BROADCAST_TASKS[broadcast_id] = task
+        task.add_done_callback(lambda _: _BROADCAST_TASKS.pop(broadcast_id, None))
+    return task
+
+
+async def resume_broadcasts_job(context: ContextTypes.DEFAULT_TYPE):
+    """Після запуску бота продовжує розсилки, перервані перезапуском"""
+    try:
+        broadcast_ids = await asyncio.to_thread(unfinished_broadcast_ids)
+        for broadcast_id in broadcast_ids:
+            start_broadcast(context.application, broadcast_id)
+        if broadcast_ids:
+            broadcast_log.info("Resuming %s unfinished broadcasts", len(broadcast_ids))
+    except Exception as e:
+        broadcast_log.exception("Could not resume broadcasts: %s", e)
 
-    if text == "📅 Розклад":
-        # Сразу показываем расписание на сегодня с кнопками дней
-        today = datetime.now()
-        weekday = today.weekday()
-        
-        if weekday >= 5:  # Субота або Неділя
-            await update.message.reply_text(
-                f"🌴 *{WEEKDAYS[weekday]}* — вихідний",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("Пн", callback_data="schedule:Понеділок"),
-                        InlineKeyboardButton("Вт", callback_data="schedule:Вівторок"),
-                        InlineKeyboardButton("Ср", callback_data="schedule:Середа"),
-                        InlineKeyboardButton("Чт", callback_data="schedule:Четвер"),
-                        InlineKeyboardButton("Пт", callback_data="schedule:П'ятниця")
-                    ]
-                ])
-            )
-        else:
-            await schedule_for_date(update, context, today.strftime('%Y-%m-%d'))
-    elif text == "📚 Домашка":
-        # Убрали отдельную кнопку, теперь только через Розклад
-        await show_weekday_keyboard(update, context, kind='schedule')
-    elif text == "📊 Середній бал":
-        # Показываем интерактивное меню для среднего бала
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📊 За весь навчальний рік", callback_data="avg:full_year")],
-            [InlineKeyboardButton("📅 Вказати діапазон дат", callback_data="avg:custom_dates")],
-            [InlineKeyboardButton("❌ Скасувати", callback_data="avg:cancel")]
-        ])
-        await update.message.reply_text(
-            "📊 *Середній бал*\n\n"
-            "Оберіть опцію:\n\n"
-            "💡 _Або просто надішліть дати у форматі:_\n"
-            "`10.12.2025 20.12.2025`\n"
-            "або\n"
-            "`05.10.2025 25.11.2025`",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=kb
-        )
-    elif text == "📋 Табель":
-        await report_card_cmd(update, context)
-    elif text == "📰 Новини":
-        await news_cmd(update, context)
-    elif text == "💎 VIP" or text == "⭐️ VIP":
-        await vip_menu_cmd(update, context)
-    elif text == "✉️ Підтримка":
-        await support_cmd(update, context)
-    elif text == "🛠 Админ-меню":
-        if is_admin(update.effective_user.id):
-            await admin_menu_cmd(update, context)
-        else:
-            await update.message.reply_text("❌ Тільки для адміністраторів")
-    else:
-        await update.message.reply_text("❓ Не знаю такої кнопки. Використайте /help для довідки.")
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник callback-запитів (інлайн кнопки)"""
@@ -3280,13 +4372,13 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             # Ignore 'Query is too old' and similar transient errors
             msg = str(e)
             if 'Query is too old' in msg or 'query id is invalid' in msg or 'response timeout' in msg:
-                print(f"[CALLBACK] Ignored BadRequest while answering callback: {msg}")
+                callback_log.warning("Ignored BadRequest while answering callback: %s", msg)
                 return
             else:
-                print(f"[CALLBACK] BadRequest while answering callback: {msg}")
+                callback_log.warning("BadRequest while answering callback: %s", msg)
                 return
         except Exception as e:
-            print(f"[CALLBACK] Unexpected error answering callback: {e}")
+            callback_log.warning("Unexpected error answering callback: %s", e)
             return
 
     await _safe_answer(query)
@@ -3336,23 +4428,13 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         action = parts[1] if len(parts) > 1 else None
         user_id = query.from_user.id
         
-        if not is_vip_user(user_id):
+        vip_expires = get_vip_expires(user_id)
+        if vip_expires is None:
             await _safe_answer(query, text='Тільки VIP-користувачі можуть використовувати ці функції', show_alert=True)
             return
         
-        # Получаем информацию о VIP статусе для меню
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT expires_at FROM vip_users WHERE user_id = ?', (user_id,))
-        row = c.fetchone()
-        conn.close()
-        expires_text = "Не встановлено"
-        if row and row[0]:
-            try:
-                expires = datetime.fromisoformat(row[0])
-                expires_text = expires.strftime('%d.%m.%Y %H:%M')
-            except:
-                expires_text = str(row[0])
+        # Інформація про VIP статус для меню (з реєстру в пам'яті)
+        expires_text = vip_expires.strftime('%d.%m.%Y %H:%M')
         
         def build_keyboard(uid):
             s = get_all_vip_settings(uid)
@@ -3391,173 +4473,13 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             await query.edit_message_text("🔄 Завантажую дані для аналітики...")
             
             try:
-                # Получаем оценки через API
-                today = datetime.now()
-                year = today.year
-                aug1 = datetime(year, 8, 1)
-                if today < aug1:
-                    aug1 = datetime(year - 1, 8, 1)
-                start = aug1.strftime('%Y-%m-%d')
-                end = today.strftime('%Y-%m-%d')
-                
-                r = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/student-performance",
-                    headers={"Authorization": f"Bearer {session['token']}"},
-                    json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                )
-                
-                if r.status_code == 401:
-                    new_session = await refresh_session(user_id)
-                    if new_session:
-                        session = new_session
-                        r = get_scraper().post(
-                            f"{API_BASE}/v1/schedule/student-performance",
-                            headers={"Authorization": f"Bearer {session['token']}"},
-                            json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                        )
-                
-                subjects_parsed = {}
-                api_data = None
-                total_api_marks = 0
-                
-                # Пробуем API
-                if r.status_code == 200:
-                    api_data = r.json()
-                    for subj in api_data.get('subjects', []):
-                        total_api_marks += len(subj.get('marks', []) or [])
-                    
-                    if total_api_marks > 0:
-                        # Используем API данные
-                        for subj in api_data.get('subjects', []):
-                            name = subj.get('subject_name', '').strip()
-                            marks = subj.get('marks', []) or []
-                            if name:
-                                tokens = []
-                                for m in marks:
-                                    if isinstance(m, (str, int, float)):
-                                        tokens.append(str(m))
-                                    else:
-                                        sig, disp = _extract_mark_info(m)
-                                        tokens.append(disp)
-                                subjects_parsed[name] = tokens
-                
-                # Если API пустой или нет данных, пробуем HTML (как в функции avg)
-                if not subjects_parsed:
-                    grades_url = f"https://nz.ua/schedule/grades-statement"
-                    params = {'student_id': session['student_id']}
-                    headers = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': grades_url}
-                    grades_html = None
-                    
-                    # Створюємо один scraper для всієї сесії веб-логіну
-                    web_scraper = get_scraper()
-                    # Пробуем несколько раз с логином (как в avg)
-                    for attempt in range(4):
-                        try:
-                            gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                            if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                grades_html = gresp.text
-                                break
-                        except Exception as exc:
-                            pass
-                        
-                        # Try logging in and retry
-                        try:
-                            login_url = "https://nz.ua/login"
-                            page = web_scraper.get(login_url, timeout=10, headers=headers)
-                            csrf = None
-                            from bs4 import BeautifulSoup
-                            login_soup = BeautifulSoup(page.text, 'html.parser')
-                            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-                            if meta_csrf:
-                                csrf = meta_csrf.get('content')
-                            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-                            if hidden_csrf and hidden_csrf.get('value'):
-                                csrf = hidden_csrf.get('value')
-                            
-                            login_data = {
-                                "LoginForm[login]": session['username'],
-                                "LoginForm[password]": session['password'],
-                                "LoginForm[rememberMe]": "1"
-                            }
-                            lheaders = {'Referer': grades_url}
-                            if csrf:
-                                login_data['_csrf'] = csrf
-                                lheaders['X-CSRF-Token'] = csrf
-                            
-                            web_scraper.post(login_url, data=login_data, headers=lheaders, timeout=10)
-                            # retry fetch after login
-                            try:
-                                gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                                if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                    grades_html = gresp.text
-                                    break
-                            except Exception:
-                                pass
-                        except Exception:
-                            pass
-                        
-                        time.sleep(1)
-                    
-                    if grades_html:
-                        sd, ed, subs = parse_grades_from_html(grades_html)
-                        for name, toks in subs.items():
-                            filtered = []
-                            for tok_item in toks:
-                                if isinstance(tok_item, (list, tuple)) and len(tok_item) >= 2:
-                                    tok_text = tok_item[0]
-                                else:
-                                    tok_text = str(tok_item)
-                                filtered.append(tok_text)
-                            if filtered:
-                                subjects_parsed[name] = filtered
-                
-                analytics_text = "🎯 *Аналітика успішності*\n\n"
+                start, end = school_year_range()
+                # get_marks оновлює сховище й агрегати; аналітика читає лише агрегати за навчальний рік
+                await get_marks(user_id, session, start, end)
+                subject_stats = await asyncio.to_thread(get_mark_stats, session['student_id'], start)
+                trends = await asyncio.to_thread(get_trends, session['student_id'], subject_stats) if NUMPY_AVAILABLE else None
                 
-                if not subjects_parsed:
-                    analytics_text += "❌ Оцінки не знайдено за цей період"
-                else:
-                    # Собираем статистику
-                    all_marks = []
-                    subject_stats = {}
-                    
-                    for name, tokens in subjects_parsed.items():
-                        numeric_marks = []
-                        for tok in tokens:
-                            val = _extract_numeric_from_mark(tok)
-                            if val is not None:
-                                numeric_marks.append(val)
-                                all_marks.append(val)
-                        
-                        if numeric_marks:
-                            avg = sum(numeric_marks) / len(numeric_marks)
-                            subject_stats[name] = {
-                                'avg': avg,
-                                'count': len(numeric_marks),
-                                'min': min(numeric_marks),
-                                'max': max(numeric_marks)
-                            }
-                    
-                    if all_marks:
-                        overall_avg = sum(all_marks) / len(all_marks)
-                        analytics_text += f"📊 *Загальна статистика:*\n"
-                        analytics_text += f"• Середній бал: {overall_avg:.2f}\n"
-                        analytics_text += f"• Всього оцінок: {len(all_marks)}\n"
-                        analytics_text += f"• Мінімальна: {min(all_marks)}\n"
-                        analytics_text += f"• Максимальна: {max(all_marks)}\n\n"
-                        
-                        # Топ-3 и худшие предметы
-                        sorted_subjects = sorted(subject_stats.items(), key=lambda x: x[1]['avg'], reverse=True)
-                        if sorted_subjects:
-                            analytics_text += "🏆 *Топ-3 предмети:*\n"
-                            for i, (name, stats) in enumerate(sorted_subjects[:3], 1):
-                                analytics_text += f"{i}. {name}: {stats['avg']:.2f} ({stats['count']} оцінок)\n"
-                            
-                            if len(sorted_subjects) > 3:
-                                analytics_text += "\n⚠️ *Потребують уваги:*\n"
-                                for name, stats in sorted_subjects[-3:]:
-                                    analytics_text += f"• {name}: {stats['avg']:.2f}\n"
-                    else:
-                        analytics_text += "❌ Не знайдено числових оцінок"
+                analytics_text, _ = render_cached('analytics', render_analytics, subject_stats, trends)
                 
                 kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="vip:back")]])
                 await query.edit_message_text(analytics_text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
@@ -3567,155 +4489,40 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 return
         
         if action == 'export':
-            # Экспорт данных
+            # Экспорт данных: vip:export -> вибір формату, vip:export:<fmt> -> файл
             session = get_session(user_id)
             if not session:
                 await query.edit_message_text("❌ Спочатку увійдіть: /start")
                 return
-            
+
+            formats = available_formats()
+            fmt = parts[2] if len(parts) > 2 else None
+            if fmt not in formats:
+                kb = InlineKeyboardMarkup([
+                    [InlineKeyboardButton(FORMAT_LABELS[f], callback_data=f"vip:export:{f}") for f in formats],
+                    [InlineKeyboardButton("🔙 Назад", callback_data="vip:back")],
+                ])
+                await query.edit_message_text("📄 *Експорт даних*\n\nОберіть формат файлу:", parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+                return
+
             await query.edit_message_text("🔄 Готую експорт даних...")
             
             try:
-                today = datetime.now()
-                year = today.year
-                aug1 = datetime(year, 8, 1)
-                if today < aug1:
-                    aug1 = datetime(year - 1, 8, 1)
-                start = aug1.strftime('%Y-%m-%d')
-                end = today.strftime('%Y-%m-%d')
-                
-                r = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/student-performance",
-                    headers={"Authorization": f"Bearer {session['token']}"},
-                    json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                )
-                
-                if r.status_code == 401:
-                    new_session = await refresh_session(user_id)
-                    if new_session:
-                        session = new_session
-                        r = get_scraper().post(
-                            f"{API_BASE}/v1/schedule/student-performance",
-                            headers={"Authorization": f"Bearer {session['token']}"},
-                            json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                        )
-                
-                subjects_parsed = {}
-                api_data = None
-                total_api_marks = 0
-                
-                # Пробуем API
-                if r.status_code == 200:
-                    api_data = r.json()
-                    for subj in api_data.get('subjects', []):
-                        total_api_marks += len(subj.get('marks', []) or [])
-                    
-                    if total_api_marks > 0:
-                        # Используем API данные
-                        for subj in api_data.get('subjects', []):
-                            name = subj.get('subject_name', '').strip()
-                            marks = subj.get('marks', []) or []
-                            if name:
-                                tokens = []
-                                for m in marks:
-                                    if isinstance(m, (str, int, float)):
-                                        tokens.append(str(m))
-                                    else:
-                                        sig, disp = _extract_mark_info(m)
-                                        tokens.append(disp)
-                                subjects_parsed[name] = tokens
-                
-                # Если API пустой или нет данных, пробуем HTML (как в функции avg)
-                if not subjects_parsed:
-                    grades_url = f"https://nz.ua/schedule/grades-statement"
-                    params = {'student_id': session['student_id']}
-                    headers = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': grades_url}
-                    grades_html = None
-                    
-                    # Створюємо один scraper для всієї сесії веб-логіну
-                    web_scraper = get_scraper()
-                    # Пробуем несколько раз с логином (как в avg)
-                    for attempt in range(4):
-                        try:
-                            gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                            if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                grades_html = gresp.text
-                                break
-                        except Exception as exc:
-                            pass
-                        
-                        # Try logging in and retry
-                        try:
-                            login_url = "https://nz.ua/login"
-                            page = web_scraper.get(login_url, timeout=10, headers=headers)
-                            csrf = None
-                            from bs4 import BeautifulSoup
-                            login_soup = BeautifulSoup(page.text, 'html.parser')
-                            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-                            if meta_csrf:
-                                csrf = meta_csrf.get('content')
-                            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-                            if hidden_csrf and hidden_csrf.get('value'):
-                                csrf = hidden_csrf.get('value')
-                            
-                            login_data = {
-                                "LoginForm[login]": session['username'],
-                                "LoginForm[password]": session['password'],
-                                "LoginForm[rememberMe]": "1"
-                            }
-                            lheaders = {'Referer': grades_url}
-                            if csrf:
-                                login_data['_csrf'] = csrf
-                                lheaders['X-CSRF-Token'] = csrf
-                            
-                            web_scraper.post(login_url, data=login_data, headers=lheaders, timeout=10)
-                            # retry fetch after login
-                            try:
-                                gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                                if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                    grades_html = gresp.text
-                                    break
-                            except Exception:
-                                pass
-                        except Exception:
-                            pass
-                        
-                        time.sleep(1)
-                    
-                    if grades_html:
-                        sd, ed, subs = parse_grades_from_html(grades_html)
-                        for name, toks in subs.items():
-                            filtered = []
-                            for tok_item in toks:
-                                if isinstance(tok_item, (list, tuple)) and len(tok_item) >= 2:
-                                    tok_text = tok_item[0]
-                                else:
-                                    tok_text = str(tok_item)
-                                filtered.append(tok_text)
-                            if filtered:
-                                subjects_parsed[name] = filtered
-                
-                export_text = "📄 *Експорт даних*\n\n"
-                export_text += f"Період: {start} — {end}\n\n"
-                
-                if subjects_parsed:
-                    for name, tokens in subjects_parsed.items():
-                        marks_str = ', '.join(tokens)
-                        export_text += f"{name}: {marks_str}\n"
-                else:
-                    export_text += "❌ Оцінки не знайдено"
-                
-                # Отправляем как файл если слишком длинное
-                if len(export_text) > 4000:
-                    # Разбиваем на части
-                    parts = [export_text[i:i+4000] for i in range(0, len(export_text), 4000)]
-                    for part in parts:
-                        await query.message.reply_text(part)
-                    kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="vip:back")]])
-                    await query.message.reply_text("✅ Експорт завершено", reply_markup=kb)
-                else:
-                    kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="vip:back")]])
-                    await query.edit_message_text(export_text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+                start, end = school_year_range()
+                # Свіжі оцінки get_marks записує у сховище; якщо сайт недоступний — експортуємо те, що вже є
+                await get_marks(user_id, session, start, end)
+                document, count = await asyncio.to_thread(export_stored_marks, session['student_id'], start, end, fmt)
+                kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="vip:back")]])
+                with document:
+                    if not count:
+                        await query.edit_message_text("❌ Оцінки не знайдено", reply_markup=kb)
+                        return
+                    await query.message.reply_document(
+                        document=document,
+                        filename=f"marks_{start}_{end}.{fmt}",
+                        caption=f"📄 Оцінки за {start} — {end}"
+                    )
+                await query.edit_message_text(f"✅ Експорт завершено: {count} оцінок", reply_markup=kb)
                 return
             except Exception as e:
                 await query.edit_message_text(f"❌ Помилка: {e}")
@@ -3728,205 +4535,10 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 await query.edit_message_text("❌ Спочатку увійдіть: /start")
                 return
             
-            await query.edit_message_text("🔄 Готую PDF-звіт про успішність...")
-            
-            try:
-                # Получаем данные для отчета (используем ту же логику что и в analytics)
-                today = datetime.now()
-                year = today.year
-                aug1 = datetime(year, 8, 1)
-                if today < aug1:
-                    aug1 = datetime(year - 1, 8, 1)
-                start = aug1.strftime('%Y-%m-%d')
-                end = today.strftime('%Y-%m-%d')
-                
-                r = get_scraper().post(
-                    f"{API_BASE}/v1/schedule/student-performance",
-                    headers={"Authorization": f"Bearer {session['token']}"},
-                    json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                )
-                
-                if r.status_code == 401:
-                    new_session = await refresh_session(user_id)
-                    if new_session:
-                        session = new_session
-                        r = get_scraper().post(
-                            f"{API_BASE}/v1/schedule/student-performance",
-                            headers={"Authorization": f"Bearer {session['token']}"},
-                            json={"student_id": session['student_id'], "start_date": start, "end_date": end}
-                        )
-                
-                subjects_parsed = {}
-                api_data = None
-                total_api_marks = 0
-                
-                # Пробуем API
-                if r.status_code == 200:
-                    api_data = r.json()
-                    for subj in api_data.get('subjects', []):
-                        total_api_marks += len(subj.get('marks', []) or [])
-                    
-                    if total_api_marks > 0:
-                        for subj in api_data.get('subjects', []):
-                            name = subj.get('subject_name', '').strip()
-                            marks = subj.get('marks', []) or []
-                            if name:
-                                tokens = []
-                                for m in marks:
-                                    if isinstance(m, (str, int, float)):
-                                        tokens.append(str(m))
-                                    else:
-                                        sig, disp = _extract_mark_info(m)
-                                        tokens.append(disp)
-                                subjects_parsed[name] = tokens
-                
-                # Если API пустой, пробуем HTML
-                if not subjects_parsed:
-                    grades_url = f"https://nz.ua/schedule/grades-statement"
-                    params = {'student_id': session['student_id']}
-                    headers = {'User-Agent': 'nz-bot/1.0 (+https://nz.ua)', 'Referer': grades_url}
-                    grades_html = None
-                    
-                    # Створюємо один scraper для всієї сесії веб-логіну
-                    web_scraper = get_scraper()
-                    for attempt in range(4):
-                        try:
-                            gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                            if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                grades_html = gresp.text
-                                break
-                        except Exception:
-                            pass
-                        
-                        try:
-                            login_url = "https://nz.ua/login"
-                            page = web_scraper.get(login_url, timeout=10, headers=headers)
-                            csrf = None
-                            from bs4 import BeautifulSoup
-                            login_soup = BeautifulSoup(page.text, 'html.parser')
-                            meta_csrf = login_soup.find('meta', attrs={'name': 'csrf-token'})
-                            if meta_csrf:
-                                csrf = meta_csrf.get('content')
-                            hidden_csrf = login_soup.find('input', {'name': '_csrf'})
-                            if hidden_csrf and hidden_csrf.get('value'):
-                                csrf = hidden_csrf.get('value')
-                            
-                            login_data = {
-                                "LoginForm[login]": session['username'],
-                                "LoginForm[password]": session['password'],
-                                "LoginForm[rememberMe]": "1"
-                            }
-                            lheaders = {'Referer': grades_url}
-                            if csrf:
-                                login_data['_csrf'] = csrf
-                                lheaders['X-CSRF-Token'] = csrf
-                            
-                            web_scraper.post(login_url, data=login_data, headers=lheaders, timeout=10)
-                            try:
-                                gresp = web_scraper.get(grades_url, params=params, timeout=10, headers=headers)
-                                if gresp and gresp.status_code == 200 and ('Виписка оцінок' in gresp.text or 'Отримані результати' in gresp.text):
-                                    grades_html = gresp.text
-                                    break
-                            except Exception:
-                                pass
-                        except Exception:
-                            pass
-                        
-                        time.sleep(1)
-                    
-                    if grades_html:
-                        sd, ed, subs = parse_grades_from_html(grades_html)
-                        for name, toks in subs.items():
-                            filtered = []
-                            for tok_item in toks:
-                                if isinstance(tok_item, (list, tuple)) and len(tok_item) >= 2:
-                                    tok_text = tok_item[0]
-                                else:
-                                    tok_text = str(tok_item)
-                                filtered.append(tok_text)
-                            if filtered:
-                                subjects_parsed[name] = filtered
-                
-                if not subjects_parsed:
-                    await query.edit_message_text("❌ Не вдалось отримати дані для звіту")
-                    return
-                
-                # Формируем текстовый отчет
-                report_text = f"📑 ЗВІТ ПРО УСПІШНІСТЬ\n\n"
-                report_text += f"Період: {start} — {end}\n"
-                report_text += f"Учень: {session.get('fio', '—')}\n\n"
-                report_text += "=" * 50 + "\n\n"
-                
-                all_marks = []
-                subject_stats = {}
-                
-                for name, tokens in subjects_parsed.items():
-                    numeric_marks = []
-                    for tok in tokens:
-                        val = _extract_numeric_from_mark(tok)
-                        if val is not None:
-                            numeric_marks.append(val)
-                            all_marks.append(val)
-                    
-                    if numeric_marks:
-                        avg = sum(numeric_marks) / len(numeric_marks)
-                        subject_stats[name] = {
-                            'avg': avg,
-                            'count': len(numeric_marks),
-                            'min': min(numeric_marks),
-                            'max': max(numeric_marks),
-                            'marks': numeric_marks
-                        }
-                
-                if all_marks:
-                    overall_avg = sum(all_marks) / len(all_marks)
-                    report_text += f"📊 ЗАГАЛЬНА СТАТИСТИКА\n\n"
-                    report_text += f"Середній бал: {overall_avg:.2f}\n"
-                    report_text += f"Всього оцінок: {len(all_marks)}\n"
-                    report_text += f"Мінімальна: {min(all_marks)}\n"
-                    report_text += f"Максимальна: {max(all_marks)}\n\n"
-                    report_text += "=" * 50 + "\n\n"
-                    
-                    # Сортируем предметы по среднему баллу
-                    sorted_subjects = sorted(subject_stats.items(), key=lambda x: x[1]['avg'], reverse=True)
-                    
-                    report_text += f"📚 СТАТИСТИКА ПО ПРЕДМЕТАМ\n\n"
-                    for name, stats in sorted_subjects:
-                        report_text += f"{name}:\n"
-                        report_text += f"  Середній бал: {stats['avg']:.2f}\n"
-                        report_text += f"  Кількість оцінок: {stats['count']}\n"
-                        report_text += f"  Мінімальна: {stats['min']}, Максимальна: {stats['max']}\n"
-                        report_text += f"  Оцінки: {', '.join(map(str, stats['marks']))}\n\n"
-                
-                # Отправляем как файл
-                from io import BytesIO
-                report_file = BytesIO(report_text.encode('utf-8'))
-                report_file.name = f"report_{datetime.now().strftime('%Y%m%d')}.txt"
-                
-                try:
-                    await query.message.reply_document(
-                        document=report_file,
-                        caption="📑 Звіт про успішність",
-                        filename=report_file.name
-                    )
-                    await query.edit_message_text("✅ PDF-звіт готовий!")
-                except Exception as e:
-                    # Если файл слишком большой, отправляем частями
-                    if len(report_text) > 4000:
-                        parts = [report_text[i:i+4000] for i in range(0, len(report_text), 4000)]
-                        for part in parts:
-                            await query.message.reply_text(part)
-                        await query.edit_message_text("✅ Звіт надіслано!")
-                    else:
-                        await query.edit_message_text(f"❌ Помилка при відправці: {e}")
-                
-                return
-            except Exception as e:
-                print(f"[VIP PDF REPORT] Error: {e}")
-                import traceback
-                print(f"[VIP PDF REPORT] Traceback: {traceback.format_exc()}")
-                await query.edit_message_text(f"❌ Помилка при створенні звіту: {e}")
-                return
+            await query.edit_message_text("🔄 Готую PDF-звіт про успішність... Надішлю файл, щойно він буде готовий.")
+            # Відповідаємо одразу; дані та рендер — у фоні, файл прийде окремим повідомленням
+            context.application.create_task(_pdf_report_job(query.message, session, user_id))
+            return
         
         if action == 'settings':
             # Настройки VIP
@@ -3981,35 +4593,17 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
 
         try:
             if action == 'stats':
-                # Детальная статистика
-                conn = get_db_connection()
-                c = conn.cursor()
-                
-                # Общая статистика
-                c.execute('SELECT COUNT(DISTINCT user_id) FROM sessions')
-                total_users = c.fetchone()[0] or 0
-                
-                c.execute('SELECT COUNT(*) FROM vip_users WHERE expires_at > ?', (datetime.now().isoformat(),))
-                active_vips = c.fetchone()[0] or 0
-                
-                c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'open'")
-                open_tickets = c.fetchone()[0] or 0
+                # Детальная статистика (материализованные счётчики)
+                stats = get_admin_stats()
+                total_users = stats.get('total_users', 0)
+                active_vips = stats.get('active_vips', 0)
+                open_tickets = stats.get('open_tickets', 0)
+                closed_tickets = stats.get('closed_tickets', 0)
+                vip_requests = stats.get('vip_requests', 0)
                 
-                c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'closed'")
-                closed_tickets = c.fetchone()[0] or 0
-                
-                c.execute('SELECT COUNT(*) FROM vip_requests')
-                vip_requests = c.fetchone()[0] or 0
-                
-                # Статистика за последние 7 дней
-                week_ago = (datetime.now() - timedelta(days=7)).isoformat()
-                c.execute('SELECT COUNT(DISTINCT user_id) FROM sessions WHERE created_at > ?', (week_ago,))
-                new_users_week = c.fetchone()[0] or 0
-                
-                c.execute('SELECT COUNT(*) FROM support_tickets WHERE created_at > ?', (week_ago,))
-                new_tickets_week = c.fetchone()[0] or 0
-                
-                conn.close()
+                # Статистика за последние 7 дней (уточняется при периодической сверке)
+                new_users_week = stats.get('new_users_week', 0)
+                new_tickets_week = stats.get('new_tickets_week', 0)
                 
                 stats_text = "📊 *Детальна статистика бота*\n\n"
                 stats_text += "*Користувачі:*\n"
@@ -4021,37 +4615,31 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 stats_text += "*Звернення:*\n"
                 stats_text += f"• Відкритих: {open_tickets}\n"
                 stats_text += f"• Закритих: {closed_tickets}\n"
-                stats_text += f"• Нових за тиждень: {new_tickets_week}\n"
+                stats_text += f"• Нових за тиждень: {new_tickets_week}\n\n"
+                stats_text += "*Кеш сесій:*\n"
+                stats_text += f"• Записів: {len(_SESSION_CACHE)}\n"
+                stats_text += f"• Влучань: {_SESSION_CACHE.hit_rate() * 100:.1f}%\n\n"
+                sources = grade_source_summary()
+                stats_text += "*Джерела оцінок:*\n"
+                stats_text += f"• API: {sources['api_users']} учнів, влучань {sources['api_hit_rate'] * 100:.1f}%\n"
+                stats_text += f"• HTML: {sources['html_users']} учнів, влучань {sources['html_hit_rate'] * 100:.1f}%\n"
                 
                 kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")]])
                 await query.edit_message_text(stats_text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
                 return
             
+            # Пагінація: admin_menu:<list>[:<state>]:<n|p>:<cursor>
+            page_dir, page_cursor = 'n', None
+            if len(parts) >= 4 and parts[-2] in ('n', 'p'):
+                page_dir, page_cursor = parts[-2], parts[-1]
+
             if action == 'vip_requests':
                 # Заявки на VIP
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT id, user_id, contact_text, created_at FROM vip_requests ORDER BY created_at DESC LIMIT 50')
-                rows = c.fetchall()
-                conn.close()
-                
-                if not rows:
+                text, kb = build_vip_requests_page(page_cursor, page_dir)
+                if not text:
                     await query.edit_message_text('📋 Заявок на VIP поки немає')
                     return
-                
-                lines = []
-                kb_buttons = []
-                for r in rows:
-                    req_id, uid, text, created = r
-                    text_preview = (text or '')[:50] if text else 'Без тексту'
-                    lines.append(f"#{req_id} — {uid} — {created}\n{text_preview}")
-                    kb_buttons.append([
-                        InlineKeyboardButton(f"Заявка #{req_id}", callback_data=f"admin:view_vip_request:{req_id}"),
-                        InlineKeyboardButton("✅ 30д", callback_data=f"admin:grant_vip:{uid}:30")
-                    ])
-                
-                kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")])
-                await query.edit_message_text('📋 Заявки на VIP:\n\n' + '\n\n'.join(lines), reply_markup=InlineKeyboardMarkup(kb_buttons))
+                await query.edit_message_text(text, reply_markup=kb)
                 return
             
             if action == 'management':
@@ -4064,58 +4652,12 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 await query.edit_message_text('⚙️ *Управління*\n\nОберіть опцію:', parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
                 return
             
-            if action == 'manage_vips':
-                # Улучшенное управление VIP
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT user_id, expires_at FROM vip_users ORDER BY expires_at DESC LIMIT 50')
-                rows = c.fetchall()
-                conn.close()
-                
-                if not rows:
-                    await query.edit_message_text('👥 VIP-користувачів поки немає')
-                    return
-                
-                lines = []
-                kb_buttons = []
-                for r in rows:
-                    uid, expires = r
-                    expires_text = expires[:10] if expires else 'Не встановлено'
-                    lines.append(f"{uid} — до {expires_text}")
-                    kb_buttons.append([
-                        InlineKeyboardButton(f"👤 {uid}", callback_data=f"admin:view_vip_user:{uid}"),
-                        InlineKeyboardButton("❌", callback_data=f"admin:revoke_vip:{uid}")
-                    ])
-                
-                kb_buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")])
-                await query.edit_message_text('👥 *Управління VIP-користувачами*\n\n' + '\n'.join(lines), parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(kb_buttons))
-                return
-            
-            if action == 'list_vips':
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT user_id, expires_at FROM vip_users ORDER BY expires_at DESC')
-                rows = c.fetchall()
-                conn.close()
-                if not rows:
+            if action in ('manage_vips', 'list_vips'):
+                text, kb = build_vips_page(action == 'manage_vips', page_cursor, page_dir)
+                if not text:
                     await query.edit_message_text('👥 VIP-користувачів поки немає')
                     return
-                lines = []
-                for r in rows:
-                    uid, expires = r
-                    expires_text = expires[:10] if expires else 'Не встановлено'
-                    try:
-                        exp_dt = datetime.fromisoformat(expires)
-                        if exp_dt > datetime.now():
-                            status = "✅ Активний"
-                        else:
-                            status = "❌ Закінчився"
-                    except:
-                        status = "❓"
-                    lines.append(f"{uid} — {expires_text} {status}")
-                
-                kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_menu:back")]])
-                await query.edit_message_text('👥 *VIP-користувачі:*\n\n' + '\n'.join(lines), parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+                await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
                 return
 
             if action == 'run_reminders':
@@ -4133,56 +4675,25 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 return
 
             if action == 'view_actions':
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT id, admin_id, action, target_user, ticket_id, details, created_at FROM admin_actions ORDER BY created_at DESC LIMIT 50')
-                rows = c.fetchall()
-                conn.close()
-                if not rows:
+                text, kb = build_admin_actions_page(page_cursor, page_dir)
+                if not text:
                     await query.edit_message_text('ℹ️ Записів дій адміністраторів поки немає')
                     return
-                lines = []
-                for r in rows:
-                    aid, admin_id, action_name, target_user, ticket_id, details, created = r
-                    parts = [f"#{aid}", f"admin:{admin_id}", action_name]
-                    if target_user:
-                        parts.append(f"user:{target_user}")
-                    if ticket_id:
-                        parts.append(f"ticket:{ticket_id}")
-                    if details:
-                        parts.append(details)
-                    parts.append(str(created))
-                    lines.append(" — ".join(parts))
-                await query.edit_message_text('🗂️ Останні дії адміністраторів:\n\n' + '\n'.join(lines))
+                await query.edit_message_text(text, reply_markup=kb)
                 return
 
             if action == 'list_tickets':
                 # parameter form: admin_menu:list_tickets[:state]
                 if len(parts) >= 3:
                     state = parts[2]
-                    conn = get_db_connection()
-                    c = conn.cursor()
-                    if state == 'open':
-                        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets WHERE COALESCE(status,'open') = 'open' ORDER BY created_at DESC LIMIT 200")
-                    elif state == 'closed':
-                        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets WHERE COALESCE(status,'open') = 'closed' ORDER BY created_at DESC LIMIT 200")
-                    elif state == 'all':
-                        c.execute("SELECT id, user_id, substr(message,1,80) as snippet, created_at FROM support_tickets ORDER BY created_at DESC LIMIT 200")
-                    else:
+                    if state not in ('open', 'closed', 'all'):
                         await query.edit_message_text('❌ Невідома опція')
                         return
-                    rows = c.fetchall()
-                    conn.close()
-                    if not rows:
+                    text, kb = build_tickets_page(state, page_cursor, page_dir)
+                    if not text:
                         await query.edit_message_text('📭 Звернень поки немає')
                         return
-                    lines = []
-                    kb_buttons = []
-                    for r in rows:
-                        tid, uid, snip, created = r
-                        lines.append(f"#{tid} — {uid} — {created} — {snip}")
-                        kb_buttons.append([InlineKeyboardButton(f"Тикет #{tid}", callback_data=f"admin:view_ticket:{tid}")])
-                    await query.edit_message_text('📭 Останні звернення (' + state + '):\n\n' + '\n'.join(lines), reply_markup=InlineKeyboardMarkup(kb_buttons))
+                    await query.edit_message_text(text, reply_markup=kb)
                     return
                 else:
                     kb = InlineKeyboardMarkup([
@@ -4214,17 +4725,11 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             
             if action == 'back':
                 # Возвращаемся в главное меню с актуальной статистикой
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT COUNT(DISTINCT user_id) FROM sessions')
-                total_users = c.fetchone()[0] or 0
-                c.execute('SELECT COUNT(*) FROM vip_users WHERE expires_at > ?', (datetime.now().isoformat(),))
-                active_vips = c.fetchone()[0] or 0
-                c.execute("SELECT COUNT(*) FROM support_tickets WHERE COALESCE(status,'open') = 'open'")
-                open_tickets = c.fetchone()[0] or 0
-                c.execute('SELECT COUNT(*) FROM vip_requests')
-                vip_requests = c.fetchone()[0] or 0
-                conn.close()
+                stats = get_admin_stats()
+                total_users = stats.get('total_users', 0)
+                active_vips = stats.get('active_vips', 0)
+                open_tickets = stats.get('open_tickets', 0)
+                vip_requests = stats.get('vip_requests', 0)
                 
                 stats_text = f"🛠️ *Адмінське меню*\n\n"
                 stats_text += f"📊 *Статистика:*\n"
@@ -4248,7 +4753,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 return
 
         except Exception as e:
-            print(f"[ADMIN MENU CALLBACK] Error: {e}")
+            admin_log.warning("Error: %s", e)
             await query.edit_message_text('❌ Помилка при виконанні дії')
         return
 
@@ -4356,30 +4861,17 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             
             if action == 'view_vip_user' and len(parts) >= 3:
                 target_uid = int(parts[2])
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('SELECT expires_at FROM vip_users WHERE user_id = ?', (target_uid,))
-                row = c.fetchone()
                 
                 # Проверяем настройки VIP
-                c.execute('SELECT key, value FROM vip_settings WHERE user_id = ?', (target_uid,))
-                settings_rows = c.fetchall()
-                settings = {r[0]: r[1] for r in settings_rows}
-                conn.close()
+                settings = get_all_vip_settings(target_uid)
                 
-                expires_text = "Не встановлено"
-                if row and row[0]:
-                    try:
-                        expires = datetime.fromisoformat(row[0])
-                        expires_text = expires.strftime('%d.%m.%Y %H:%M')
-                        if expires > datetime.now():
-                            status = "✅ Активний"
-                        else:
-                            status = "❌ Закінчився"
-                    except:
-                        expires_text = str(row[0])
-                        status = "❓"
+                # Реєстр містить лише активні підписки; закінчені з нього вже видалені
+                expires = get_vip_expires(target_uid)
+                if expires is not None:
+                    expires_text = expires.strftime('%d.%m.%Y %H:%M')
+                    status = "✅ Активний"
                 else:
+                    expires_text = "Не встановлено"
                     status = "❌ Не VIP"
                 
                 profile_url = f"tg://user?id={target_uid}"
@@ -4411,6 +4903,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                     target_uid = row[0]
                     # Удаляем заявку
                     c.execute('DELETE FROM vip_requests WHERE id = ?', (req_id,))
+                    _bump_stat(c, 'vip_requests', -1)
                     conn.commit()
                     log_admin_action(user_id, 'reject_vip_request', target_user=target_uid, details=f'request_id={req_id}')
                     try:
@@ -4437,7 +4930,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                         target_user = resolved.get('user_id')
                         await context.bot.send_message(target_user, f"✅ Ваше звернення #{ticket_id} було позначено як вирішене адміністратором.")
                 except Exception as e:
-                    print(f"[ADMIN CALLBACK] Could not notify ticket owner {resolved}: {e}")
+                    admin_log.warning("Could not notify ticket owner %s: %s", resolved, e)
                 return
 
             if action == 'grant_vip' and len(parts) >= 4:
@@ -4454,7 +4947,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
 
             await query.edit_message_text('❌ Невідома admin дія')
         except Exception as e:
-            print(f"[ADMIN CALLBACK] Error: {e}")
+            admin_log.warning("Error: %s", e)
             await query.edit_message_text('❌ Помилка при виконанні дії')
         return
 
@@ -4480,41 +4973,41 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
 def run_bot(app):
     """Запускає бота в окремому потоці"""
     try:
-        print("[STARTUP] Starting polling...")
+        startup_log.info("Starting polling...")
         app.run_polling()
     except Exception as exc:
-        import traceback
-        tb = ''.join(traceback.format_exception(None, exc, exc.__traceback__))
-        print(f"[STARTUP ERROR] app.run_polling failed: {exc}\n{tb}")
+        startup_log.exception("app.run_polling failed: %s", exc)
         raise
 
 def main():
     """Головна функція запуску бота"""
+    setup_logging()
+    # Ключ шифрування — до будь-якої роботи з БД, щоб помилка доступу до файлу ключа зупинила запуск
+    get_cipher()
     # Ініціалізація БД
     init_db()
+    load_vip_registry()
+    reconcile_admin_stats()
     
     # Токен бота - задається через змінну середовища TELEGRAM_BOT_TOKEN або вбудований в код
-    print("[STARTUP] main() reached: checking BOT_TOKEN...")
+    startup_log.info("main() reached: checking BOT_TOKEN...")
     BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "7693623960:AAHjwDrkt6OhBImU-BmaJK2nZMjvk7a0U6Y")
     # do not print token value raw; show masked info
     try:
-        print(f"[STARTUP] BOT_TOKEN present: {bool(BOT_TOKEN)} length={len(BOT_TOKEN) if BOT_TOKEN else 0}")
+        startup_log.info("BOT_TOKEN present: %s length=%s", bool(BOT_TOKEN), len(BOT_TOKEN) if BOT_TOKEN else 0)
     except Exception:
         pass
 
     if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        print("❌ ПОМИЛКА: Не вказано токен бота!")
-        print("Вставте токен у код або створіть змінну середовища TELEGRAM_BOT_TOKEN")
+        startup_log.error("❌ ПОМИЛКА: Не вказано токен бота! Вставте токен у код або створіть змінну середовища TELEGRAM_BOT_TOKEN")
         return
     
     # Створення застосунку
     try:
         app = Application.builder().token(BOT_TOKEN).build()
-        print("[STARTUP] Application built", flush=True)
+        startup_log.info("Application built")
     except Exception as exc:
-        import traceback
-        tb = ''.join(traceback.format_exception(None, exc, exc.__traceback__))
-        print(f"[STARTUP ERROR] Failed to build Application: {exc}\n{tb}", flush=True)
+        startup_log.exception("Failed to build Application: %s", exc)
         return
 
     # Инициализируем async locks, чтобы предотвратить параллельное выполнение фоновых задач
@@ -4526,7 +5019,7 @@ def main():
     
     # Команди
     app.add_handler(CommandHandler("start", start))
-    print("[STARTUP] Registered initial handlers")
+    startup_log.info("Registered initial handlers")
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("diary", diary_cmd))
     app.add_handler(CommandHandler("homework", homework_cmd))
@@ -4552,6 +5045,7 @@ def main():
     # Адмінські команди
     app.add_handler(CommandHandler("list_tickets", list_tickets_cmd))
     app.add_handler(CommandHandler("ticket_close", ticket_close_cmd))
+    app.add_handler(CommandHandler("rebuild_stats", rebuild_stats_cmd))
 
     # Кнопки з клавіатури
     app.add_handler(MessageHandler(
@@ -4566,75 +5060,68 @@ def main():
     try:
         app.job_queue.run_repeating(check_reminders, interval=REMINDER_INTERVAL, first=10)
         app.job_queue.run_repeating(check_grades, interval=GRADE_POLL_INTERVAL, first=20)
+        app.job_queue.run_repeating(reconcile_stats_job, interval=STATS_RECONCILE_INTERVAL, first=STATS_RECONCILE_INTERVAL)
+        if NUMPY_AVAILABLE:
+            prewarm_at = datetime.strptime(TREND_PREWARM_TIME, '%H:%M').time().replace(tzinfo=KYIV_TZ)
+            app.job_queue.run_daily(prewarm_trends_job, time=prewarm_at)
+        app.job_queue.run_once(resume_broadcasts_job, when=5)
         if PING_URL:
             app.job_queue.run_repeating(ping_self, interval=PING_INTERVAL, first=15)
-        print("[VIP JOB] Background jobs registered: reminders every", REMINDER_INTERVAL, "s; grades every", GRADE_POLL_INTERVAL, "s")
+        vip_job_log.info("Background jobs registered: reminders every %s s; grades every %s s", REMINDER_INTERVAL, GRADE_POLL_INTERVAL)
     except Exception as e:
-        print("[VIP JOB] Could not register jobs:", e)
-    
-    print("=" * 50)
-    print("🚀 NZ.UA Telegram Bot запущено!")
-    print("=" * 50)
-    print("📱 Бот готовий до роботи")
-    print("💾 База даних:", DB_FILE)
+        vip_job_log.warning("Could not register jobs: %s", e)
+
+    startup_log.info("🚀 NZ.UA Telegram Bot запущено!")
+    startup_log.info("📱 Бот готовий до роботи")
+    startup_log.info("💾 База даних: %s", DB_FILE)
     if CRYPTO_AVAILABLE:
-        print("🔐 Шифрування: УВІМКНЕНО")
+        startup_log.info("🔐 Шифрування: УВІМКНЕНО")
     else:
-        print("⚠️  Шифрування: ВИМКНЕНО (встановіть: pip install cryptography)")
-    print("=" * 50)
+        startup_log.warning("⚠️  Шифрування: ВИМКНЕНО (встановіть: pip install cryptography)")
 
     # Start bot: prefer webhook on Railway (set WEBHOOK_URL env). Falls back to polling if not set.
     WEBHOOK_URL_ENV = os.getenv('WEBHOOK_URL')
     PORT = int(os.getenv('PORT', '8080'))
     try:
         if WEBHOOK_URL_ENV:
-            print(f"[STARTUP] Starting webhook mode on port {PORT}, webhook={WEBHOOK_URL_ENV}")
+            startup_log.info("Starting webhook mode on port %s, webhook=%s", PORT, WEBHOOK_URL_ENV)
             url_path = f"bot{BOT_TOKEN}"
             # Let run_webhook handle webhook setup; do NOT call app.bot.set_webhook() here (it's async and run_webhook will set the webhook).
             # run webhook server (blocks)
             app.run_webhook(listen="0.0.0.0", port=PORT, url_path=url_path, webhook_url=WEBHOOK_URL_ENV.rstrip('/') + '/' + url_path, drop_pending_updates=True)
         else:
-            print("[STARTUP] Starting polling...")
+            startup_log.info("Starting polling...")
             app.run_polling(drop_pending_updates=True)
     except RuntimeError as exc:
         # Common case: missing webhook extras (aiohttp) -> fallback to polling to avoid crash loop
         msg = str(exc)
-        print(f"[STARTUP ERROR] RuntimeError during startup: {msg}")
+        startup_log.error("RuntimeError during startup: %s", msg)
         if 'webhooks' in msg or 'start_webhook' in msg or 'aiohttp' in msg:
-            print("[STARTUP] Webhook support missing in the environment. Falling back to polling.\n" \
-                  "Please add `python-telegram-bot[webhooks]` to your requirements and redeploy to enable webhook mode.")
+            startup_log.warning("Webhook support missing in the environment. Falling back to polling.\nPlease add `python-telegram-bot[webhooks]` to your requirements and redeploy to enable webhook mode.")
             try:
-                print("[STARTUP] Starting polling (fallback)...")
+                startup_log.info("Starting polling (fallback)...")
                 app.run_polling(drop_pending_updates=True)
             except Exception as exc2:
-                import traceback
-                tb2 = ''.join(traceback.format_exception(None, exc2, exc2.__traceback__))
-                print(f"[STARTUP ERROR] fallback polling failed: {exc2}\n{tb2}")
+                startup_log.exception("fallback polling failed: %s", exc2)
                 raise
         else:
-            import traceback
-            tb = ''.join(traceback.format_exception(None, exc, exc.__traceback__))
-            print(f"[STARTUP ERROR] failed to start bot: {exc}\n{tb}")
+            startup_log.exception("failed to start bot: %s", exc)
             raise
     except Exception as exc:
-        import traceback
-        tb = ''.join(traceback.format_exception(None, exc, exc.__traceback__))
-        print(f"[STARTUP ERROR] failed to start bot: {exc}\n{tb}")
+        startup_log.exception("failed to start bot: %s", exc)
         raise
 
 # Global error handler to catch unhandled exceptions from handlers
 async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     try:
-        import traceback
-        tb = ''.join(traceback.format_exception(None, context.error, context.error.__traceback__))
-        print(f"[GLOBAL ERROR] update={update} error={context.error}\n{tb}")
+        errors_log.error("update=%s error=%s", update, context.error, exc_info=context.error)
         # notify owner
         try:
             await context.bot.send_message(OWNER_ID, f"[Error] {context.error}\nSee logs for details.")
         except Exception:
             pass
     except Exception as e:
-        print(f"[GLOBAL ERROR] failed to log error: {e}")
+        errors_log.error("failed to log error: %s", e)
 
 # NOTE: registrations below moved into main() to avoid indentation issues
 
@@ -4642,7 +5129,7 @@ async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYP
 # small debug on text handler
 async def _handle_message_debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        print(f"[MSG] from={update.effective_user and update.effective_user.id} text={getattr(update.message, 'text', None)}")
+        msg_log.info("from=%s text=%s", update.effective_user and update.effective_user.id, getattr(update.message, 'text', None), extra=SAMPLED)
     except Exception:
         pass
     await handle_message(update, context)
@@ -4658,9 +5145,9 @@ async def ping_self(context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         r = requests.get(PING_URL, timeout=5)
-        print(f"[PING] {PING_URL} status={r.status_code}")
+        ping_log.info("%s status=%s", PING_URL, r.status_code)
     except Exception as e:
-        print(f"[PING] failed: {e}")
+        ping_log.warning("failed: %s", e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
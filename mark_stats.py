@@ -0,0 +1,111 @@
+"""Агрегати оцінок учня по предмету за навчальний рік.
+
+SubjectStats оновлюється інкрементально при записі оцінок у сховище; remove() повертає False,
+якщо агрегат не можна скоригувати без перерахунку (видалено мінімум, максимум або одну з останніх оцінок).
+"""
+import bisect
+import json
+import os
+from datetime import date, datetime
+
+from marks import Mark
+
+# Скільки останніх оцінок предмета зберігати
+LAST_MARKS = int(os.getenv('MARK_STATS_LAST_N', '5'))
+
+
+def school_year_of(mark_date: str = None, fetched_at: int = None) -> str:
+    """Початок навчального року (YYYY-08-01) для дати оцінки; оцінка без дати — за датою завантаження"""
+    if mark_date:
+        year, month = int(mark_date[:4]), int(mark_date[5:7])
+    else:
+        d = datetime.fromtimestamp(fetched_at).date() if fetched_at else date.today()
+        year, month = d.year, d.month
+    return f"{year if month >= 8 else year - 1:04d}-08-01"
+
+
+class SubjectStats:
+    """Кількість, сума, мін/макс числових оцінок, відсутності, нечислові оцінки та останні LAST_MARKS"""
+    __slots__ = ('marks', 'count', 'total', 'min_value', 'max_value', 'absences', 'other', 'last')
+
+    def __init__(self, marks=0, count=0, total=0.0, min_value=None, max_value=None, absences=0, other=None, last=None):
+        self.marks = marks
+        self.count = count
+        self.total = total
+        self.min_value = min_value
+        self.max_value = max_value
+        self.absences = absences
+        self.other = other or {}    # {raw: n} нечислових оцінок (разом з відсутностями)
+        self.last = last or []      # [[date | '', raw], ...] у порядку дат
+
+    @classmethod
+    def fold(cls, marks) -> 'SubjectStats':
+        stats = cls()
+        for mark in marks:
+            stats.add(mark)
+        return stats
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else None
+
+    def add(self, mark: Mark):
+        self.marks += 1
+        if mark.value is not None:
+            self.count += 1
+            self.total += mark.value
+            self.min_value = mark.value if self.min_value is None else min(self.min_value, mark.value)
+            self.max_value = mark.value if self.max_value is None else max(self.max_value, mark.value)
+        else:
+            self.other[mark.raw] = self.other.get(mark.raw, 0) + 1
+        if mark.absent:
+            self.absences += 1
+        # Оцінки без дати — на початку, як і в ORDER BY mark_date
+        item = [mark.date or '', mark.raw]
+        pos = bisect.bisect_right([d for d, _ in self.last], item[0])
+        if pos or len(self.last) < LAST_MARKS:
+            self.last.insert(pos, item)
+            del self.last[:-LAST_MARKS]
+
+    def remove(self, mark: Mark) -> bool:
+        if [mark.date or '', mark.raw] in self.last:
+            return False
+        if mark.value is not None:
+            if mark.value in (self.min_value, self.max_value):
+                return False
+            self.count -= 1
+            self.total -= mark.value
+        else:
+            left = self.other.get(mark.raw, 0) - 1
+            if left > 0:
+                self.other[mark.raw] = left
+            else:
+                self.other.pop(mark.raw, None)
+        if mark.absent:
+            self.absences -= 1
+        self.marks -= 1
+        return True
+
+    def to_row(self) -> tuple:
+        """Значення для колонок mark_stats (marks, count, total, min_value, max_value, absences, other, last_marks)"""
+        return (self.marks, self.count, self.total, self.min_value, self.max_value, self.absences,
+                json.dumps(self.other, ensure_ascii=False, sort_keys=True), json.dumps(self.last, ensure_ascii=False))
+
+    @classmethod
+    def from_row(cls, marks, count, total, min_value, max_value, absences, other, last_marks) -> 'SubjectStats':
+        return cls(marks, count, total, min_value, max_value, absences,
+                   json.loads(other) if other else {}, json.loads(last_marks) if last_marks else [])
+
+    def __eq__(self, other):
+        if not isinstance(other, SubjectStats):
+            return NotImplemented
+        # сума порівнюється з допуском: після віднімань можлива похибка округлення
+        return (abs(self.total - other.total) < 1e-6 and
+                (self.marks, self.count, self.min_value, self.max_value, self.absences, self.other) ==
+                (other.marks, other.count, other.min_value, other.max_value, other.absences, other.other) and
+                sorted(self.last) == sorted(other.last))
+
+    def __repr__(self):
+        return (f"SubjectStats(marks={self.marks}, count={self.count}, total={self.total!r}, "
+                f"min={self.min_value}, max={self.max_value}, absences={self.absences}, "
+                f"other={self.other}, last={self.last})")
@@ -0,0 +1,154 @@
+import os
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# Однакові рядки оцінок ("10", "Н", "7 (12.01.2026)") повторюються у всіх користувачів
+MARK_CACHE_SIZE = int(os.getenv('MARK_CACHE_SIZE', '8192'))
+
+MONTHS = {
+    'січня': 1, 'лютого': 2, 'березня': 3, 'квітня': 4, 'травня': 5, 'червня': 6,
+    'липня': 7, 'серпня': 8, 'вересня': 9, 'жовтня': 10, 'листопада': 11, 'грудня': 12
+}
+
+# Ключові слова типів оцінок -> канонічна назва
+KINDS = (
+    ('тематичн', 'тематична'),
+    ('семестров', 'семестрова'),
+    ('річн', 'річна'),
+    ('контрольн', 'контрольна'),
+    ('к/р', 'контрольна'),
+    ('самостійн', 'самостійна'),
+    ('лабораторн', 'лабораторна'),
+    ('практичн', 'практична'),
+    ('пр/р', 'практична'),
+    ('зошит', 'зошит'),
+    ('зош', 'зошит'),
+    ('поточн', 'поточна'),
+)
+ABSENCE_MARKS = frozenset({'н', 'h', 'нб', 'н/б'})
+
+_ISO_DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+_DOTTED_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+_MONTH_DATE_RE = re.compile(
+    r"(\d{1,2})\s+(" + '|'.join(re.escape(m) for m in MONTHS) + r")\s*(\d{4})?",
+    flags=re.IGNORECASE,
+)
+_FUTURE_GRACE = timedelta(days=7)
+_NUMBER_RE = re.compile(r"(\d+(?:[\.,]\d+)?)")
+_VALUE_KEYS = ('mark', 'value', 'grade', 'score', 'mark_value')
+_KIND_KEYS = ('type', 'mark_type', 'lesson_type')
+
+
+class Mark(NamedTuple):
+    """Розібрана оцінка. Перші два поля сумісні зі старими кортежами (token, date_iso)"""
+    raw: str
+    date: Optional[str]
+    value: Optional[float]
+    absent: bool
+    kind: Optional[str]
+
+
+def parse_mark_date(s, today: date = None) -> Optional[str]:
+    """Шукає дату (ISO, dd.mm.yyyy або '19 грудня [2025]') у рядку, повертає 'YYYY-MM-DD' або None
+
+    Дата без року відноситься до найближчого минулого (оцінки не ставлять наперед).
+    """
+    if not s:
+        return None
+    if not isinstance(s, str):
+        s = str(s)
+    m = _ISO_DATE_RE.search(s)
+    if m:
+        return m.group(1)
+    m = _DOTTED_DATE_RE.search(s)
+    if m:
+        d, mo, y = m.groups()
+        return f"{int(y):04d}-{int(mo):02d}-{int(d):02d}"
+    m = _MONTH_DATE_RE.search(s)
+    if m:
+        d, mo = int(m.group(1)), MONTHS[m.group(2).lower()]
+        if m.group(3):
+            y = int(m.group(3))
+        else:
+            today = today or date.today()
+            y = today.year
+            try:
+                if date(y, mo, d) > today + _FUTURE_GRACE:
+                    y -= 1
+            except ValueError:
+                pass
+        return f"{y:04d}-{mo:02d}-{d:02d}"
+    return None
+
+
+def _kind_of(text: str) -> Optional[str]:
+    low = text.lower()
+    for needle, kind in KINDS:
+        if needle in low:
+            return kind
+    return None
+
+
+@lru_cache(maxsize=MARK_CACHE_SIZE)
+def _parse_token(token: str, today: date) -> Mark:
+    # Значення береться лише з частини до дужок: у "Н (12.01.2026)" число — це дата, а не оцінка
+    head = token.split('(', 1)[0].strip()
+    absent = head.lower() in ABSENCE_MARKS
+    value = None
+    if not absent:
+        m = _NUMBER_RE.search(head)
+        if m:
+            value = float(m.group(1).replace(',', '.'))
+    return Mark(token, parse_mark_date(token, today), value, absent, _kind_of(token))
+
+
+def parse_mark(token: str) -> Mark:
+    """Розбирає текстовий токен оцінки (з кешем)"""
+    return _parse_token(token.strip(), date.today())
+
+
+def to_mark(mark) -> Mark:
+    """Приводить оцінку будь-якого вигляду (рядок, число, dict з API, Mark) до Mark"""
+    if isinstance(mark, Mark):
+        return mark
+    if isinstance(mark, bool) or mark is None:
+        return parse_mark(str(mark))
+    if isinstance(mark, (int, float)):
+        return Mark(str(mark), None, float(mark), False, None)
+    if isinstance(mark, dict):
+        value = next((mark[k] for k in _VALUE_KEYS if mark.get(k) is not None), None)
+        kind_raw = next((str(mark[k]) for k in _KIND_KEYS if mark.get(k)), '')
+        date_raw = mark.get('date') or mark.get('created_at') or mark.get('datetime') or ''
+        parsed = parse_mark(str(value) if value is not None else '')
+        display = mark_info(mark)[1]
+        return Mark(display, parse_mark_date(date_raw) or parsed.date, parsed.value, parsed.absent,
+                    _kind_of(kind_raw) or parsed.kind)
+    return parse_mark(str(mark))
+
+
+def mark_info(mark):
+    """Повертає кортеж (signature, display_text) для оцінки"""
+    if isinstance(mark, dict):
+        value = next((mark[k] for k in _VALUE_KEYS if mark.get(k) is not None), None)
+        mid = mark.get('id') or mark.get('mark_id') or ''
+        date = mark.get('date') or mark.get('created_at') or mark.get('datetime') or ''
+        val_str = str(value).strip() if value is not None else str(mark)
+    else:
+        val_str = mark.raw if isinstance(mark, Mark) else str(mark)
+        mid = ''
+        date = ''
+    signature = f"{val_str}|{mid}|{date}"
+    display = val_str if not date else f"{val_str} ({date})"
+    return signature, display
+
+
+def mark_value(mark) -> Optional[float]:
+    """Числове значення оцінки або None (відсутність, текстова оцінка)"""
+    return to_mark(mark).value
+
+
+def mark_cache_info():
+    """Статистика кешу токенів (functools.CacheInfo)"""
+    return _parse_token.cache_info()
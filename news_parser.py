@@ -0,0 +1,173 @@
+import hashlib
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin
+
+BASE_URL = "https://nz.ua"
+
+# Без вкладених квантифікаторів: кожен рядок проходиться один раз
+_GRADE_RE = re.compile(
+    r'(Ви отримали оцінку|Оцінка змінена на)\s+([\wА-ЯІЇЄҐа-яіїєґ/]+)\s+з предмету:\s+([^,\n]+),\s+([^\n]+)'
+)
+_WHEN_RE = re.compile(r'(\d{1,2}\s+[а-яіїєґʼ]+\s+о\s+\d{1,2}:\d{2})\s*$')
+_ITEM_CLASS_RE = re.compile(r'class="[^"]*\bnews-page__item\b')
+_VOID_TAGS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                        'link', 'meta', 'param', 'source', 'track', 'wbr'})
+_FIELDS = {'news-page__name': 'name', 'news-page__date': 'date', 'news-page__desc': 'desc'}
+
+
+class NewsItem(NamedTuple):
+    key: str
+    teacher: str
+    date: str
+    text: str
+    link: Optional[str] = None
+    grade: Optional[str] = None
+    subject: Optional[str] = None
+    grade_type: Optional[str] = None
+    is_changed: bool = False
+
+
+def news_key(teacher: str, date: str, text: str) -> str:
+    """Стабільний ідентифікатор новини (для маркера 'останню бачив')"""
+    return hashlib.sha1(f"{teacher}|{date}|{text}".encode('utf-8')).hexdigest()[:16]
+
+
+def make_news_item(teacher: str, date: str, text: str, link: str = None) -> NewsItem:
+    m = _GRADE_RE.search(text)
+    if not m:
+        return NewsItem(news_key(teacher, date, text), teacher, date, text, link)
+    return NewsItem(
+        news_key(teacher, date, text), teacher, date, text, link,
+        grade=m.group(2), subject=m.group(3).strip(), grade_type=m.group(4).strip(),
+        is_changed=m.group(1).startswith('Оцінка змінена'),
+    )
+
+
+class _Stop(Exception):
+    pass
+
+
+class NewsListParser(HTMLParser):
+    """Один прохід по div#school-news-list -> NewsItem.
+
+    Зупиняється на елементі з ключем stop_at (уже бачений) або після limit новин.
+    """
+
+    def __init__(self, stop_at: str = None, limit: int = None):
+        super().__init__(convert_charrefs=True)
+        self.stop_at = stop_at
+        self.limit = limit
+        self.items = []
+        self.found_list = False
+        self.reached_marker = False
+        self._stack = []
+        self._list_level = None
+        self._item_level = None
+        self._field = None
+        self._field_level = None
+        self._parts = None
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        self._stack.append(tag)
+        level = len(self._stack)
+        a = dict(attrs)
+        if self._list_level is None:
+            if tag == 'div' and a.get('id') == 'school-news-list':
+                self._list_level = level
+                self.found_list = True
+            return
+        classes = (a.get('class') or '').split()
+        if self._item_level is None:
+            if 'news-page__item' in classes:
+                self._item_level = level
+                self._parts = {'name': [], 'date': [], 'desc': []}
+                self._link = None
+            return
+        if self._field is None:
+            for cls in classes:
+                if cls in _FIELDS:
+                    self._field, self._field_level = _FIELDS[cls], level
+                    break
+        if tag == 'a' and self._field == 'desc' and self._link is None and a.get('href'):
+            self._link = urljoin(BASE_URL, a['href'])
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or tag not in self._stack:
+            return
+        while self._stack:
+            if self._stack.pop() == tag:
+                break
+        level = len(self._stack)
+        if self._field is not None and level < self._field_level:
+            self._field = None
+        if self._item_level is not None and level < self._item_level:
+            self._finish_item()
+        if self._list_level is not None and level < self._list_level:
+            raise _Stop
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._parts[self._field].append(data)
+
+    def _finish_item(self):
+        parts, self._parts, self._item_level = self._parts, None, None
+        teacher = ''.join(s.strip() for s in parts['name']) or '—'
+        date = ''.join(s.strip() for s in parts['date'])
+        text = ' '.join(s for s in (p.strip() for p in parts['desc']) if s)
+        item = make_news_item(teacher, date, text, self._link)
+        if self.stop_at and item.key == self.stop_at:
+            self.reached_marker = True
+            raise _Stop
+        self.items.append(item)
+        if self.limit and len(self.items) >= self.limit:
+            raise _Stop
+
+
+def parse_news_page(html: str, stop_at: str = None, limit: int = None):
+    """Розбирає блок school-news-list.
+
+    Повертає (items, found_list, reached_marker); items — лише новини до маркера stop_at.
+    """
+    parser = NewsListParser(stop_at=stop_at, limit=limit)
+    try:
+        parser.feed(html)
+        parser.close()
+    except _Stop:
+        pass
+    return parser.items, parser.found_list, parser.reached_marker
+
+
+def count_news_items(html: str) -> int:
+    """Кількість новин на сторінці без розбору"""
+    return len(_ITEM_CLASS_RE.findall(html))
+
+
+def parse_news_from_html(html: str) -> list:
+    """Парсить текстовий варіант блоку 'Мої новини' (без school-news-list) у NewsItem"""
+    start_idx = html.find('Мої новини')
+    if start_idx == -1:
+        return []
+    end_idx = html.find('Показано новин', start_idx)
+    section = html[start_idx:] if end_idx == -1 else html[start_idx:end_idx]
+
+    # Формат рядка: "<Вчитель ПІБ> <Учень ПІБ> 19 грудня о 10:06 Ви отримали оцінку 7 з предмету: X, Тип"
+    items = []
+    prev_end = 0
+    for m in _GRADE_RE.finditer(section):
+        head = section[prev_end:m.start()]
+        prev_end = m.end()
+        head = head[head.rfind('\n') + 1:]
+        when = _WHEN_RE.search(head)
+        if not when:
+            continue
+        words = head[:when.start()].split()
+        if len(words) < 6:
+            continue
+        teacher = ' '.join(words[-6:-3])
+        items.append(make_news_item(teacher, when.group(1), m.group(0)))
+    return items
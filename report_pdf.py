@@ -0,0 +1,229 @@
+"""PDF-звіт про успішність.
+
+Рендер виконується у процесі-воркері (ProcessPoolExecutor у main.py), тому на вхід приходять
+лише прості типи: payload = {'fio', 'start', 'end', 'subjects': {name: [[raw, date_iso, value], ...]}}.
+Без reportlab або шрифту з кирилицею повертається текстовий звіт.
+"""
+import html
+import io
+import os
+from collections import defaultdict
+
+try:
+    from reportlab.graphics.charts.lineplots import LinePlot
+    from reportlab.graphics.shapes import Drawing, PolyLine
+    from reportlab.lib import colors
+    from reportlab.lib.fonts import addMapping
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    REPORTLAB_AVAILABLE = True
+except Exception:
+    REPORTLAB_AVAILABLE = False
+
+FONT_NAME = 'ReportFont'
+BOLD_FONT_NAME = 'ReportFont-Bold'
+# Вбудовані шрифти PDF не мають кирилиці — потрібен TTF
+FONT_CANDIDATES = (
+    os.getenv('REPORT_FONT_PATH'),
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+)
+MONTH_LABELS = ['січ', 'лют', 'бер', 'кві', 'тра', 'чер', 'лип', 'сер', 'вер', 'жов', 'лис', 'гру']
+ACCENT = '#2b6cb0'
+
+
+def report_payload(subjects_parsed: dict, fio: str, start: str, end: str) -> dict:
+    """Mark-и -> прості списки (їх можна передати у процес і хешувати)"""
+    subjects = {}
+    for name, marks in subjects_parsed.items():
+        rows = [[m.raw, m.date, m.value] for m in marks]
+        if rows:
+            subjects[name] = rows
+    return {'fio': fio or '—', 'start': start, 'end': end, 'subjects': subjects}
+
+
+def subject_stats(payload: dict) -> list:
+    """[(name, avg, count, min, max, values_in_date_order)], від кращого середнього до гіршого"""
+    stats = []
+    for name, rows in payload['subjects'].items():
+        dated = sorted((r for r in rows if r[2] is not None), key=lambda r: r[1] or '')
+        values = [r[2] for r in dated]
+        if values:
+            stats.append((name, sum(values) / len(values), len(values), min(values), max(values), values))
+    stats.sort(key=lambda s: s[1], reverse=True)
+    return stats
+
+
+def monthly_averages(payload: dict) -> list:
+    """[('YYYY-MM', avg)] за всіма предметами (оцінки без дати не враховуються)"""
+    months = defaultdict(list)
+    for rows in payload['subjects'].values():
+        for raw, date_iso, value in rows:
+            if value is not None and date_iso:
+                months[date_iso[:7]].append(value)
+    return [(m, sum(v) / len(v)) for m, v in sorted(months.items())]
+
+
+def _fmt(value) -> str:
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _esc(text) -> str:
+    return html.escape(str(text), quote=False)
+
+
+def render_report_text(payload: dict) -> bytes:
+    """Текстовий звіт (без reportlab)"""
+    lines = ["📑 ЗВІТ ПРО УСПІШНІСТЬ", "", f"Період: {payload['start']} — {payload['end']}",
+             f"Учень: {payload['fio']}", "", "=" * 50, ""]
+    stats = subject_stats(payload)
+    all_values = [v for s in stats for v in s[5]]
+    if all_values:
+        lines += ["📊 ЗАГАЛЬНА СТАТИСТИКА", "",
+                  f"Середній бал: {sum(all_values) / len(all_values):.2f}",
+                  f"Всього оцінок: {len(all_values)}",
+                  f"Мінімальна: {_fmt(min(all_values))}",
+                  f"Максимальна: {_fmt(max(all_values))}", "", "=" * 50, "",
+                  "📚 СТАТИСТИКА ПО ПРЕДМЕТАМ", ""]
+        for name, avg, count, lo, hi, values in stats:
+            lines += [f"{name}:", f"  Середній бал: {avg:.2f}", f"  Кількість оцінок: {count}",
+                      f"  Мінімальна: {_fmt(lo)}, Максимальна: {_fmt(hi)}",
+                      f"  Оцінки: {', '.join(map(_fmt, values))}", ""]
+    return "\n".join(lines).encode('utf-8')
+
+
+_font_ready = None
+
+
+def _register_font() -> bool:
+    """Реєструє TTF-шрифт один раз на процес"""
+    global _font_ready
+    if _font_ready is None:
+        _font_ready = False
+        for path in FONT_CANDIDATES:
+            if path and os.path.exists(path):
+                try:
+                    pdfmetrics.registerFont(TTFont(FONT_NAME, path))
+                except Exception:
+                    continue
+                # <b> у Paragraph потребує жирного варіанта; якщо поруч його немає — звичайний
+                bold_path = path.replace('.ttf', '-Bold.ttf')
+                bold = FONT_NAME
+                if bold_path != path and os.path.exists(bold_path):
+                    try:
+                        pdfmetrics.registerFont(TTFont(BOLD_FONT_NAME, bold_path))
+                        bold = BOLD_FONT_NAME
+                    except Exception:
+                        pass
+                addMapping(FONT_NAME, 0, 0, FONT_NAME)
+                addMapping(FONT_NAME, 1, 0, bold)
+                addMapping(FONT_NAME, 0, 1, FONT_NAME)
+                addMapping(FONT_NAME, 1, 1, bold)
+                _font_ready = True
+                break
+    return _font_ready
+
+
+def _sparkline(values: list, width: float, height: float):
+    """Міні-графік оцінок предмета в порядку дат (шкала 1–12)"""
+    drawing = Drawing(width, height)
+    if len(values) >= 2:
+        step = width / (len(values) - 1)
+        points = []
+        for i, value in enumerate(values):
+            points += [i * step, 1 + (min(max(value, 1), 12) - 1) / 11 * (height - 2)]
+        drawing.add(PolyLine(points, strokeColor=colors.HexColor(ACCENT), strokeWidth=0.8))
+    return drawing
+
+
+def _trend_chart(months: list, width: float, height: float):
+    """Середній бал по місяцях"""
+    drawing = Drawing(width, height)
+    plot = LinePlot()
+    plot.x, plot.y = 25, 18
+    plot.width, plot.height = width - 35, height - 28
+    plot.data = [[(i, avg) for i, (_, avg) in enumerate(months)]]
+    plot.lines[0].strokeColor = colors.HexColor(ACCENT)
+    plot.lines[0].strokeWidth = 1.5
+    labels = [MONTH_LABELS[int(m[5:7]) - 1] for m, _ in months]
+    plot.xValueAxis.valueMin = 0
+    plot.xValueAxis.valueMax = max(1, len(months) - 1)
+    plot.xValueAxis.valueSteps = list(range(len(months)))
+    plot.xValueAxis.labelTextFormat = lambda v: labels[int(v)] if 0 <= int(v) < len(labels) else ''
+    plot.xValueAxis.labels.fontName = FONT_NAME
+    plot.yValueAxis.valueMin = 1
+    plot.yValueAxis.valueMax = 12
+    plot.yValueAxis.valueSteps = [1, 4, 7, 10, 12]
+    plot.yValueAxis.labels.fontName = FONT_NAME
+    drawing.add(plot)
+    return drawing
+
+
+def render_report_pdf(payload: dict) -> bytes:
+    """PDF: загальна статистика, графік по місяцях, таблиця предметів з динамікою, усі оцінки"""
+    title = ParagraphStyle('title', fontName=FONT_NAME, fontSize=16, leading=20, spaceAfter=4)
+    heading = ParagraphStyle('heading', fontName=FONT_NAME, fontSize=12, leading=15, spaceBefore=8, spaceAfter=4)
+    body = ParagraphStyle('body', fontName=FONT_NAME, fontSize=9, leading=11)
+
+    stats = subject_stats(payload)
+    all_values = [v for s in stats for v in s[5]]
+    page_width = A4[0] - 30 * mm
+
+    story = [
+        Paragraph('Звіт про успішність', title),
+        Paragraph(f"Учень: {_esc(payload['fio'])}<br/>Період: {payload['start']} — {payload['end']}", body),
+        Spacer(1, 4 * mm),
+    ]
+    if all_values:
+        story.append(Paragraph(
+            f"Середній бал: <b>{sum(all_values) / len(all_values):.2f}</b> · Оцінок: {len(all_values)} · "
+            f"Мін: {_fmt(min(all_values))} · Макс: {_fmt(max(all_values))}", body))
+    months = monthly_averages(payload)
+    if len(months) >= 2:
+        story += [Paragraph('Середній бал по місяцях', heading), _trend_chart(months, page_width, 55 * mm)]
+
+    if stats:
+        story.append(Paragraph('Предмети', heading))
+        rows = [['Предмет', 'Середній', 'Оцінок', 'Мін', 'Макс', 'Динаміка']]
+        for name, avg, count, lo, hi, values in stats:
+            rows.append([Paragraph(_esc(name), body), f"{avg:.2f}", str(count), _fmt(lo), _fmt(hi),
+                         _sparkline(values, 35 * mm, 6 * mm)])
+        table = Table(rows, colWidths=[page_width - 105 * mm, 18 * mm, 16 * mm, 14 * mm, 14 * mm, 43 * mm],
+                      repeatRows=1)
+        table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), FONT_NAME),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(ACCENT)),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f1f5f9')]),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#cbd5e1')),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ALIGN', (1, 0), (4, -1), 'CENTER'),
+        ]))
+        story.append(table)
+
+        story.append(Paragraph('Усі оцінки', heading))
+        for name, rows_ in payload['subjects'].items():
+            marks = ', '.join(r[0] for r in rows_)
+            story.append(Paragraph(f"<b>{_esc(name)}</b>: {_esc(marks)}", body))
+
+    out = io.BytesIO()
+    doc = SimpleDocTemplate(out, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm,
+                            topMargin=15 * mm, bottomMargin=15 * mm,
+                            title='Звіт про успішність', author='NZ.UA bot')
+    doc.build(story)
+    return out.getvalue()
+
+
+def render_report(payload: dict):
+    """(ext, data): 'pdf', якщо доступні reportlab і шрифт, інакше 'txt'"""
+    if REPORTLAB_AVAILABLE and _register_font():
+        return 'pdf', render_report_pdf(payload)
+    return 'txt', render_report_text(payload)
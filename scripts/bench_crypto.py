@@ -0,0 +1,65 @@
+"""Мікробенчмарк шифрування полів сесії: Fernet (старий формат) проти v2 (AES-GCM).
+
+Запуск з кореня репозиторію:  python scripts/bench_crypto.py [кількість_користувачів]
+"""
+import secrets
+import string
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cryptography.fernet import Fernet  # noqa: E402
+
+from field_crypto import FieldCipher  # noqa: E402
+
+REPEAT = 5
+NUMBER = 2000
+
+
+def _random_text(n: int) -> str:
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(alphabet) for _ in range(n))
+
+
+def _best_us(fn) -> float:
+    return min(timeit.repeat(fn, repeat=REPEAT, number=NUMBER)) / NUMBER * 1e6
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    key = Fernet.generate_key()
+    fernet = Fernet(key)
+    cipher = FieldCipher(key)
+
+    # Розміри як у таблиці sessions: короткий пароль і JWT access_token
+    samples = {'password': _random_text(12), 'token': _random_text(600)}
+
+    totals = {'fernet': 0.0, 'v2': 0.0}
+    print(f"{'field':<10}{'op':<10}{'fernet, us':>12}{'v2, us':>10}{'speedup':>10}")
+    for name, value in samples.items():
+        old_ct = fernet.encrypt(value.encode()).decode()
+        new_ct = cipher.encrypt(value)
+        assert cipher.decrypt(old_ct) == value and cipher.decrypt(new_ct) == value
+
+        enc_old = _best_us(lambda: fernet.encrypt(value.encode()).decode())
+        enc_new = _best_us(lambda: cipher.encrypt(value))
+        dec_old = _best_us(lambda: fernet.decrypt(old_ct.encode()).decode())
+        dec_new = _best_us(lambda: cipher.decrypt(new_ct))
+        totals['fernet'] += dec_old
+        totals['v2'] += dec_new
+
+        for op, a, b in (('encrypt', enc_old, enc_new), ('decrypt', dec_old, dec_new)):
+            print(f"{name:<10}{op:<10}{a:>12.2f}{b:>10.2f}{a / b:>9.2f}x")
+        print(f"{'':<10}{'size':<10}{len(old_ct):>12}{len(new_ct):>10}")
+
+    # Розсилки/нагадування дешифрують пароль і токен кожного користувача
+    print()
+    print(f"Sweep over {users} users (2 fields each, cold cache):")
+    print(f"  fernet: {totals['fernet'] * users / 1000:.1f} ms")
+    print(f"  v2:     {totals['v2'] * users / 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Знеособлені фікстури сторінок NZ.UA для бенчмарків парсерів.
+
+Сторінки генеруються детерміновано (фіксований seed) за структурою реальних відповідей,
+але з вигаданими ПІБ та оцінками. Зберегти на диск для перегляду:
+
+    python scripts/bench_fixtures.py --dump fixtures/
+"""
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+SUBJECTS = [
+    'Українська мова', 'Українська література', 'Зарубіжна література', 'Англійська мова',
+    'Німецька мова', 'Алгебра', 'Геометрія', 'Фізика', 'Хімія', 'Біологія', 'Географія',
+    'Історія України', 'Всесвітня історія', 'Правознавство', 'Інформатика', 'Мистецтво',
+    'Фізична культура', 'Захист України', 'Технології', 'Основи здоров\'я', 'Астрономія',
+    'Економіка', 'Громадянська освіта', 'Польська мова',
+]
+TEACHERS = [
+    'Коваленко Олена Петрівна', 'Шевчук Ірина Василівна', 'Бондар Тетяна Миколаївна',
+    'Мельник Наталія Іванівна', 'Ткаченко Оксана Степанівна', 'Кравець Людмила Андріївна',
+]
+STUDENT = 'Іваненко Марія Олегівна'
+MARK_TYPES = ['Поточна', 'Тематична', 'Зошит', 'Контрольна робота', 'Практичне заняття', 'Семестрова']
+MONTHS_GEN = ['січня', 'лютого', 'березня', 'квітня', 'травня', 'червня',
+              'липня', 'серпня', 'вересня', 'жовтня', 'листопада', 'грудня']
+
+YEAR_START = date(2025, 9, 1)
+
+
+def _rng(seed: int) -> random.Random:
+    return random.Random(seed)
+
+
+def _page(body: str, padding_kb: int = 0) -> str:
+    """Обгортка сторінки з шапкою/скриптами, як на сайті (щоб парсери бачили реальний обсяг)"""
+    scripts = ''.join(
+        f'<script>window.__cfg{i} = {{"k": "{"x" * 900}"}};</script>\n' for i in range(padding_kb)
+    )
+    return (
+        '<!DOCTYPE html><html lang="uk"><head><meta charset="utf-8">'
+        '<meta name="csrf-param" content="_csrf">'
+        '<meta name="csrf-token" content="bench-csrf-token-0123456789abcdef">'
+        f'<title>НЗ.УА</title>{scripts}</head><body>'
+        '<header class="header"><nav><a href="/dashboard">Головна</a><a href="/news">Новини</a></nav></header>'
+        f'<main class="content">{body}</main>'
+        '<footer class="footer">© НЗ.УА</footer></body></html>'
+    )
+
+
+def grades_statement_page(subjects: int = 12, marks_per_subject: int = 25, seed: int = 1) -> str:
+    """Сторінка 'Виписка оцінок' з table.marks-report"""
+    rng = _rng(seed)
+    rows = []
+    for i, subj in enumerate((SUBJECTS * 2)[:subjects], start=1):
+        marks = []
+        for _ in range(marks_per_subject):
+            day = YEAR_START + timedelta(days=rng.randrange(0, 270))
+            value = rng.choice(['Н'] + [str(v) for v in range(1, 13)] * 3)
+            if rng.random() < 0.3:
+                marks.append(f'{value} ({day.day} {MONTHS_GEN[day.month - 1]} {day.year}, {rng.choice(MARK_TYPES)})')
+            else:
+                marks.append(f'{value} ({day.strftime("%d.%m.%Y")})')
+        rows.append(f'<tr><td>{i}</td><td>{subj}</td><td>{", ".join(marks)}</td></tr>')
+    body = (
+        '<h1>Виписка оцінок</h1>'
+        '<form id="classselectform"><input type="text" id="classselectform-date_from" name="date_from" value="2025-09-01">'
+        '<input type="text" id="classselectform-date_to" name="date_to" value="2026-05-31"></form>'
+        '<p>Оберіть діапазон дат: 2025-09-01 по 2026-05-31</p>'
+        '<h3>Отримані результати</h3>'
+        '<table class="table table-bordered marks-report"><thead><tr><th>№</th><th>Предмет</th><th>Оцінки</th></tr></thead>'
+        f'<tbody>{"".join(rows)}</tbody></table>'
+    )
+    return _page(body, padding_kb=20)
+
+
+def news_page(items: int = 30, seed: int = 2) -> str:
+    """Текстовий варіант блоку 'Мої новини' (вхід для parse_news_from_html)"""
+    rng = _rng(seed)
+    lines = ['Мої новини']
+    for _ in range(items):
+        day = YEAR_START + timedelta(days=rng.randrange(0, 270))
+        teacher = rng.choice(TEACHERS)
+        grade = rng.choice(['Н'] + [str(v) for v in range(1, 13)])
+        subj = rng.choice(SUBJECTS)
+        kind = rng.choice(MARK_TYPES)
+        action = 'Оцінка змінена на' if rng.random() < 0.15 else 'Ви отримали оцінку'
+        lines.append(
+            f'{teacher} {STUDENT} {day.day} {MONTHS_GEN[day.month - 1]} о {rng.randrange(8, 16)}:{rng.randrange(60):02d} '
+            f'{action} {grade} з предмету: {subj}, {kind}'
+        )
+    lines.append(f'Показано новин: {items}')
+    return _page('<div class="news">' + '\n'.join(lines) + '</div>', padding_kb=10)
+
+
+def news_list_page(items: int = 30, seed: int = 5) -> str:
+    """Сторінка новин з div#school-news-list (основний шлях news_cmd)"""
+    rng = _rng(seed)
+    out = []
+    for i in range(items):
+        day = YEAR_START + timedelta(days=rng.randrange(0, 270))
+        if rng.random() < 0.8:
+            action = 'Оцінка змінена на' if rng.random() < 0.15 else 'Ви отримали оцінку'
+            desc = (f'{action} {rng.choice(["Н"] + [str(v) for v in range(1, 13)])} '
+                    f'з предмету: {rng.choice(SUBJECTS)}, {rng.choice(MARK_TYPES)}')
+        else:
+            desc = f'Нове <a href="/distance/{i}">Дистанційне завдання</a><br>з предмету {rng.choice(SUBJECTS)}'
+        out.append(
+            '<div class="news-page__item"><div class="news-page__header">'
+            f'<span class="news-page__name">{rng.choice(TEACHERS)}</span>'
+            f'<span class="news-page__date">{day.day} {MONTHS_GEN[day.month - 1]} о {rng.randrange(8, 16)}:{rng.randrange(60):02d}</span>'
+            f'</div><div class="news-page__desc">{desc}</div></div>'
+        )
+    body = f'<h1>Мої новини</h1><div id="school-news-list">{"".join(out)}</div><div class="pager">Показано новин: {items}</div>'
+    return _page(body, padding_kb=20)
+
+
+def report_card_page(subjects: int = 18, seed: int = 3) -> str:
+    """Сторінка табеля з h2 'Табель успішності'"""
+    rng = _rng(seed)
+    rows = ['<tr><th>Предмети</th><th>1 семестр</th><th>2 семестр</th><th>Річні</th></tr>',
+            '<tr><td colspan="4">Інваріантна складова</td></tr>']
+    for subj in (SUBJECTS * 3)[:subjects]:
+        s1 = rng.choice(['', 'зар.'] + [str(v) for v in range(4, 13)] * 2)
+        rows.append(f'<tr><td>{subj}</td><td>{s1}</td><td></td><td></td></tr>')
+    rows.append('<tr><td>Кількість пропущених навчальних днів</td><td>12</td><td></td><td></td></tr>')
+    body = f'<h2>Табель успішності</h2><table class="table">{"".join(rows)}</table>'
+    return _page(body, padding_kb=10)
+
+
+def login_page(padding_kb: int = 40) -> str:
+    """Сторінка логіну з meta csrf-token і прихованим _csrf у формі"""
+    body = (
+        '<div class="login-box"><form id="login-form" action="/login" method="post">'
+        '<input type="hidden" name="_csrf" value="bench-form-csrf-fedcba9876543210">'
+        '<input type="text" name="LoginForm[login]"><input type="password" name="LoginForm[password]">'
+        '<input type="checkbox" name="LoginForm[rememberMe]" value="1">'
+        '<button type="submit">Увійти</button></form></div>'
+    )
+    return _page(body, padding_kb=padding_kb)
+
+
+def diary_tasks(lessons: int = 8, seed: int = 4) -> list:
+    """Записи щоденника (поле tasks) для split_diary_tasks"""
+    rng = _rng(seed)
+    out = []
+    for i in range(lessons):
+        parts = [f'Поточна: Тема уроку {i + 1}. {rng.choice(SUBJECTS)}', rng.choice(['Н', '7', '11', '']),
+                 f'Д/з: §{rng.randrange(1, 40)}, вправи {rng.randrange(1, 300)}-{rng.randrange(300, 400)}']
+        if rng.random() < 0.5:
+            parts.append('Підготуватися до контрольної роботи\nПовторити формули')
+        out.append('\n'.join(parts))
+    return out
+
+
+# name -> (realistic kwargs, stress kwargs)
+SIZES = {
+    'grades': ({'subjects': 12, 'marks_per_subject': 25}, {'subjects': 20, 'marks_per_subject': 160}),
+    'news': ({'items': 30}, {'items': 600}),
+    'news_list': ({'items': 30}, {'items': 600}),
+    'report_card': ({'subjects': 18}, {'subjects': 60}),
+    'login': ({'padding_kb': 40}, {'padding_kb': 400}),
+    'diary': ({'lessons': 8}, {'lessons': 400}),
+}
+GENERATORS = {
+    'grades': grades_statement_page,
+    'news': news_page,
+    'news_list': news_list_page,
+    'report_card': report_card_page,
+    'login': login_page,
+    'diary': diary_tasks,
+}
+
+
+def build_all() -> dict:
+    """{'grades/realistic': payload, 'grades/stress': payload, ...}"""
+    out = {}
+    for name, (realistic, stress) in SIZES.items():
+        out[f'{name}/realistic'] = GENERATORS[name](**realistic)
+        out[f'{name}/stress'] = GENERATORS[name](**stress)
+    return out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--dump':
+        target = Path(sys.argv[2])
+        target.mkdir(parents=True, exist_ok=True)
+        for key, payload in build_all().items():
+            ext = 'txt' if isinstance(payload, list) else 'html'
+            text = '\n---\n'.join(payload) if isinstance(payload, list) else payload
+            path = target / f"{key.replace('/', '_')}.{ext}"
+            path.write_text(text, encoding='utf-8')
+            print(f"{path}  {len(text.encode('utf-8')) / 1024:.1f} KB")
+    else:
+        print(__doc__)
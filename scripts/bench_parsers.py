@@ -0,0 +1,163 @@
+"""Бенчмарк гарячих парсерів бота на знеособлених фікстурах (scripts/bench_fixtures.py).
+
+Для кожного кейсу міряє час на виклик, кількість блоків пам'яті, що лишаються після
+виклику (алокації результату), та піковий приріст пам'яті під час виклику (tracemalloc).
+
+    python scripts/bench_parsers.py                       # таблиця в консоль
+    python scripts/bench_parsers.py --save before.json    # зберегти результати
+    python scripts/bench_parsers.py --compare before.json # порівняти з попереднім запуском
+    python scripts/bench_parsers.py --filter grades       # лише кейси з 'grades' у назві
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'scripts'))
+
+import bench_fixtures  # noqa: E402
+
+MIN_RUN_SECONDS = 0.3
+REPEAT = 5
+
+
+def _import_main(workdir: str):
+    """Імпортує main.py з БД і файлом ключа у workdir, щоб не чіпати робочі (зокрема /data на сервері)"""
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+    os.environ['DB_FILE'] = os.path.join(workdir, 'data', 'bench.db')
+    os.environ['ENCRYPTION_KEY_FILE'] = os.path.join(workdir, 'data', 'bench.key')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main
+    finally:
+        os.chdir(cwd)
+    return main
+
+
+def build_cases(main) -> list:
+    """[(name, fn, payload, payload_kb)]"""
+    from login_form import extract_login_form
+    from report_card_parser import parse_report_card
+
+    targets = {
+        'grades': main.parse_grades_from_html,
+        'news': main.parse_news_from_html,
+        'news_list': lambda page: main.parse_news_page(page)[0],
+        'report_card': parse_report_card,
+        'login': lambda page: extract_login_form(page).csrf,
+        'diary': main.split_diary_tasks,
+    }
+    cases = []
+    for key, payload in bench_fixtures.build_all().items():
+        name = key.split('/')[0]
+        size = sum(len(p) for p in payload) if isinstance(payload, list) else len(payload)
+        cases.append((key, targets[name], payload, size / 1024))
+    return cases
+
+
+def measure(fn, payload) -> dict:
+    # Глушимо stdout, щоб не міряти консоль
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink):
+        fn(payload)  # прогрів
+
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn(payload)
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_RUN_SECONDS / REPEAT or number >= 1 << 16:
+                break
+            number *= 2
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn(payload)
+            timings.append((time.perf_counter() - start) / number)
+            sink.seek(0)
+            sink.truncate()
+
+        gc.collect()
+        tracemalloc.start()
+        base_current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        result = fn(payload)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    allocs = sum(s.count_diff for s in after.compare_to(before, 'filename') if s.count_diff > 0)
+    del result
+    timings.sort()
+    return {
+        'us_per_call': timings[len(timings) // 2] * 1e6,
+        'best_us': timings[0] * 1e6,
+        'allocs': allocs,
+        'peak_kb': (peak - base_current) / 1024,
+        'retained_kb': (current - base_current) / 1024,
+    }
+
+
+def run(args, bot):
+    baseline = {}
+    if args.compare:
+        baseline = {r['case']: r for r in json.loads(Path(args.compare).read_text(encoding='utf-8'))['results']}
+
+    header = f"{'case':<22}{'input KB':>10}{'us/call':>12}{'allocs':>9}{'peak KB':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    for name, fn, payload, size_kb in build_cases(bot):
+        if args.filter and args.filter not in name:
+            continue
+        row = {'case': name, 'input_kb': round(size_kb, 1), **measure(fn, payload)}
+        results.append(row)
+        line = (f"{name:<22}{size_kb:>10.1f}{row['us_per_call']:>12.1f}"
+                f"{row['allocs']:>9}{row['peak_kb']:>10.1f}")
+        if name in baseline:
+            line += f"{baseline[name]['us_per_call'] / row['us_per_call']:>9.2f}x"
+        print(line)
+
+    if args.save:
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }
+        Path(args.save).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\nSaved {len(results)} results to {args.save}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', help='зберегти результати у JSON')
+    parser.add_argument('--compare', help='JSON попереднього запуску для порівняння')
+    parser.add_argument('--filter', default='', help='запускати лише кейси, що містять підрядок')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='nzbench-') as workdir:
+        run(args, _import_main(workdir))
+
+
+if __name__ == '__main__':
+    main()